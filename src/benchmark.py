@@ -0,0 +1,1306 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import copy
+from datetime import datetime, timezone
+import costco
+import extract
+import fetcher
+import franchises
+from franchises import FranchiseSource
+import gc
+import heapq
+import helpers
+from history import PriceHistory
+import json
+import jsonstream
+from loguru import logger
+import logsink
+import math
+import merge
+import metrics
+import multiprocessing
+from multiprocessing import Pool
+import normalize
+import os
+import random
+import refresh
+import requests
+import samsclub
+import serializers
+import spatial
+from store import StationPriceStore
+import stubserver
+import tempfile
+import time
+import tracemalloc
+
+
+_states = ("AL", "AZ", "CA", "FL", "GA", "IL", "NY", "PR", "TX", "WA")
+
+
+def make_synthetic_stations(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    now = helpers.now_in_epoch_ms()
+    stations = []
+    for i in range(count):
+        franchise_name = "COSTCO" if i % 4 else "SAMS_CLUB"
+
+        def price():
+            return {
+                "timestamp": now - rng.randrange(86_400_000),
+                "price": round(rng.uniform(2.5, 6.5), 2),
+            }
+
+        stations.append(
+            {
+                "franchiseName": franchise_name,
+                "name": "Synthetic Station {i}".format(i=i),
+                "streetAddress": "{i} Synthetic Way".format(i=i),
+                "city": "City {n}".format(n=i % 997),
+                "state": _states[i % len(_states)],
+                "postalCode": "{zip:05d}".format(zip=i % 100_000),
+                "latitude": round(rng.uniform(18.0, 48.0), 3),
+                "longitude": round(rng.uniform(-124.0, -66.0), 3),
+                "currencySymbol": "$",
+                "regularPrice": price(),
+                "midGradePrice": price() if franchise_name == "SAMS_CLUB" else None,
+                "premiumPrice": price(),
+                "dieselPrice": price() if i % 3 == 0 else None,
+            }
+        )
+    return stations
+
+
+def make_synthetic_warehouse_page(rng: random.Random, filler_kb: int = 200) -> str:
+    grades = [("Regular", rng.uniform(3, 5)), ("Premium", rng.uniform(4, 6))]
+    if rng.random() < 0.3:
+        grades.append(("Diesel", rng.uniform(4, 6)))
+    gas_prices = "".join(
+        '<div><span class="gas-type">{grade}</span>'
+        "<span>${dollars_and_cents}<sup>9</sup></span></div>".format(
+            grade=grade, dollars_and_cents="{price:.2f}".format(price=price)
+        )
+        for grade, price in grades
+    )
+    # Real warehouse pages are mostly navigation, scripts, and other departments
+    filler_div = '<div class="nav-item"><a href="/department.html">Department</a></div>'
+    filler = filler_div * (filler_kb * 1024 // len(filler_div))
+    return (
+        "<!DOCTYPE html><html><head><title>Warehouse</title></head><body>"
+        '<div class="header">{filler}</div>'
+        '<div class="gas-station"><div class="gas-price-section">{gas_prices}</div></div>'
+        "</body></html>"
+    ).format(filler=filler, gas_prices=gas_prices)
+
+
+def write_synthetic_warehouse_pages(pages_dir: str, count: int) -> list:
+    """
+    Writes count synthetic warehouse pages to pages_dir and returns Costco URL objects
+    for them, with paths that the stub server maps back to the saved pages.
+    """
+    rng = random.Random(0)
+    url_objects = []
+    for i in range(count):
+        page_file_name = "synthetic-{i}.html".format(i=i)
+        with open(os.path.join(pages_dir, page_file_name), "w") as page_file:
+            page_file.write(make_synthetic_warehouse_page(rng))
+        url_objects.append(
+            {
+                "name": "Synthetic {i}".format(i=i),
+                "streetAddress": "{i} Synthetic Way".format(i=i),
+                "city": "Synthetic",
+                "state": _states[i % len(_states)],
+                "postalCode": "00000",
+                "latitude": 0.0,
+                "longitude": 0.0,
+                "url": "/warehouse-locations/" + page_file_name,
+            }
+        )
+    return url_objects
+
+
+def make_synthetic_clubfinder_payload(count: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    grade_names = ("UNLEAD", "MIDGRAD", "PREMIUM", "DIESEL")
+    clubs = [
+        {
+            "id": str(i),
+            "name": "Synthetic Club {i}".format(i=i),
+            "address": {
+                "address1": "{i} Synthetic Blvd".format(i=i),
+                "city": "City {n}".format(n=i % 997),
+                "state": _states[i % len(_states)],
+                "postalCode": "{zip:05d}".format(zip=i % 100_000),
+            },
+            "geoPoint": {
+                "latitude": rng.uniform(18.0, 48.0),
+                "longitude": rng.uniform(-124.0, -66.0),
+            },
+            "gasPrices": [
+                {"name": grade_name, "price": round(rng.uniform(2.5, 6.5), 3)}
+                for grade_name in grade_names
+            ],
+            # Real clubs carry hours, services, and more that normalization ignores
+            "operationalHours": {
+                day: {"startHr": "10:00", "endHr": "20:00"}
+                for day in ("monday", "tuesday", "wednesday", "thursday", "friday")
+            },
+            "services": [{"name": "SERVICE_{n}".format(n=n)} for n in range(20)],
+        }
+        for i in range(count)
+    ]
+    return json.dumps(clubs).encode("utf-8")
+
+
+def _measure_samsclub_parse(mode: str, payload_file_name: str) -> dict:
+    # Runs in a fresh process so peak RSS only reflects this mode
+    logger.disable("samsclub")
+    start = time.perf_counter()
+    if mode == "loads":
+        # The old path: the whole payload as one string, loaded all at once
+        with open(payload_file_name, "r") as payload_file:
+            records = iter(samsclub.normalize_data(json.loads(payload_file.read())))
+    else:
+
+        def chunks():
+            with open(payload_file_name, "rb") as payload_file:
+                while chunk := payload_file.read(64 * 1024):
+                    yield chunk
+
+        records = samsclub.iter_normalized_data(jsonstream.iter_array_items(chunks()))
+    next(records)
+    time_to_first_s = time.perf_counter() - start
+    count = 1 + sum(1 for _ in records)
+    return {
+        "count": count,
+        "time_to_first_s": time_to_first_s,
+        "total_time_s": time.perf_counter() - start,
+        "peak_rss_mb": metrics.peak_rss_mb()["self"],
+    }
+
+
+def _blocking_get(url: str) -> int:
+    return requests.get(url, headers={"User-Agent": helpers.user_agent}).status_code
+
+
+def _positional_merge_prices(curr_prices: list, new_prices: list) -> list:
+    # The original merge_prices, kept only as a baseline to benchmark against
+    merged_prices = []
+    for new_station_state in new_prices:
+        if len(curr_prices) == 0:
+            merged_prices.append(new_station_state)
+            continue
+        curr_station_state = curr_prices.pop(0)
+        merged_prices.append(merge.merge_station(curr_station_state, new_station_state))
+    return merged_prices
+
+
+def _time_call(fn, *fn_args) -> float:
+    # Like timeit, keep the collector from walking the synthetic data mid-measurement
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        fn(*fn_args)
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def bench_merge(args) -> None:
+    for size in args.sizes:
+        curr_prices = make_synthetic_stations(size, seed=1)
+        new_prices = make_synthetic_stations(size, seed=2)
+        # Simulate a refreshed station list: same stations, different order
+        shuffled_new_prices = new_prices[:]
+        random.Random(3).shuffle(shuffled_new_prices)
+        # Mispaired stations trip merge's diesel warning; keep that out of the timing
+        logger.disable("merge")
+        positional_time_s = _time_call(
+            _positional_merge_prices, copy.copy(curr_prices), shuffled_new_prices
+        )
+        keyed_time_s = _time_call(
+            merge.merge_prices_by_key, curr_prices, shuffled_new_prices
+        )
+        logger.enable("merge")
+        # The positional merge pairs the i-th current station with the i-th new one
+        mispaired_count = sum(
+            merge.station_key(curr_station) != merge.station_key(new_station)
+            for curr_station, new_station in zip(curr_prices, shuffled_new_prices)
+        )
+        logger.info(
+            "merge @ {size} stations: positional={positional_time_s:.3f} s ({mispaired_count} stations mispaired), keyed={keyed_time_s:.3f} s",
+            size=size,
+            positional_time_s=positional_time_s,
+            mispaired_count=mispaired_count,
+            keyed_time_s=keyed_time_s,
+        )
+
+
+def bench_fetch(args) -> None:
+    with tempfile.TemporaryDirectory() as pages_dir:
+        url_objects = write_synthetic_warehouse_pages(pages_dir, args.stations)
+        server = stubserver.start_stub_server(
+            pages_dir, latency_s=args.latency_ms / 1000
+        )
+        urls = [server.base_url + url_object["url"] for url_object in url_objects]
+        # Fetching is the only thing being measured here
+        logger.disable("fetcher")
+        with Pool(processes=args.pool_size) as p:
+            pool_time_s = _time_call(p.map, _blocking_get, urls)
+        logger.info(
+            "fetch {count} pages @ {latency_ms} ms latency: Pool({pool_size}) + requests.get={time_s:.3f} s",
+            count=len(urls),
+            latency_ms=args.latency_ms,
+            pool_size=args.pool_size,
+            time_s=pool_time_s,
+        )
+        for concurrency in args.concurrency:
+            # Effectively unlimited, so only the concurrency limit applies
+            async_time_s = _time_call(fetcher.fetch_all, urls, concurrency, 1_000_000)
+            logger.info(
+                "fetch {count} pages @ {latency_ms} ms latency: asyncio with concurrency {concurrency}={time_s:.3f} s",
+                count=len(urls),
+                latency_ms=args.latency_ms,
+                concurrency=concurrency,
+                time_s=async_time_s,
+            )
+        logger.enable("fetcher")
+        server.shutdown()
+
+
+def bench_ratelimit(args) -> None:
+    with tempfile.TemporaryDirectory() as pages_dir:
+        url_objects = write_synthetic_warehouse_pages(pages_dir, args.stations)
+        server = stubserver.start_stub_server(
+            pages_dir,
+            latency_s=args.latency_ms / 1000,
+            max_rate_per_s=args.server_max_rate,
+        )
+        urls = [server.base_url + url_object["url"] for url_object in url_objects]
+        start = time.perf_counter()
+        results = fetcher.fetch_all(urls, args.concurrency, args.client_max_rate)
+        time_s = time.perf_counter() - start
+        server.shutdown()
+    ok_count = sum(result.status_code == 200 for result in results)
+    logger.info(
+        "ratelimit: fetched {ok_count}/{count} pages in {time_s:.2f} s ({pages_per_s:.1f} pages/s vs. a server limit of {server_max_rate} requests/s), {throttled_count} requests throttled, {retry_count} retries",
+        ok_count=ok_count,
+        count=len(results),
+        time_s=time_s,
+        pages_per_s=ok_count / time_s,
+        server_max_rate=args.server_max_rate,
+        throttled_count=server.throttled_count,
+        retry_count=sum(max(0, result.attempts - 1) for result in results),
+    )
+
+
+def bench_samsclub_stream(args) -> None:
+    with tempfile.NamedTemporaryFile(suffix=".json") as payload_file:
+        payload_file.write(make_synthetic_clubfinder_payload(args.clubs))
+        payload_file.flush()
+        logger.info(
+            "Sam's Club payload with {count} clubs is {size_mb} MB",
+            count=args.clubs,
+            size_mb=os.path.getsize(payload_file.name) // (1024 * 1024),
+        )
+        for mode in ("loads", "stream"):
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                measurement = executor.submit(
+                    _measure_samsclub_parse, mode, payload_file.name
+                ).result()
+            logger.info(
+                "samsclub-stream with {mode}: {count} records, first after {time_to_first_s:.3f} s, all after {total_time_s:.3f} s, peak RSS {peak_rss_mb} MB",
+                mode=mode,
+                **measurement,
+            )
+
+
+def _read_corpus(corpus_dir: str) -> list:
+    pages = []
+    for page_file_name in sorted(os.listdir(corpus_dir)):
+        with open(os.path.join(corpus_dir, page_file_name), "r") as page_file:
+            pages.append(page_file.read())
+    return pages
+
+
+def bench_extract(args) -> None:
+    if args.corpus_dir is not None:
+        pages = _read_corpus(args.corpus_dir)
+    else:
+        rng = random.Random(0)
+        pages = [make_synthetic_warehouse_page(rng) for _ in range(args.pages)]
+    extracted_by_backend = {}
+    for backend, extract_fn in extract.backends.items():
+        start = time.perf_counter()
+        extracted_by_backend[backend] = [extract_fn(page) for page in pages]
+        time_s = time.perf_counter() - start
+        logger.info(
+            "extract {count} pages with {backend}: {pages_per_s:.1f} pages/s",
+            count=len(pages),
+            backend=backend,
+            pages_per_s=len(pages) / time_s,
+        )
+    # Every backend must extract exactly what html5lib does
+    for backend, extracted in extracted_by_backend.items():
+        mismatch_count = sum(
+            gas_prices != html5lib_gas_prices
+            for gas_prices, html5lib_gas_prices in zip(
+                extracted, extracted_by_backend["html5lib"]
+            )
+        )
+        if mismatch_count:
+            logger.error(
+                "{backend} disagrees with html5lib on {count} pages",
+                backend=backend,
+                count=mismatch_count,
+            )
+
+
+def _traced_mb(build, *build_args) -> float:
+    # Only counts what build leaves alive, not the peak while building it
+    gc.collect()
+    tracemalloc.start()
+    try:
+        kept = build(*build_args)
+        gc.collect()
+        traced_bytes, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del kept
+    return traced_bytes / (1024 * 1024)
+
+
+def bench_store_memory(args) -> None:
+    for size in args.sizes:
+        dicts_mb = _traced_mb(make_synthetic_stations, size)
+        store_mb = _traced_mb(
+            lambda count: StationPriceStore.from_records(
+                make_synthetic_stations(count)
+            ),
+            size,
+        )
+        stations = make_synthetic_stations(size)
+        if StationPriceStore.from_records(stations).to_records() != stations:
+            raise RuntimeError(
+                "The store's records don't match the stations it was built from"
+            )
+        logger.info(
+            "store @ {size} stations: dicts={dicts_mb:.1f} MB, columnar={store_mb:.1f} MB ({ratio:.1f}x smaller)",
+            size=size,
+            dicts_mb=dicts_mb,
+            store_mb=store_mb,
+            ratio=dicts_mb / store_mb,
+        )
+
+
+def bench_serializers(args) -> None:
+    for size in args.sizes:
+        stations = make_synthetic_stations(size)
+        for serializer in serializers.serializers.values():
+            data = serializer.encode(stations)
+            if serializer.decode(data) != stations:
+                raise RuntimeError(
+                    "{format} doesn't round-trip the stations".format(
+                        format=serializer.name
+                    )
+                )
+            logger.info(
+                "serializers @ {size} stations, {format}: size={size_kb:.0f} KB, encode={encode_time_s:.3f} s, decode={decode_time_s:.3f} s",
+                size=size,
+                format=serializer.name,
+                size_kb=len(data) / 1024,
+                encode_time_s=_time_call(serializer.encode, stations),
+                decode_time_s=_time_call(serializer.decode, data),
+            )
+        binary_data = serializers.serializers["binary"].encode(stations)
+        logger.info(
+            "serializers @ {size} stations, binary into a StationPriceStore: decode={decode_time_s:.3f} s",
+            size=size,
+            decode_time_s=_time_call(serializers.read_binary_store, binary_data),
+        )
+
+
+def _collect_synthetic_samsclub(url: str, startup_s: float):
+    # Stands in for launching Firefox and loading the clubfinder API through it
+    time.sleep(startup_s)
+    with requests.get(url, stream=True) as resp:
+        yield from samsclub.iter_normalized_data(
+            jsonstream.iter_array_items(resp.iter_content(64 * 1024))
+        )
+
+
+def _dispatch_synthetic_item(item: dict):
+    # The original scraper's dispatcher: one Pool.map item per Costco page, plus one
+    # for all of Sam's Club
+    match item["franchise_name"]:
+        case "COSTCO":
+            html = requests.get(item["url"]).text
+            return [costco.normalize_html(item, html)]
+        case "SAMS_CLUB":
+            return list(_collect_synthetic_samsclub(item["url"], item["startup_s"]))
+
+
+def bench_franchises(args) -> None:
+    with tempfile.TemporaryDirectory() as pages_dir:
+        url_objects = write_synthetic_warehouse_pages(pages_dir, args.stations)
+        with open(os.path.join(pages_dir, "clubfinder.json"), "wb") as payload_file:
+            payload_file.write(make_synthetic_clubfinder_payload(args.clubs))
+        server = stubserver.start_stub_server(
+            pages_dir, latency_s=args.latency_ms / 1000
+        )
+        for url_object in url_objects:
+            url_object["url"] = server.base_url + url_object["url"]
+        samsclub_url = server.base_url + "/clubfinder.json"
+        startup_s = args.samsclub_startup_ms / 1000
+        for logger_name in ("costco", "fetcher", "samsclub", "franchises", "pipeline"):
+            logger.disable(logger_name)
+
+        items = [
+            {"franchise_name": "SAMS_CLUB", "url": samsclub_url, "startup_s": startup_s}
+        ] + [{**url_object, "franchise_name": "COSTCO"} for url_object in url_objects]
+        with Pool(processes=args.pool_size) as p:
+            start = time.perf_counter()
+            barrier_count = sum(
+                len(stations) for stations in p.map(_dispatch_synthetic_item, items)
+            )
+            barrier_time_s = time.perf_counter() - start
+
+        sources = [
+            FranchiseSource(
+                "COSTCO",
+                lambda args, pool, response_cache: costco.iter_normalized_data(
+                    url_objects,
+                    args.concurrency,
+                    1_000_000,
+                    pool,
+                    queue_size=2 * args.pool_size,
+                ),
+                open_executor=lambda args: Pool(processes=args.pool_size),
+            ),
+            FranchiseSource(
+                "SAMS_CLUB",
+                lambda args, executor, response_cache: _collect_synthetic_samsclub(
+                    samsclub_url, startup_s
+                ),
+            ),
+        ]
+        start = time.perf_counter()
+        scheduled_count = sum(1 for _ in franchises.iter_all_stations(sources, args))
+        scheduled_time_s = time.perf_counter() - start
+
+        for logger_name in ("costco", "fetcher", "samsclub", "franchises", "pipeline"):
+            logger.enable(logger_name)
+        server.shutdown()
+    logger.info(
+        "franchises @ {stations} Costco pages + {clubs} Sam's Clubs: Pool({pool_size}).map(dispatcher)={barrier_time_s:.3f} s ({barrier_count} stations), franchise scheduler={scheduled_time_s:.3f} s ({scheduled_count} stations)",
+        stations=args.stations,
+        clubs=args.clubs,
+        pool_size=args.pool_size,
+        barrier_time_s=barrier_time_s,
+        barrier_count=barrier_count,
+        scheduled_time_s=scheduled_time_s,
+        scheduled_count=scheduled_count,
+    )
+
+
+def make_synthetic_price_history(
+    count: int, runs: int, interval_h: float, seed: int = 0
+) -> list:
+    # A few stations change price every few hours, most only every day or two
+    rng = random.Random(seed)
+    stations = make_synthetic_stations(count, seed=seed)
+    changes_per_h = [
+        rng.uniform(0.2, 0.5) if rng.random() < 0.2 else rng.uniform(0.01, 0.04)
+        for _ in stations
+    ]
+    snapshots = []
+    for _ in range(runs):
+        snapshot = {}
+        for i, station in enumerate(stations):
+            if rng.random() < 1 - math.exp(-changes_per_h[i] * interval_h):
+                station = {
+                    **station,
+                    "regularPrice": {
+                        "timestamp": station["regularPrice"]["timestamp"],
+                        "price": round(rng.uniform(2.5, 6.5), 2),
+                    },
+                }
+                stations[i] = station
+            snapshot[merge.station_key(station)] = station
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def _read_price_history(history_dir: str) -> list:
+    snapshots = []
+    for file_name in sorted(os.listdir(history_dir)):
+        with open(os.path.join(history_dir, file_name), "r") as snapshot_file:
+            snapshots.append(
+                {
+                    merge.station_key(station): station
+                    for station in json.loads(snapshot_file.read())
+                }
+            )
+    return snapshots
+
+
+def _simulate_refresh(
+    snapshots: list, interval_h: float, request_budget: int, policy: str
+) -> float:
+    """
+    Replays a price history with one run per snapshot, fetching request_budget
+    stations per run, and returns the mean fraction of stations whose served prices
+    were stale.
+    """
+    histories = {}
+    served_prices = {}
+    stale_fraction_total = 0.0
+    logger.disable("refresh")
+    for run, snapshot in enumerate(snapshots):
+        now_ms = int(run * interval_h * 3_600_000)
+        keys = list(snapshot)
+        if policy == "volatility":
+            to_fetch = refresh.plan_refresh(
+                keys, histories, request_budget, now_ms
+            ).to_fetch
+        else:
+            # Round robin: whatever was fetched longest ago, after any station that
+            # was never fetched, just like the scheduler
+            unknown_keys = [key for key in keys if key not in histories]
+            to_fetch = (
+                unknown_keys
+                + sorted(
+                    (key for key in keys if key in histories),
+                    key=lambda key: histories[key]["lastFetchedAt"],
+                )
+            )[:request_budget]
+        for key in to_fetch:
+            refresh.record_fetch(histories, key, snapshot[key], now_ms)
+            served_prices[key] = histories[key]["prices"]
+        stale_fraction_total += sum(
+            served_prices.get(key) != refresh.station_prices(station)
+            for key, station in snapshot.items()
+        ) / len(snapshot)
+    logger.enable("refresh")
+    return stale_fraction_total / len(snapshots)
+
+
+def bench_refresh(args) -> None:
+    if args.history_dir is not None:
+        snapshots = _read_price_history(args.history_dir)
+    else:
+        snapshots = make_synthetic_price_history(
+            args.stations, args.runs, args.interval_hours
+        )
+    station_count = len(snapshots[0])
+    for budget_fraction in args.budget_fractions:
+        request_budget = int(station_count * budget_fraction)
+        stale_fraction_by_policy = {
+            policy: _simulate_refresh(
+                snapshots, args.interval_hours, request_budget, policy
+            )
+            for policy in ("round-robin", "volatility")
+        }
+        logger.info(
+            "refresh over {runs} runs of {count} stations with {request_budget} requests/run: stale prices served round-robin={round_robin:.1%}, volatility={volatility:.1%}",
+            runs=len(snapshots),
+            count=station_count,
+            request_budget=request_budget,
+            round_robin=stale_fraction_by_policy["round-robin"],
+            volatility=stale_fraction_by_policy["volatility"],
+        )
+
+
+def bench_history(args) -> None:
+    stations = make_synthetic_stations(args.stations)
+    rng = random.Random(0)
+    end_ms = helpers.now_in_epoch_ms()
+    interval_ms = 86_400_000 // args.runs_per_day
+    run_count = args.days * args.runs_per_day
+    with tempfile.TemporaryDirectory() as db_dir:
+        db_file_name = os.path.join(db_dir, "history.db")
+        price_history = PriceHistory(db_file_name)
+        logger.disable("history")
+        start = time.perf_counter()
+        for run in range(run_count):
+            timestamp = end_ms - (run_count - run) * interval_ms
+            price_history.ingest(
+                {
+                    **station,
+                    **{
+                        price_key: {
+                            "timestamp": timestamp,
+                            "price": round(rng.uniform(2.5, 6.5), 2),
+                        }
+                        for price_key in merge.price_keys
+                        if station[price_key] is not None
+                    },
+                }
+                for station in stations
+            )
+        ingest_time_s = time.perf_counter() - start
+        logger.enable("history")
+        observation_count = price_history.connection.execute(
+            "SELECT COUNT(*) FROM observations"
+        ).fetchone()[0]
+        station_key = merge.station_key(stations[0])
+        start_ms = end_ms - 90 * 86_400_000
+        station_query_time_s = _time_call(
+            price_history.station_prices,
+            station_key,
+            "regularPrice",
+            start_ms,
+            end_ms,
+        )
+        state_query_time_s = _time_call(
+            price_history.state_average,
+            stations[0]["state"],
+            "regularPrice",
+            start_ms,
+            end_ms,
+        )
+        price_history.close()
+        logger.info(
+            "history with {count} prices ({size_mb:.1f} MB): ingest={rate:.0f} prices/s, 90 days of one station={station_ms:.2f} ms, 90 days of state averages={state_ms:.1f} ms",
+            count=observation_count,
+            size_mb=os.path.getsize(db_file_name) / (1024 * 1024),
+            rate=observation_count / ingest_time_s,
+            station_ms=station_query_time_s * 1000,
+            state_ms=state_query_time_s * 1000,
+        )
+
+
+def _mean_query_ms(query, query_points: list) -> float:
+    start = time.perf_counter()
+    for latitude, longitude in query_points:
+        query(latitude, longitude)
+    return (time.perf_counter() - start) * 1000 / len(query_points)
+
+
+def bench_spatial(args) -> None:
+    rng = random.Random(1)
+    query_points = [
+        (rng.uniform(25.0, 48.0), rng.uniform(-124.0, -70.0))
+        for _ in range(args.queries)
+    ]
+    for size in args.sizes:
+        _bench_spatial_size(args, size, query_points)
+
+
+def _bench_spatial_size(args, size: int, query_points: list) -> None:
+    stations = make_synthetic_stations(size)
+    start = time.perf_counter()
+    station_index = spatial.StationIndex(stations)
+    build_time_s = time.perf_counter() - start
+    # Brute force gets the same precomputed unit vectors, so only the scan differs
+    unit_vectors = [
+        spatial._unit_vector(station["latitude"], station["longitude"])
+        for station in stations
+    ]
+
+    def brute_nearest(latitude, longitude):
+        point = spatial._unit_vector(latitude, longitude)
+        return heapq.nsmallest(
+            args.k,
+            range(len(stations)),
+            key=lambda i: math.dist(unit_vectors[i], point),
+        )
+
+    def brute_radius(latitude, longitude):
+        point = spatial._unit_vector(latitude, longitude)
+        chord = spatial._km_to_chord(args.radius_km)
+        return spatial.cheapest_by_grade(
+            stations[i]
+            for i, unit_vector in enumerate(unit_vectors)
+            if math.dist(unit_vector, point) <= chord
+        )
+
+    def brute_bbox(latitude, longitude):
+        return [
+            station
+            for station in stations
+            if latitude - 1 <= station["latitude"] <= latitude + 1
+            and longitude - 1 <= station["longitude"] <= longitude + 1
+        ]
+
+    def indexed_radius(latitude, longitude):
+        return spatial.cheapest_by_grade(
+            station
+            for _, station in station_index.within_radius(
+                latitude, longitude, args.radius_km
+            )
+        )
+
+    def indexed_bbox(latitude, longitude):
+        return station_index.within_bbox(
+            latitude - 1, longitude - 1, latitude + 1, longitude + 1
+        )
+
+    # Both must find the same stations
+    for latitude, longitude in query_points[:20]:
+        if [id(stations[i]) for i in brute_nearest(latitude, longitude)] != [
+            id(station)
+            for _, station in station_index.nearest(latitude, longitude, args.k)
+        ]:
+            raise RuntimeError("k-nearest results differ from brute force")
+        if brute_radius(latitude, longitude) != indexed_radius(latitude, longitude):
+            raise RuntimeError("Radius results differ from brute force")
+        if len(brute_bbox(latitude, longitude)) != len(
+            indexed_bbox(latitude, longitude)
+        ):
+            raise RuntimeError("Bounding box results differ from brute force")
+    brute_points = query_points[: max(1, args.queries * 1000 // size)]
+    logger.info(
+        "spatial @ {size} stations (built in {build_time_s:.3f} s), ms/query brute force vs. index: {k}-nearest={brute_nearest_ms:.3f} vs. {nearest_ms:.3f}, {radius_km} km radius + cheapest per grade={brute_radius_ms:.3f} vs. {radius_ms:.3f}, 2x2 degree bbox={brute_bbox_ms:.3f} vs. {bbox_ms:.3f}",
+        size=size,
+        build_time_s=build_time_s,
+        k=args.k,
+        radius_km=args.radius_km,
+        brute_nearest_ms=_mean_query_ms(brute_nearest, brute_points),
+        nearest_ms=_mean_query_ms(
+            lambda latitude, longitude: station_index.nearest(
+                latitude, longitude, args.k
+            ),
+            query_points,
+        ),
+        brute_radius_ms=_mean_query_ms(brute_radius, brute_points),
+        radius_ms=_mean_query_ms(indexed_radius, query_points),
+        brute_bbox_ms=_mean_query_ms(brute_bbox, brute_points),
+        bbox_ms=_mean_query_ms(indexed_bbox, query_points),
+    )
+
+
+def _json_dumps_structured_log_formatter(record):
+    # The original structured_log_formatter, kept only as a baseline to benchmark
+    # against
+    record["extra"]["serialized"] = json.dumps(
+        {
+            "timestamp": datetime.fromtimestamp(
+                record["time"].timestamp(), tz=timezone.utc
+            ).isoformat(),
+            "severity": record["level"].name,
+            "message": record["message"],
+        }
+    )
+    return "{extra[serialized]}\n"
+
+
+def _log_fetch_records(count: int) -> float:
+    # The lines the fetcher and Costco parsing log for every warehouse page
+    start = time.perf_counter()
+    for i in range(count // 4):
+        url = "https://www.costco.com/warehouse-locations/synthetic-{i}.html".format(
+            i=i
+        )
+        logger.debug(helpers.get_request_log_fmt_str, url=url)
+        logger.info(helpers.api_response_log_fmt_str, status_code=200, url=url)
+        logger.info(helpers.read_html_log_fmt_str, url=url)
+        logger.info("Got prices from {url} in {time_s} s", url=url, time_s=0.01)
+    return time.perf_counter() - start
+
+
+def bench_logging(args) -> None:
+    configurations = {
+        "configure_logger": lambda stream: dict(
+            sink=stream, format=_json_dumps_structured_log_formatter
+        ),
+        "pre-serialized": lambda stream: dict(
+            sink=stream, format=helpers.structured_log_formatter
+        ),
+        "pre-serialized + queued": lambda stream: dict(
+            sink=logsink.QueuedSink(stream), format=helpers.structured_log_formatter
+        ),
+        "pre-serialized + queued + sampled": lambda stream: dict(
+            sink=logsink.QueuedSink(stream),
+            format=helpers.structured_log_formatter,
+            filter=logsink.LogFilter(sample_rate=args.sample_rate),
+        ),
+    }
+    records_per_process = args.records // args.processes
+    results = {}
+    with tempfile.TemporaryDirectory() as log_dir:
+        for name, configuration in configurations.items():
+            # Every process appends to one file, like Pool workers sharing stdout
+            log_file_name = os.path.join(log_dir, name)
+            with open(log_file_name, "a") as stream:
+                logger.remove()
+                logger.add(level="DEBUG", colorize=False, **configuration(stream))
+                start = time.perf_counter()
+                p = Pool(processes=args.processes)
+                process_times_s = p.map(
+                    _log_fetch_records, [records_per_process] * args.processes
+                )
+                # Let the workers exit on their own so that they flush their queues
+                p.close()
+                p.join()
+                wall_time_s = time.perf_counter() - start
+                logger.remove()
+            with open(log_file_name, "r") as log_file:
+                written_count = sum(1 for _ in log_file)
+            results[name] = (
+                sum(process_times_s) / (records_per_process * args.processes),
+                wall_time_s,
+                written_count,
+            )
+    helpers.configure_logger(args)
+    for name, (per_record_s, wall_time_s, written_count) in results.items():
+        logger.info(
+            "logging {records} records from {processes} processes, {name}: {per_record_us:.2f} us/record in the caller, {wall_time_s:.3f} s until written, {written_count} written",
+            records=records_per_process * args.processes,
+            processes=args.processes,
+            name=name,
+            per_record_us=per_record_s * 1e6,
+            wall_time_s=wall_time_s,
+            written_count=written_count,
+        )
+
+
+def _per_row_normalize_grade_prices(grade_prices: list, price_keys_by_grade: dict):
+    # The original per-grade normalization, kept only as a baseline to benchmark
+    # against
+    price_points = []
+    for grade, price_text, is_per_liter in grade_prices:
+        if grade not in price_keys_by_grade:
+            price_points.append(None)
+            continue
+        price = float(str(price_text).replace("$", "")[0:4])
+        if is_per_liter:
+            price = helpers.convert_price_per_liter_to_price_per_gallon(price)
+        price_points.append({"timestamp": helpers.now_in_epoch_ms(), "price": price})
+    return price_points
+
+
+def bench_normalize(args) -> None:
+    rng = random.Random(0)
+    price_keys_by_grade = {"Regular": "regularPrice", "Premium": "premiumPrice"}
+    for size in args.sizes:
+        # Costco-style price texts, a tenth of them per liter like Puerto Rico's
+        grade_prices = [
+            (
+                rng.choice(("Regular", "Premium")),
+                "${price:.3f}".format(price=rng.uniform(2.5, 6.5)),
+                rng.random() < 0.1,
+            )
+            for _ in range(size)
+        ]
+        batch_grade_prices = [(grade, price_text) for grade, price_text, _ in grade_prices]
+        per_liter = [is_per_liter for _, _, is_per_liter in grade_prices]
+        per_row_time_s = _time_call(
+            _per_row_normalize_grade_prices, grade_prices, price_keys_by_grade
+        )
+        batch_times_s = {}
+        batch_prices = {}
+        numpy_module = normalize.import_numpy()
+        for name, module in (("python", None), ("numpy", numpy_module)):
+            if name == "numpy" and numpy_module is None:
+                continue
+            normalize.numpy = module
+            batch_times_s[name] = _time_call(
+                normalize.normalize_grade_prices,
+                batch_grade_prices,
+                price_keys_by_grade,
+                per_liter,
+            )
+            batch_prices[name] = [
+                price_point["price"]
+                for price_point in normalize.normalize_grade_prices(
+                    batch_grade_prices, price_keys_by_grade, per_liter
+                )[0]
+            ]
+        normalize.numpy = numpy_module
+        per_row_prices = [
+            price_point["price"]
+            for price_point in _per_row_normalize_grade_prices(
+                grade_prices, price_keys_by_grade
+            )
+        ]
+        logger.info(
+            "normalize @ {size} rows: per row={per_row_time_s:.3f} s, batch={batch_times}. {differing_count} prices differ from per row{numpy_note}",
+            size=size,
+            per_row_time_s=per_row_time_s,
+            batch_times=", ".join(
+                "{name} {time_s:.3f} s".format(name=name, time_s=time_s)
+                for name, time_s in batch_times_s.items()
+            ),
+            differing_count=sum(
+                per_row_price != batch_price
+                for per_row_price, batch_price in zip(
+                    per_row_prices, batch_prices["python"]
+                )
+            ),
+            numpy_note=(
+                "" if numpy_module is not None else " (NumPy isn't installed)"
+            ),
+        )
+
+
+def parse_benchmark_args():
+    arg_parser = argparse.ArgumentParser(
+        description="Offline benchmarks for the scraper's hot paths"
+    )
+    arg_parser.add_argument(
+        "--log-level",
+        action="store",
+        type=str,
+        default="INFO",
+        help="The logging level to use",
+    )
+    arg_parser.add_argument(
+        "--structured-logging",
+        action="store_true",
+        default=False,
+        help="Denotes whether to structure log statements",
+    )
+    subparsers = arg_parser.add_subparsers(required=True)
+
+    merge_parser = subparsers.add_parser(
+        "merge", help="Keyed merge vs. the original positional merge"
+    )
+    merge_parser.add_argument(
+        "--sizes",
+        action="store",
+        type=int,
+        nargs="+",
+        default=[10_000, 50_000, 100_000],
+        help="Numbers of synthetic stations to merge",
+    )
+    merge_parser.set_defaults(func=bench_merge)
+
+    fetch_parser = subparsers.add_parser(
+        "fetch",
+        help="asyncio fetcher vs. a process pool of blocking requests against a local stub server",
+    )
+    fetch_parser.add_argument(
+        "--stations",
+        action="store",
+        type=int,
+        default=600,
+        help="Number of synthetic warehouse pages to serve",
+    )
+    fetch_parser.add_argument(
+        "--latency-ms",
+        action="store",
+        type=float,
+        default=100,
+        help="Latency the stub server adds to every response",
+    )
+    fetch_parser.add_argument(
+        "--pool-size",
+        action="store",
+        type=int,
+        default=4,
+        help="Number of subprocesses for the blocking baseline",
+    )
+    fetch_parser.add_argument(
+        "--concurrency",
+        action="store",
+        type=int,
+        nargs="+",
+        default=[4, 16, 64],
+        help="Concurrency limits to run the asyncio fetcher with",
+    )
+    fetch_parser.set_defaults(func=bench_fetch)
+
+    ratelimit_parser = subparsers.add_parser(
+        "ratelimit",
+        help="Sustained throughput of the adaptive rate limiter against a stub server that returns 429 above a request rate",
+    )
+    ratelimit_parser.add_argument(
+        "--stations",
+        action="store",
+        type=int,
+        default=300,
+        help="Number of synthetic warehouse pages to serve",
+    )
+    ratelimit_parser.add_argument(
+        "--latency-ms",
+        action="store",
+        type=float,
+        default=20,
+        help="Latency the stub server adds to every response",
+    )
+    ratelimit_parser.add_argument(
+        "--server-max-rate",
+        action="store",
+        type=float,
+        default=20,
+        help="Requests/s above which the stub server returns 429",
+    )
+    ratelimit_parser.add_argument(
+        "--client-max-rate",
+        action="store",
+        type=float,
+        default=50,
+        help="Requests/s the fetcher starts at and won't exceed",
+    )
+    ratelimit_parser.add_argument(
+        "--concurrency",
+        action="store",
+        type=int,
+        default=16,
+        help="Maximum number of in-flight requests for the fetcher",
+    )
+    ratelimit_parser.set_defaults(func=bench_ratelimit)
+
+    samsclub_stream_parser = subparsers.add_parser(
+        "samsclub-stream",
+        help="Streaming vs. all-at-once parsing of a synthetic Sam's Club payload",
+    )
+    samsclub_stream_parser.add_argument(
+        "--clubs",
+        action="store",
+        type=int,
+        default=50_000,
+        help="Number of clubs in the synthetic payload",
+    )
+    samsclub_stream_parser.set_defaults(func=bench_samsclub_stream)
+
+    extract_parser = subparsers.add_parser(
+        "extract", help="Pages/s of each gas price extractor backend"
+    )
+    extract_parser.add_argument(
+        "--corpus-dir",
+        action="store",
+        type=str,
+        default=None,
+        help="Directory of saved warehouse pages. Synthetic pages are used if not given",
+    )
+    extract_parser.add_argument(
+        "--pages",
+        action="store",
+        type=int,
+        default=100,
+        help="Number of synthetic pages to extract from if no corpus is given",
+    )
+    extract_parser.set_defaults(func=bench_extract)
+
+    franchises_parser = subparsers.add_parser(
+        "franchises",
+        help="Makespan of collecting both franchises with the franchise scheduler vs. one Pool.map over every item",
+    )
+    franchises_parser.add_argument(
+        "--stations",
+        action="store",
+        type=int,
+        default=600,
+        help="Number of synthetic Costco warehouse pages to serve",
+    )
+    franchises_parser.add_argument(
+        "--clubs",
+        action="store",
+        type=int,
+        default=600,
+        help="Number of synthetic clubs in the Sam's Club payload",
+    )
+    franchises_parser.add_argument(
+        "--latency-ms",
+        action="store",
+        type=float,
+        default=50,
+        help="Latency the stub server adds to every response",
+    )
+    franchises_parser.add_argument(
+        "--samsclub-startup-ms",
+        action="store",
+        type=float,
+        default=5000,
+        help="Time to simulate starting a browser for Sam's Club",
+    )
+    franchises_parser.add_argument(
+        "--pool-size",
+        action="store",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="Size of the process pool",
+    )
+    franchises_parser.add_argument(
+        "--concurrency",
+        action="store",
+        type=int,
+        default=8,
+        help="Costco fetch concurrency for the franchise scheduler",
+    )
+    franchises_parser.set_defaults(func=bench_franchises)
+
+    refresh_parser = subparsers.add_parser(
+        "refresh",
+        help="Offline simulation of how stale the served prices are with the refresh scheduler vs. round robin under a request budget",
+    )
+    refresh_parser.add_argument(
+        "--history-dir",
+        action="store",
+        type=str,
+        default=None,
+        help="Directory of recorded prices.json snapshots, one per run in file name order. A synthetic history is used if not given",
+    )
+    refresh_parser.add_argument(
+        "--interval-hours",
+        action="store",
+        type=float,
+        default=1,
+        help="Hours between runs",
+    )
+    refresh_parser.add_argument(
+        "--stations",
+        action="store",
+        type=int,
+        default=600,
+        help="Number of synthetic stations if no history is given",
+    )
+    refresh_parser.add_argument(
+        "--runs",
+        action="store",
+        type=int,
+        default=168,
+        help="Number of synthetic runs if no history is given",
+    )
+    refresh_parser.add_argument(
+        "--budget-fractions",
+        action="store",
+        type=float,
+        nargs="+",
+        default=[0.1, 0.25, 0.5],
+        help="Requests per run, as fractions of the number of stations",
+    )
+    refresh_parser.set_defaults(func=bench_refresh)
+
+    history_parser = subparsers.add_parser(
+        "history", help="Ingest rate and query latency of the price history store"
+    )
+    history_parser.add_argument(
+        "--stations",
+        action="store",
+        type=int,
+        default=600,
+        help="Number of synthetic stations",
+    )
+    history_parser.add_argument(
+        "--days",
+        action="store",
+        type=int,
+        default=90,
+        help="Days of history to ingest",
+    )
+    history_parser.add_argument(
+        "--runs-per-day",
+        action="store",
+        type=int,
+        default=4,
+        help="Scraper runs per day to ingest",
+    )
+    history_parser.set_defaults(func=bench_history)
+
+    serializers_parser = subparsers.add_parser(
+        "serializers", help="Size, encode and decode time of each output format"
+    )
+    serializers_parser.add_argument(
+        "--sizes",
+        action="store",
+        type=int,
+        nargs="+",
+        # About as many gas stations as Costco and Sam's Club have in the U.S., then
+        # a much larger synthetic set
+        default=[1_200, 100_000],
+        help="Numbers of synthetic stations to serialize",
+    )
+    serializers_parser.set_defaults(func=bench_serializers)
+
+    spatial_parser = subparsers.add_parser(
+        "spatial", help="Spatial index queries vs. brute-force scans"
+    )
+    spatial_parser.add_argument(
+        "--sizes",
+        action="store",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000],
+        help="Numbers of synthetic stations to index",
+    )
+    spatial_parser.add_argument(
+        "--queries",
+        action="store",
+        type=int,
+        default=1000,
+        help="Number of random query points",
+    )
+    spatial_parser.add_argument(
+        "--k",
+        action="store",
+        type=int,
+        default=10,
+        help="Number of nearest stations to find",
+    )
+    spatial_parser.add_argument(
+        "--radius-km",
+        action="store",
+        type=float,
+        default=25,
+        help="Radius of the radius queries",
+    )
+    spatial_parser.set_defaults(func=bench_spatial)
+
+    store_memory_parser = subparsers.add_parser(
+        "store-memory",
+        help="Memory held by normalized stations as dicts vs. the columnar store",
+    )
+    store_memory_parser.add_argument(
+        "--sizes",
+        action="store",
+        type=int,
+        nargs="+",
+        default=[100_000],
+        help="Numbers of synthetic stations to hold",
+    )
+    store_memory_parser.set_defaults(func=bench_store_memory)
+
+    logging_parser = subparsers.add_parser(
+        "logging",
+        help="Per-record cost of logging the fetch lines with the original structured logging setup vs. the pre-serialized formatter, queued sink, and URL sampling",
+    )
+    logging_parser.add_argument(
+        "--records",
+        action="store",
+        type=int,
+        default=200_000,
+        help="Number of records to log across all processes",
+    )
+    logging_parser.add_argument(
+        "--processes",
+        action="store",
+        type=int,
+        default=4,
+        help="Number of processes logging at once",
+    )
+    logging_parser.add_argument(
+        "--sample-rate",
+        action="store",
+        type=float,
+        default=0.1,
+        help="Fraction of URLs to log for the sampled setup",
+    )
+    logging_parser.set_defaults(func=bench_logging)
+
+    normalize_parser = subparsers.add_parser(
+        "normalize",
+        help="Per-row price normalization vs. the batch API, with and without NumPy",
+    )
+    normalize_parser.add_argument(
+        "--sizes",
+        action="store",
+        type=int,
+        nargs="+",
+        default=[100_000],
+        help="Numbers of (grade, price) rows to normalize",
+    )
+    normalize_parser.set_defaults(func=bench_normalize)
+
+    return arg_parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_benchmark_args()
+    helpers.configure_logger(args)
+    args.func(args)
@@ -1,25 +1,62 @@
+import asyncio
 from bs4 import BeautifulSoup
+import extract
+import fetcher
+import fingerprints
 import helpers
+import http_session
+import httpcache
 from helpers import (
     get_request_log_fmt_str,
     api_response_log_fmt_str,
     abort_due_to_bad_response_fmt_str,
     read_html_log_fmt_str,
-    user_agent,
     now_in_epoch_ms,
-    convert_price_per_liter_to_price_per_gallon,
 )
+import journal
 import json
 from loguru import logger
+from metrics import run_metrics
+import multiprocessing
+import merge
+import normalize
+import os
 from multiprocessing import Pool
+from pipeline import StageStats
+import publish
+import queue
 import re
-import requests
+import refresh
+import serializers
+import threading
 import time
+from typing import Callable, NamedTuple
 
 
 costco_station_urls_file_name = "costco-gas-station-urls-us.json"
-_prices_output_file_name = "costco-prices-out.json"
-_should_abort = False
+_script_tag_regex = re.compile(r"<script[^>]*>(.*?)</script>", re.DOTALL)
+_warehouse_id_from_url_regex = re.compile(r"-(\d+)\.html$")
+_price_keys_by_grade = {
+    "Regular": "regularPrice",
+    "Premium": "premiumPrice",
+    "Diesel": "dieselPrice",
+}
+_prices_output_file_stem = "costco-prices-out"
+# How often to hand back unchanged pages while waiting on the pool
+_unchanged_poll_s = 0.05
+
+
+class StationListDelta(NamedTuple):
+    # The full refreshed list of URL objects
+    urls: list
+    # URL objects of new stations, closed stations, and stations whose details changed
+    added: list
+    removed: list
+    changed: list
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
 
 
 def write_urls_to_file(urls: list) -> None:
@@ -44,7 +81,7 @@ def mark_diesel_station_urls(urls: list) -> None:
     """
     diesel_stations_url = "https://www.costco.com/gasoline-diesel.html"
     logger.debug(get_request_log_fmt_str, url=diesel_stations_url)
-    resp = requests.get(diesel_stations_url, headers={"User-Agent": user_agent})
+    resp = http_session.get_session().get(diesel_stations_url)
     logger.info(
         api_response_log_fmt_str, status_code=resp.status_code, url=diesel_stations_url
     )
@@ -113,37 +150,90 @@ def mark_diesel_station_urls(urls: list) -> None:
     return urls
 
 
-def get_and_write_all_gas_station_urls() -> list:
+def _extract_warehouse_list_as_str(html: str) -> str:
+    # The warehouse list is a JSON array assigned to a JS variable in one of the
+    # page's script tags. Scanning the script text for it is much faster than
+    # parsing the whole page into a DOM, and doesn't depend on where the tag is
+    logger.info("Finding script tag with warehouse list...")
+    for match in _script_tag_regex.finditer(html):
+        script = match.group(1)
+        if '"warehouseList"' in script and "=" in script:
+            return script.split("=", 1)[1].rsplit(";", 1)[0]
+    logger.error("Could not find the script tag with the warehouse list")
+    raise AssertionError("No script tag contains the list of warehouses")
+
+
+def _warehouse_id(url_object: dict) -> str:
+    return _warehouse_id_from_url_regex.search(url_object["url"]).group(1)
+
+
+def diff_station_urls(curr_urls: list, new_urls: list) -> StationListDelta:
+    """
+    Compares a freshly downloaded station list with the current one by warehouse
+    identifier.
+    """
+    curr_urls_by_id = {
+        _warehouse_id(url_object): url_object for url_object in curr_urls
+    }
+    new_ids = set()
+    added = []
+    changed = []
+    for url_object in new_urls:
+        warehouse_id = _warehouse_id(url_object)
+        new_ids.add(warehouse_id)
+        curr_url_object = curr_urls_by_id.get(warehouse_id)
+        if curr_url_object is None:
+            added.append(url_object)
+        elif curr_url_object != url_object:
+            changed.append(url_object)
+    removed = [
+        url_object
+        for warehouse_id, url_object in curr_urls_by_id.items()
+        if warehouse_id not in new_ids
+    ]
+    return StationListDelta(
+        urls=new_urls, added=added, removed=removed, changed=changed
+    )
+
+
+def get_and_write_all_gas_station_urls(
+    response_cache: httpcache.ResponseCache | None = None,
+) -> StationListDelta:
+    """
+    Downloads the current list of warehouses with gas stations and returns how it
+    differs from the saved one, for collect_stations.
+    """
     # When the warehouse name isn't the same as the city name, use the alt format
     warehouse_url_format_string = "https://www.costco.com/warehouse-locations/{city}-{state_code}-{location_id}.html"
     # alt_warehouse_url_format_string = "https://www.costco.com/warehouse-locations/{name}-{city}-{state_code}-{location_id}.html"
     warehouse_list_url = "https://www.costco.com/WarehouseListByStateDisplayView"
     p_start = time.perf_counter()
+    cached_response = (
+        response_cache.get(warehouse_list_url) if response_cache is not None else None
+    )
     logger.debug(get_request_log_fmt_str, url=warehouse_list_url)
-    # Must send User-Agent, else will hang
-    resp = requests.get(warehouse_list_url, headers={"User-Agent": user_agent})
+    resp = http_session.get_session().get(
+        warehouse_list_url, headers=httpcache.conditional_headers(cached_response)
+    )
     logger.info(
         api_response_log_fmt_str, status_code=resp.status_code, url=warehouse_list_url
     )
-    if resp.status_code != 200:
-        logger.error(abort_due_to_bad_response_fmt_str)
-        resp.raise_for_status()
-    logger.info(read_html_log_fmt_str, url=warehouse_list_url)
-    soup = BeautifulSoup(resp.text, "html5lib")
-    logger.info("Done reading HTML response tree from {url}", url=warehouse_list_url)
-    logger.info("Finding script tag with warehouse list...")
-    # The JS script tag containing all of the warehouses as a list var should be at index 11
-    js_script_tags = soup.find_all("script", attrs={"type": "text/javascript"})
-    try:
-        script_containing_warehouse_list_guess = js_script_tags[11]
-        warehouse_list_as_str = script_containing_warehouse_list_guess.string.split(
-            "=", 1
-        )[1].rsplit(";", 1)[0]
-    except IndexError as e:
-        logger.error("Could not find the script tag with the warehouse list", e)
-        raise AssertionError(
-            "Targeted script tag does not contain the list of warehouses"
-        )
+    if resp.status_code == 304 and cached_response is not None:
+        logger.info("Warehouse list is unchanged, using the cached copy")
+        warehouse_list_as_str = cached_response["content"]
+    else:
+        if resp.status_code != 200:
+            logger.error(abort_due_to_bad_response_fmt_str)
+            resp.raise_for_status()
+        logger.info(read_html_log_fmt_str, url=warehouse_list_url)
+        warehouse_list_as_str = _extract_warehouse_list_as_str(resp.text)
+        if response_cache is not None:
+            response_cache.put(
+                warehouse_list_url,
+                resp.headers.get("ETag"),
+                resp.headers.get("Last-Modified"),
+                warehouse_list_as_str,
+            )
     warehouse_list = json.loads(warehouse_list_as_str)
     logger.info("Found and loaded warehouse list.")
     gas_station_urls = []
@@ -180,112 +270,51 @@ def get_and_write_all_gas_station_urls() -> list:
                         # "altUrl": alt_url_to_write.replace(" ", "-"),
                     }
                 )
+    # mark_diesel_station_urls(gas_station_urls)
+    curr_urls = (
+        read_station_urls() if os.path.exists(costco_station_urls_file_name) else []
+    )
+    delta = diff_station_urls(curr_urls, gas_station_urls)
+    for url_object in delta.added:
+        logger.info("New Costco gas station: {name}", name=url_object["name"])
+    for url_object in delta.removed:
+        logger.info("Closed Costco gas station: {name}", name=url_object["name"])
+    logger.info(
+        "Costco station list: {added} new, {removed} closed, {changed} changed",
+        added=len(delta.added),
+        removed=len(delta.removed),
+        changed=len(delta.changed),
+    )
+    # The file is only rewritten when a station changed, so an unchanged list
+    # doesn't touch it
+    if delta.is_empty:
+        logger.info("Costco station list is unchanged. Not rewriting it")
+    else:
+        write_urls_to_file(gas_station_urls)
     p_end = time.perf_counter()
     logger.info(
-        "Done writing all Costco US warehouse URLs with gas stations. Took {time_s} s",
+        "Done refreshing all Costco US warehouse URLs with gas stations. Took {time_s} s",
         time_s=p_end - p_start,
     )
-    # mark_diesel_station_urls(gas_station_urls)
-    write_urls_to_file(gas_station_urls)
-    return gas_station_urls
-
-
-def get_and_normalize_data_from_url(url_object: dict) -> dict | None:
-    franchise_name = "COSTCO"
-    name = url_object["name"] + " (Costco)"
-    street_address = url_object["streetAddress"]
-    city = url_object["city"]
-    state = url_object["state"]
-    postal_code = url_object["postalCode"]
-    latitude = url_object["latitude"]
-    longitude = url_object["longitude"]
-    regular_price = None
-    mid_grade_price = None
-    premium_price = None
-    diesel_price = None
-    url = url_object["url"]
-    global _should_abort
-    if _should_abort:
-        logger.warning("Abort flag set, setting gas prices to None for {url}", url=url)
-    else:
-        p_start = time.perf_counter()
-        logger.debug(get_request_log_fmt_str, url=url)
-        # Must send User-Agent, else will hang
-        resp = requests.get(url, headers={"User-Agent": user_agent})
-        logger.info(api_response_log_fmt_str, status_code=resp.status_code, url=url)
-        if resp.status_code != 200:
-            logger.error(abort_due_to_bad_response_fmt_str)
-            if resp.status_code == 403 or resp.status_code == 429 and not _should_abort:
-                logger.error("Being rate limited or honeypotted. Setting abort flag.")
-                _should_abort = True
-        else:
-            logger.info(read_html_log_fmt_str, url=url)
-            soup = BeautifulSoup(resp.text, "html5lib")
-            gas_price_section = soup.find("div", attrs={"class": "gas-price-section"})
-            # Should never happen, but I don't want to delete this safeguard completely from code
-            # if gas_price_section is None:
-            #     logger.info(
-            #         "URL {url} does not have a gas-price-section. Returning None", url=url
-            #     )
-            #     return None
-            # Map to normalized schema
-            for gas_price in gas_price_section.find_all("div"):
-                grade = None
-                price = None
-                for meaningful_descendant in gas_price.find_all("span"):
-                    if (
-                        grade is None
-                        and "gas-type"
-                        in meaningful_descendant.get_attribute_list("class")
-                    ):
-                        grade = meaningful_descendant.text
-                    else:
-                        price = float(meaningful_descendant.text.replace("$", "")[0:4])
-                        if state == "PR":
-                            price = convert_price_per_liter_to_price_per_gallon(price)
-                match grade:
-                    case "Regular":
-                        regular_price = {"timestamp": now_in_epoch_ms(), "price": price}
-                    case "Premium":
-                        premium_price = {"timestamp": now_in_epoch_ms(), "price": price}
-                    case "Diesel":
-                        diesel_price = {"timestamp": now_in_epoch_ms(), "price": price}
-                    case _:
-                        logger.warning(
-                            '{url} has unknown gas grade "{grade_name}". Gas price is={gas_price}',
-                            url=url,
-                            grade_name=grade,
-                            gas_price=price,
-                        )
-            if (
-                regular_price is None
-                and mid_grade_price is None
-                and premium_price is None
-                and diesel_price is None
-            ):
-                logger.warning(
-                    'URL "{url}" has a gas prices section, but no gas prices were found.',
-                    url=url,
-                )
-            elif regular_price is None:
-                logger.error(
-                    "Expected a price for regular octane at {url}, but got None! html is {html}",
-                    url=url,
-                    html=gas_price_section.contents,
-                )
-            p_end = time.perf_counter()
-            logger.info(
-                "Got prices from {url} in {time_s} s", url=url, time_s=p_end - p_start
-            )
+    return delta
+
+
+def _normalized_station(
+    url_object: dict,
+    regular_price: dict | None = None,
+    mid_grade_price: dict | None = None,
+    premium_price: dict | None = None,
+    diesel_price: dict | None = None,
+) -> dict:
     return {
-        "franchiseName": franchise_name,
-        "name": name,
-        "streetAddress": street_address,
-        "city": city,
-        "state": state,
-        "postalCode": postal_code,
-        "latitude": latitude,
-        "longitude": longitude,
+        "franchiseName": "COSTCO",
+        "name": url_object["name"] + " (Costco)",
+        "streetAddress": url_object["streetAddress"],
+        "city": url_object["city"],
+        "state": url_object["state"],
+        "postalCode": url_object["postalCode"],
+        "latitude": url_object["latitude"],
+        "longitude": url_object["longitude"],
         "currencySymbol": "$",
         "regularPrice": regular_price,
         "midGradePrice": mid_grade_price,
@@ -294,35 +323,540 @@ def get_and_normalize_data_from_url(url_object: dict) -> dict | None:
     }
 
 
+def normalize_html(
+    url_object: dict,
+    html: str,
+    extractor: str = extract.default_backend,
+    observed_at_ms: int | None = None,
+) -> dict:
+    """
+    observed_at_ms, by default now, timestamps every price on the page.
+    """
+    url = url_object["url"]
+    logger.info(read_html_log_fmt_str, url=url)
+    gas_prices = extract.extract_gas_prices(html, extractor)
+    if gas_prices is None:
+        logger.error("URL {url} does not have a gas-price-section", url=url)
+        return _normalized_station(url_object)
+    # Map to normalized schema
+    price_points, price_keys = normalize.normalize_grade_prices(
+        gas_prices,
+        _price_keys_by_grade,
+        per_liter=url_object["state"] == "PR",
+        observed_at_ms=observed_at_ms,
+    )
+    prices = {}
+    for (grade, price_text), price_key, price_point in zip(
+        gas_prices, price_keys, price_points
+    ):
+        if price_key is None:
+            logger.warning(
+                '{url} has unknown gas grade "{grade_name}". Gas price is={gas_price}',
+                url=url,
+                grade_name=grade,
+                gas_price=price_text,
+            )
+        else:
+            prices[price_key] = price_point
+    regular_price = prices.get("regularPrice")
+    mid_grade_price = prices.get("midGradePrice")
+    premium_price = prices.get("premiumPrice")
+    diesel_price = prices.get("dieselPrice")
+    if (
+        regular_price is None
+        and mid_grade_price is None
+        and premium_price is None
+        and diesel_price is None
+    ):
+        logger.warning(
+            'URL "{url}" has a gas prices section, but no gas prices were found.',
+            url=url,
+        )
+    elif regular_price is None:
+        logger.error(
+            "Expected a price for regular octane at {url}, but got None! Gas prices are {gas_prices}",
+            url=url,
+            gas_prices=gas_prices,
+        )
+    return _normalized_station(
+        url_object,
+        regular_price=regular_price,
+        mid_grade_price=mid_grade_price,
+        premium_price=premium_price,
+        diesel_price=diesel_price,
+    )
+
+
+def _page_to_normalize(
+    url_object: dict,
+    result: fetcher.FetchResult,
+    response_cache: httpcache.ResponseCache | None,
+) -> str | None:
+    """
+    Returns the markup to extract gas prices from: just the gas-price-section where it
+    can be found, since that's all that needs to be parsed and cached.
+    """
+    url = url_object["url"]
+    if result.status_code == 304:
+        if result.cached_content is not None:
+            return result.cached_content
+        logger.warning("{url} is not modified, but wasn't cached", url=url)
+        return None
+    if result.status_code != 200:
+        if result.status_code is not None:
+            logger.error(abort_due_to_bad_response_fmt_str)
+        return None
+    gas_price_section = extract.slice_gas_price_section(result.text)
+    if gas_price_section is None:
+        # Let the extractor fall back to parsing the whole page
+        return result.text
+    if response_cache is not None:
+        response_cache.put(
+            url, result.etag, result.last_modified, content=gas_price_section
+        )
+    return gas_price_section
+
+
+def _normalize_page(
+    url_object: dict, page: str | None, extractor: str, observed_at_ms: int | None
+) -> dict:
+    if page is None:
+        return _normalized_station(url_object)
+    return normalize_html(url_object, page, extractor, observed_at_ms)
+
+
+def _normalize_page_from_args(args: tuple) -> tuple:
+    # Also returns the URL and whether there was a page to parse, for on_parsed, and
+    # how long parsing took, since metrics recorded in a Pool worker would be lost
+    url_object, page = args[:2]
+    p_start = time.perf_counter()
+    station = _normalize_page(*args)
+    return (
+        url_object["url"],
+        page is not None,
+        station,
+        time.perf_counter() - p_start,
+    )
+
+
+def _run_fetch_stage(
+    urls: list,
+    concurrency: int,
+    max_rate_per_s: float,
+    response_cache: httpcache.ResponseCache | None,
+    fetched: queue.Queue,
+    fetch_stats: StageStats,
+    stopped: threading.Event,
+    initial_rate_per_s: float | None,
+) -> None:
+    async def fetch_into_queue():
+        async for result in fetcher.iter_fetch_all_async(
+            [url_object["url"] for url_object in urls],
+            concurrency,
+            max_rate_per_s,
+            response_cache,
+            initial_rate_per_s,
+        ):
+            if stopped.is_set():
+                # Requests still in flight are cancelled when the loop shuts down
+                break
+            fetch_stats.record(fetched.qsize())
+            # Blocks while the parse stage is behind, without stalling the requests
+            # that are already in flight
+            await asyncio.to_thread(fetched.put, result)
+
+    try:
+        asyncio.run(fetch_into_queue())
+    except BaseException as e:
+        fetched.put(e)
+        raise
+    fetched.put(None)
+
+
+def iter_normalized_data(
+    urls: list,
+    concurrency: int,
+    max_rate_per_s: float,
+    pool: Pool,
+    extractor: str = extract.default_backend,
+    response_cache: httpcache.ResponseCache | None = None,
+    queue_size: int = 16,
+    on_parsed: Callable | None = None,
+    page_fingerprints: fingerprints.PageFingerprints | None = None,
+    initial_rate_per_s: float | None = None,
+):
+    """
+    Yields each warehouse's normalized prices as soon as its page has been fetched and
+    parsed, in no particular order.
+
+    Pages are fetched with asyncio on a background thread and parsed on the given
+    process pool at the same time. At most queue_size fetched pages wait to be parsed,
+    and at most queue_size pages are being parsed, so a slow stage holds back the
+    stages before it instead of letting pages pile up in memory.
+
+    With a response cache, pages that haven't changed since they were cached aren't
+    downloaded again, and only their cached gas-price-section is parsed.
+
+    With page fingerprints, pages whose gas-price-section is the same as when it was
+    last parsed aren't parsed again, and keep the prices and timestamps from then.
+
+    on_parsed, if given, is called with the URL and normalized prices of every page
+    that was actually fetched, but not of pages that failed.
+    """
+    url_objects_by_url = {url_object["url"]: url_object for url_object in urls}
+    fetch_stats = StageStats("fetch")
+    parse_stats = StageStats("parse")
+    fetched = queue.Queue(maxsize=queue_size)
+    parse_slots = threading.Semaphore(queue_size)
+    # Set if this generator is closed early. pages_to_parse runs on the pool's task
+    # handler thread, which every other task on the pool waits behind, so it must
+    # still run to the end
+    stopped = threading.Event()
+    # Only the pool's task handler thread counts submitted pages and only this
+    # generator counts parsed ones, so neither counter needs a lock
+    submitted_count = 0
+    # Stations of unchanged pages, which skip the pool
+    unchanged = queue.SimpleQueue()
+    section_hashes = {}
+
+    def pages_to_parse():
+        nonlocal submitted_count
+        while True:
+            result = fetched.get()
+            if result is None:
+                return
+            if isinstance(result, BaseException):
+                raise result
+            if stopped.is_set():
+                continue
+            url_object = url_objects_by_url[result.url]
+            if response_cache is not None:
+                response_cache.record(result.status_code)
+            page = _page_to_normalize(url_object, result, response_cache)
+            if page_fingerprints is not None and page is not None:
+                section_hash = page_fingerprints.hash_section(page, extractor)
+                prices = page_fingerprints.unchanged_prices(result.url, section_hash)
+                if prices is not None:
+                    unchanged.put(
+                        (result.url, {**_normalized_station(url_object), **prices})
+                    )
+                    continue
+                section_hashes[result.url] = section_hash
+            parse_slots.acquire()
+            if stopped.is_set():
+                continue
+            submitted_count += 1
+            yield url_object, page, extractor, result.fetched_at_ms
+
+    fetch_thread = threading.Thread(
+        target=_run_fetch_stage,
+        args=(
+            urls,
+            concurrency,
+            max_rate_per_s,
+            response_cache,
+            fetched,
+            fetch_stats,
+            stopped,
+            initial_rate_per_s,
+        ),
+        daemon=True,
+    )
+    fetch_thread.start()
+
+    def unchanged_stations():
+        while True:
+            try:
+                url, station = unchanged.get_nowait()
+            except queue.Empty:
+                return
+            if on_parsed is not None:
+                on_parsed(url, station)
+            yield station
+
+    try:
+        results = pool.imap_unordered(_normalize_page_from_args, pages_to_parse())
+        while True:
+            try:
+                url, was_fetched, station, parse_s = results.next(_unchanged_poll_s)
+            except multiprocessing.TimeoutError:
+                yield from unchanged_stations()
+                continue
+            except StopIteration:
+                break
+            parse_stats.record(submitted_count - parse_stats.count)
+            run_metrics.observe("costco_parse_seconds", parse_s)
+            parse_slots.release()
+            section_hash = section_hashes.pop(url, None)
+            if page_fingerprints is not None and section_hash is not None:
+                page_fingerprints.record(url, section_hash, station)
+            if on_parsed is not None and was_fetched:
+                on_parsed(url, station)
+            yield station
+            yield from unchanged_stations()
+        yield from unchanged_stations()
+    except BaseException:
+        stopped.set()
+        # Wake pages_to_parse if it's waiting for a parse slot
+        parse_slots.release()
+        raise
+    fetch_thread.join()
+    fetch_stats.log()
+    parse_stats.log()
+    if page_fingerprints is not None:
+        logger.info(
+            "Skipped parsing {count} Costco pages that were unchanged",
+            count=page_fingerprints.unchanged_count,
+        )
+        run_metrics.set_gauge(
+            "costco_unchanged_pages", page_fingerprints.unchanged_count
+        )
+    run_metrics.set_gauge("costco_parse_stage_seconds", parse_stats.elapsed_s)
+
+
+def read_station_urls() -> list:
+    logger.info(
+        "Reading Costco URLs from {file_name}",
+        file_name=costco_station_urls_file_name,
+    )
+    with open(costco_station_urls_file_name, "r") as urls_file:
+        return json.loads(urls_file.read())
+
+
+def _read_published_stations(args) -> list:
+    # The DB repo's working copy has the last published prices. Runs that don't
+    # publish only have the prices file they write locally
+    for file_name in (
+        os.path.join(args.db_repo_clone_dir, publish.prices_file_name),
+        publish.prices_file_name,
+    ):
+        if os.path.exists(file_name):
+            return publish.read_prices_file(file_name)
+    return []
+
+
+def _seed_histories(histories: dict, url_objects_by_url: dict, args) -> int:
+    """
+    Gives stations without a refresh history one from their published prices, so
+    a deployment that starts using a request budget, or loses its refresh state,
+    doesn't treat every station as never fetched. Returns how many were seeded.
+    """
+    unseeded_urls_by_key = {
+        merge.station_key(_normalized_station(url_object)): url
+        for url, url_object in url_objects_by_url.items()
+        if url not in histories
+    }
+    if not unseeded_urls_by_key:
+        return 0
+    seeded_count = 0
+    for station in _read_published_stations(args):
+        url = unseeded_urls_by_key.get(merge.station_key(station))
+        if url is None:
+            continue
+        history = refresh.seed_history(station)
+        if history is not None:
+            histories[url] = history
+            seeded_count += 1
+    return seeded_count
+
+
+def collect_stations(
+    args,
+    pool: Pool,
+    response_cache: httpcache.ResponseCache | None = None,
+    station_list_delta: StationListDelta | None = None,
+):
+    """
+    Entry point for the franchise scheduler.
+
+    Warehouses with a fresh result in the run journal aren't fetched again. Of the
+    rest, the refresh scheduler picks which to fetch within the request budget, if
+    there is one, and the others reuse their last fetched result. Stations without
+    a refresh history start from their published prices, if any.
+
+    If the station list was refreshed earlier in the run, pass the delta it returned
+    as station_list_delta. Its list is collected instead of the saved one, closed
+    stations are dropped along with their refresh history, and new stations are
+    fetched ahead of every other station. Under a request budget, new stations that
+    don't fit are deferred to a later run like any other never-fetched station.
+    """
+    url_objects = (
+        read_station_urls()
+        if station_list_delta is None
+        else station_list_delta.urls
+    )
+    url_objects_by_url = {url_object["url"]: url_object for url_object in url_objects}
+    new_urls = (
+        set()
+        if station_list_delta is None
+        else {url_object["url"] for url_object in station_list_delta.added}
+    )
+    run_journal = journal.open_run_journal(args)
+    page_fingerprints = fingerprints.open_page_fingerprints(args)
+    schedule_refreshes = args.request_budget is not None
+    histories = (
+        refresh.read_refresh_state(args.refresh_state_file)
+        if schedule_refreshes
+        else {}
+    )
+    # Stations dropped from the station list are closed, so their history goes too
+    closed_urls = [url for url in histories if url not in url_objects_by_url]
+    for url in closed_urls:
+        del histories[url]
+    if closed_urls:
+        logger.info(
+            "Dropped the refresh history of {count} closed Costco stations",
+            count=len(closed_urls),
+        )
+    if schedule_refreshes:
+        seeded_count = _seed_histories(histories, url_objects_by_url, args)
+        if seeded_count:
+            logger.info(
+                "Seeded the refresh history of {count} Costco stations from their published prices",
+                count=seeded_count,
+            )
+
+    def on_parsed(url: str, station: dict) -> None:
+        if run_journal is not None:
+            run_journal.record(url, station)
+        if schedule_refreshes:
+            refresh.record_fetch(histories, url, station, now_in_epoch_ms())
+
+    try:
+        journaled_stations = (
+            run_journal.fresh_results() if run_journal is not None else {}
+        )
+        plan = refresh.plan_refresh(
+            # Stations that have never been fetched are planned in order, so new
+            # stations go first. sorted() keeps the order of the rest
+            sorted(
+                (url for url in url_objects_by_url if url not in journaled_stations),
+                key=lambda url: url not in new_urls,
+            ),
+            histories,
+            args.request_budget,
+            now_in_epoch_ms(),
+        )
+        logger.info(
+            "Fetching {fetch_count} Costco warehouses. Reusing {journaled_count} results from the run journal and {reused_count} from earlier runs. Deferring {deferred_count} new warehouses",
+            fetch_count=len(plan.to_fetch),
+            journaled_count=len(journaled_stations),
+            reused_count=len(plan.to_reuse),
+            deferred_count=len(plan.deferred),
+        )
+        for url in url_objects_by_url:
+            if url in journaled_stations:
+                yield journaled_stations[url]
+        for url in plan.to_reuse:
+            yield histories[url]["station"]
+        yield from iter_normalized_data(
+            [url_objects_by_url[url] for url in plan.to_fetch],
+            args.fetch_concurrency,
+            args.max_request_rate,
+            pool,
+            args.extractor,
+            response_cache,
+            queue_size=2 * args.cpu_pool_size,
+            on_parsed=on_parsed,
+            page_fingerprints=page_fingerprints,
+            initial_rate_per_s=args.initial_request_rate,
+        )
+        parse_stage_s = run_metrics.gauges.get("costco_parse_stage_seconds", 0)
+        if parse_stage_s > 0:
+            # Share of the parse stage the pool's processes spent parsing
+            run_metrics.set_gauge(
+                "costco_pool_utilization",
+                run_metrics.total("costco_parse_seconds")
+                / (parse_stage_s * args.cpu_pool_size),
+            )
+    finally:
+        if run_journal is not None:
+            run_journal.close()
+        if schedule_refreshes:
+            refresh.write_refresh_state(args.refresh_state_file, histories)
+        if page_fingerprints is not None:
+            page_fingerprints.retain(url_objects_by_url)
+            fingerprints.write_page_fingerprints(
+                args.page_fingerprints_file, page_fingerprints
+            )
+
+
+def get_and_normalize_all_data(
+    urls: list,
+    concurrency: int,
+    max_rate_per_s: float,
+    pool: Pool,
+    extractor: str = extract.default_backend,
+    response_cache: httpcache.ResponseCache | None = None,
+    page_fingerprints: fingerprints.PageFingerprints | None = None,
+    initial_rate_per_s: float | None = None,
+) -> list:
+    p_start = time.perf_counter()
+    data = list(
+        iter_normalized_data(
+            urls,
+            concurrency,
+            max_rate_per_s,
+            pool,
+            extractor,
+            response_cache,
+            page_fingerprints=page_fingerprints,
+            initial_rate_per_s=initial_rate_per_s,
+        )
+    )
+    p_end = time.perf_counter()
+    logger.info(
+        "Fetched and parsed {count} Costco warehouse pages in {time_s} s",
+        count=len(data),
+        time_s=p_end - p_start,
+    )
+    return data
+
+
 def main(args):
     urls = None
+    response_cache = httpcache.open_response_cache(args)
     if args.refresh_station_list:
         logger.info("Updating list of Costco gas station URLs")
-        urls = get_and_write_all_gas_station_urls()
+        urls = get_and_write_all_gas_station_urls(response_cache).urls
     if args.no_collect_prices:
         logger.info('Will not collect prices as "--no-collect-prices" was specified')
     else:
         if urls is None:
-            logger.info(
-                "Reading Costco URLs from {file_name}",
-                file_name=costco_station_urls_file_name,
-            )
-            with open(costco_station_urls_file_name, "r") as urls_file:
-                urls = json.loads(urls_file.read())
+            urls = read_station_urls()
+        page_fingerprints = fingerprints.open_page_fingerprints(args)
         logger.info(
-            "Creating pool of size {pool_size} to get Costco prices",
+            "Creating pool of size {pool_size} to parse Costco prices",
             pool_size=args.cpu_pool_size,
         )
         with Pool(processes=args.cpu_pool_size) as p:
             p_start = time.perf_counter()
-            data = p.map(get_and_normalize_data_from_url, urls)
+            data = get_and_normalize_all_data(
+                urls,
+                args.fetch_concurrency,
+                args.max_request_rate,
+                p,
+                args.extractor,
+                response_cache,
+                page_fingerprints,
+                args.initial_request_rate,
+            )
             data_with_nulls_removed = [price for price in data if price is not None]
             p_end = time.perf_counter()
             logger.info(
                 "Got prices for all Costcos in {time_s} s", time_s=p_end - p_start
             )
-        with open(_prices_output_file_name, "w") as out_file:
-            out_file.write(json.dumps(data_with_nulls_removed, indent=2))
+        serializers.write_stations(
+            _prices_output_file_stem, data_with_nulls_removed, args.output_format
+        )
+        if page_fingerprints is not None:
+            page_fingerprints.retain(url_object["url"] for url_object in urls)
+            fingerprints.write_page_fingerprints(
+                args.page_fingerprints_file, page_fingerprints
+            )
+    if response_cache is not None:
+        response_cache.evict()
+    http_session.log_connection_stats()
 
 
 if __name__ == "__main__":
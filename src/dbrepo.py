@@ -0,0 +1,136 @@
+from contextlib import contextmanager
+from loguru import logger
+from metrics import run_metrics
+import os
+import shutil
+import subprocess
+import time
+
+
+class DbRepo:
+    """
+    A working copy of the pricing DB repo that's kept between runs.
+
+    sync() brings an existing copy up to date with a shallow fetch and a hard reset,
+    and only clones when there's no usable copy. Every git phase is timed in timings.
+    """
+
+    def __init__(self, repo_url: str, clone_dir: str):
+        self.repo_url = repo_url
+        self.clone_dir = clone_dir
+        self.branch = None
+        self.timings = {}
+
+    @contextmanager
+    def _timed(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_s = time.perf_counter() - start
+            self.timings[phase] = self.timings.get(phase, 0) + elapsed_s
+            run_metrics.observe(
+                "db_repo_{phase}_seconds".format(phase=phase), elapsed_s
+            )
+
+    def _git(self, *git_args: str, cwd: str | None = None) -> str:
+        try:
+            completed = subprocess.run(
+                ["git", *git_args],
+                cwd=self.clone_dir if cwd is None else cwd,
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(
+                "git {command} failed with exit code {code}: {stderr}".format(
+                    command=git_args[0], code=e.returncode, stderr=e.stderr.strip()
+                )
+            ) from e
+        return completed.stdout.strip()
+
+    def _clone(self) -> None:
+        shutil.rmtree(self.clone_dir, ignore_errors=True)
+        with self._timed("clone"):
+            self._git(
+                "clone",
+                "--depth=1",
+                self.repo_url,
+                self.clone_dir,
+                cwd=os.getcwd(),
+            )
+        self.branch = self._git("rev-parse", "--abbrev-ref", "HEAD")
+
+    def _is_reusable(self) -> bool:
+        if not os.path.isdir(os.path.join(self.clone_dir, ".git")):
+            return False
+        try:
+            return self._git("remote", "get-url", "origin") == self.repo_url
+        except RuntimeError:
+            return False
+
+    def sync(self) -> None:
+        """
+        Makes the working copy match the remote's default branch, discarding anything
+        left over from a previous run.
+        """
+        if not self._is_reusable():
+            logger.info("Cloning database repo...")
+            self._clone()
+            logger.info(
+                "Pricing DB repo cloned in {time_s} s", time_s=self.timings["clone"]
+            )
+            return
+        logger.info("Updating existing clone of database repo...")
+        try:
+            # The working copy is only ever on the branch it was cloned with
+            self.branch = self._git("rev-parse", "--abbrev-ref", "HEAD")
+            with self._timed("fetch"):
+                self._git("fetch", "--depth=1", "origin", self.branch)
+            with self._timed("reset"):
+                self._git("reset", "--hard", "FETCH_HEAD")
+                self._git("clean", "-fdx")
+        except RuntimeError as e:
+            logger.warning(
+                "Failed to update existing clone of database repo, cloning again: {error}",
+                error=e,
+            )
+            self._clone()
+        logger.info(
+            "Pricing DB repo updated in {time_s} s",
+            time_s=sum(self.timings.values()),
+        )
+
+    def path(self, file_name: str) -> str:
+        return os.path.join(self.clone_dir, file_name)
+
+    def commit_and_tag(
+        self, paths: list, message: str, tag: str, tag_message: str
+    ) -> None:
+        with self._timed("commit"):
+            # Adding a directory also stages the files removed from it
+            self._git("add", "--", *paths)
+            self._git("commit", "-m", message)
+            self._git("tag", "-a", "-f", "-m", tag_message, tag)
+
+    def push(self, tag: str) -> None:
+        # The branch and the tag go out in a single push. Only the tag is forced, since
+        # a rerun on the same day moves it
+        with self._timed("push"):
+            self._git(
+                "push",
+                "--atomic",
+                "origin",
+                "HEAD:refs/heads/{branch}".format(branch=self.branch),
+                "+refs/tags/{tag}:refs/tags/{tag}".format(tag=tag),
+            )
+
+    def log_timings(self) -> None:
+        logger.info(
+            "DB repo git timings: {timings}",
+            timings=", ".join(
+                "{phase}={time_s:.3f} s".format(phase=phase, time_s=time_s)
+                for phase, time_s in self.timings.items()
+            ),
+        )
@@ -0,0 +1,153 @@
+from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+import re
+
+
+default_backend = "section"
+
+_div_tag_regex = re.compile(r"<(/?)div\b", re.IGNORECASE)
+
+
+def slice_gas_price_section(html: str) -> str | None:
+    """
+    Returns the markup of the first div.gas-price-section in html, from its opening
+    tag through its matching closing tag, or None if it can't be found.
+    """
+    # A plain substring search is much cheaper than a regex over the whole page, but
+    # the class name may also show up in stylesheets or scripts before the div
+    class_index = html.find("gas-price-section")
+    while class_index != -1:
+        section_start = html.rfind("<div", 0, class_index)
+        if section_start != -1 and ">" not in html[section_start:class_index]:
+            break
+        class_index = html.find("gas-price-section", class_index + 1)
+    else:
+        return None
+    depth = 0
+    for div_tag in _div_tag_regex.finditer(html, section_start):
+        depth += -1 if div_tag.group(1) else 1
+        if depth == 0:
+            return html[section_start : html.index(">", div_tag.end()) + 1]
+    return None
+
+
+class _GasPriceSectionParser(HTMLParser):
+    """
+    Tokenizes a sliced gas-price-section and collects the spans under every div in it
+    the same way BeautifulSoup's find_all would: each div sees all of its descendant
+    spans in document order, and each span's text includes its descendants' text.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.div_spans = []
+        self._open_tags = []
+        # Span lists of the divs inside the section that are currently open
+        self._open_div_spans = []
+        # [is_gas_type, text_parts] of the spans that are currently open
+        self._open_spans = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "div":
+            if self._open_tags:
+                spans = []
+                self.div_spans.append(spans)
+                self._open_div_spans.append(spans)
+            else:
+                # The section itself
+                self._open_div_spans.append(None)
+        elif tag == "span":
+            classes = (dict(attrs).get("class") or "").split()
+            span = [("gas-type" in classes), []]
+            for spans in self._open_div_spans:
+                if spans is not None:
+                    spans.append(span)
+            self._open_spans.append(span)
+        self._open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in self._open_tags:
+            return
+        # Implicitly close anything left open inside this tag
+        while self._open_tags:
+            open_tag = self._open_tags.pop()
+            if open_tag == "div":
+                self._open_div_spans.pop()
+            elif open_tag == "span":
+                self._open_spans.pop()
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        for _, text_parts in self._open_spans:
+            text_parts.append(data)
+
+
+def _gas_prices_from_spans(div_spans: list) -> list:
+    gas_prices = []
+    for spans in div_spans:
+        grade = None
+        price_text = None
+        for is_gas_type, text in spans:
+            if grade is None and is_gas_type:
+                grade = text
+            else:
+                price_text = text
+        gas_prices.append((grade, price_text))
+    return gas_prices
+
+
+def extract_with_section_slice(html: str) -> list | None:
+    section = slice_gas_price_section(html)
+    if section is None:
+        return None
+    parser = _GasPriceSectionParser()
+    parser.feed(section)
+    parser.close()
+    return _gas_prices_from_spans(
+        [
+            [(is_gas_type, "".join(text_parts)) for is_gas_type, text_parts in spans]
+            for spans in parser.div_spans
+        ]
+    )
+
+
+def extract_with_html5lib(html: str) -> list | None:
+    soup = BeautifulSoup(html, "html5lib")
+    gas_price_section = soup.find("div", attrs={"class": "gas-price-section"})
+    if gas_price_section is None:
+        return None
+    return _gas_prices_from_spans(
+        [
+            [
+                (
+                    "gas-type" in meaningful_descendant.get_attribute_list("class"),
+                    meaningful_descendant.text,
+                )
+                for meaningful_descendant in gas_price.find_all("span")
+            ]
+            for gas_price in gas_price_section.find_all("div")
+        ]
+    )
+
+
+backends = {
+    # Slices out the gas-price-section and tokenizes only that
+    "section": extract_with_section_slice,
+    # Builds the full document tree. Slowest, but the most forgiving of odd markup
+    "html5lib": extract_with_html5lib,
+}
+
+
+def extract_gas_prices(html: str, backend: str = default_backend) -> list | None:
+    """
+    Returns a (grade, price text) tuple for every div in the page's
+    gas-price-section, or None if the page has no gas-price-section.
+
+    If a faster backend can't find any gas prices, the page is re-extracted with
+    html5lib before giving up.
+    """
+    gas_prices = backends[backend](html)
+    if backend != "html5lib" and not gas_prices:
+        gas_prices = extract_with_html5lib(html)
+    return gas_prices
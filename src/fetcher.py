@@ -0,0 +1,227 @@
+import aiohttp
+import asyncio
+from helpers import (
+    get_request_log_fmt_str,
+    api_response_log_fmt_str,
+    now_in_epoch_ms,
+)
+import http_session
+import httpcache
+from loguru import logger
+from metrics import run_metrics
+import ratelimit
+import time
+from typing import NamedTuple
+
+
+_request_timeout_s = 30
+_max_attempts = 4
+
+
+class FetchResult(NamedTuple):
+    url: str
+    # None if the request was never made or failed before a response was received
+    status_code: int | None
+    text: str | None
+    elapsed_s: float
+    attempts: int
+    etag: str | None = None
+    last_modified: str | None = None
+    # When the response was received, as the observation time of its prices
+    fetched_at_ms: int | None = None
+    # The cached content of a page that was not modified
+    cached_content: str | None = None
+
+
+async def _fetch(
+    session: aiohttp.ClientSession,
+    rate_controller: ratelimit.RateController,
+    response_cache: httpcache.ResponseCache | None,
+    url: str,
+) -> FetchResult:
+    host_rate_controller = rate_controller.for_url(url)
+    cached_response = response_cache.get(url) if response_cache is not None else None
+    request_headers = httpcache.conditional_headers(cached_response)
+    p_start = time.perf_counter()
+    status_code = None
+    text = None
+    etag = None
+    last_modified = None
+    fetched_at_ms = None
+    attempts = 0
+    while attempts < _max_attempts:
+        started_at = await host_rate_controller.acquire()
+        if host_rate_controller.gave_up:
+            await host_rate_controller.release(started_at)
+            logger.warning("Gave up on this host, not requesting {url}", url=url)
+            break
+        attempts += 1
+        logger.debug(get_request_log_fmt_str, url=url)
+        try:
+            async with session.get(url, headers=request_headers) as resp:
+                body = await resp.read()
+                run_metrics.observe("fetch_bytes", len(body))
+                text = await resp.text()
+                status_code = resp.status
+                fetched_at_ms = now_in_epoch_ms()
+                etag = resp.headers.get("ETag")
+                last_modified = resp.headers.get("Last-Modified")
+                retry_after_s = ratelimit.parse_retry_after(
+                    resp.headers.get("Retry-After")
+                )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            await host_rate_controller.release(started_at)
+            run_metrics.increment("fetch_errors")
+            logger.error("GET request to {url} failed: {err}", url=url, err=repr(err))
+            break
+        await host_rate_controller.release(started_at, status_code, retry_after_s)
+        logger.info(api_response_log_fmt_str, status_code=status_code, url=url)
+        if status_code == 403:
+            run_metrics.increment("fetch_forbidden")
+            break
+        if status_code != 429:
+            break
+        run_metrics.increment("fetch_throttled")
+        logger.warning(
+            "Being rate limited or honeypotted on attempt {attempt} for {url}",
+            attempt=attempts,
+            url=url,
+        )
+    elapsed_s = time.perf_counter() - p_start
+    run_metrics.observe("fetch_latency_seconds", elapsed_s)
+    run_metrics.increment("fetch_requests", attempts)
+    if attempts > 1:
+        run_metrics.increment("fetch_retries", attempts - 1)
+    if status_code == 304:
+        run_metrics.increment("fetch_not_modified")
+    return FetchResult(
+        url=url,
+        status_code=status_code,
+        text=text if status_code == 200 else None,
+        elapsed_s=elapsed_s,
+        attempts=attempts,
+        etag=etag,
+        last_modified=last_modified,
+        fetched_at_ms=fetched_at_ms,
+        cached_content=(
+            cached_response["content"]
+            if status_code == 304 and cached_response is not None
+            else None
+        ),
+    )
+
+
+def _connection_counting_trace_config(connection_stats: dict) -> aiohttp.TraceConfig:
+    async def on_connection_create_end(session, context, params):
+        connection_stats["connections"] += 1
+
+    async def on_connection_reuseconn(session, context, params):
+        connection_stats["reused"] += 1
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    return trace_config
+
+
+def _client_session(concurrency: int, connection_stats: dict) -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=concurrency),
+        timeout=aiohttp.ClientTimeout(total=_request_timeout_s),
+        headers=http_session.default_headers,
+        trace_configs=[_connection_counting_trace_config(connection_stats)],
+    )
+
+
+def _log_fetch_stats(
+    connection_stats: dict, rate_controller: ratelimit.RateController
+) -> None:
+    logger.info(
+        "Fetcher opened {connections} connections and reused them {reused} times",
+        **connection_stats,
+    )
+    for host_rate_controller in rate_controller.hosts.values():
+        logger.info(
+            "Throttled {count} times by {host}, ending at {rate_per_s:.2f} requests/s with concurrency {concurrency}",
+            count=host_rate_controller.throttle_count,
+            host=host_rate_controller.host,
+            rate_per_s=host_rate_controller.bucket.rate_per_s,
+            concurrency=int(host_rate_controller.concurrency),
+        )
+
+
+async def fetch_all_async(
+    urls: list,
+    concurrency: int,
+    max_rate_per_s: float,
+    response_cache: httpcache.ResponseCache | None = None,
+    initial_rate_per_s: float | None = None,
+) -> list:
+    """
+    Fetches every URL over one connection-pooled client session.
+
+    Requests are paced per host by a shared RateController, which starts at
+    initial_rate_per_s requests/s (by default, max_rate_per_s) and `concurrency`
+    requests in flight, speeds up to max_rate_per_s while requests succeed, and backs
+    off on a 429. Requests that got a 429 are retried after the backoff. After a 403,
+    no more requests are made to that host. Results are in the same order as urls.
+
+    If a response cache is given, requests are conditional on the cached validators,
+    and an unchanged page comes back as a 304 with no text.
+    """
+    rate_controller = ratelimit.RateController(
+        max_rate_per_s, concurrency, initial_rate_per_s=initial_rate_per_s
+    )
+    connection_stats = {"connections": 0, "reused": 0}
+    async with _client_session(concurrency, connection_stats) as session:
+        results = await asyncio.gather(
+            *(_fetch(session, rate_controller, response_cache, url) for url in urls)
+        )
+    _log_fetch_stats(connection_stats, rate_controller)
+    return results
+
+
+async def iter_fetch_all_async(
+    urls: list,
+    concurrency: int,
+    max_rate_per_s: float,
+    response_cache: httpcache.ResponseCache | None = None,
+    initial_rate_per_s: float | None = None,
+):
+    """
+    Like fetch_all_async, but yields each result as soon as its request completes
+    instead of waiting for all of them.
+    """
+    rate_controller = ratelimit.RateController(
+        max_rate_per_s, concurrency, initial_rate_per_s=initial_rate_per_s
+    )
+    connection_stats = {"connections": 0, "reused": 0}
+    async with _client_session(concurrency, connection_stats) as session:
+        for next_result in asyncio.as_completed(
+            [_fetch(session, rate_controller, response_cache, url) for url in urls]
+        ):
+            yield await next_result
+    _log_fetch_stats(connection_stats, rate_controller)
+
+
+def fetch_all(
+    urls: list,
+    concurrency: int,
+    max_rate_per_s: float,
+    response_cache: httpcache.ResponseCache | None = None,
+    initial_rate_per_s: float | None = None,
+) -> list:
+    p_start = time.perf_counter()
+    results = asyncio.run(
+        fetch_all_async(
+            urls, concurrency, max_rate_per_s, response_cache, initial_rate_per_s
+        )
+    )
+    p_end = time.perf_counter()
+    logger.info(
+        "Fetched {count} URLs with concurrency {concurrency} in {time_s} s",
+        count=len(urls),
+        concurrency=concurrency,
+        time_s=p_end - p_start,
+    )
+    return results
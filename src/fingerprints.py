@@ -0,0 +1,72 @@
+import hashlib
+import json
+import merge
+import os
+
+
+class PageFingerprints:
+    """
+    A hash of the gas-price-section each warehouse page had when it was last parsed,
+    keyed by URL, along with the prices normalized from it. A page whose section
+    hashes the same again doesn't need parsing: its prices are the ones already
+    normalized, and keep the timestamps from when they were first observed.
+
+    The extractor is part of the hash, so switching extractors parses every page
+    again.
+    """
+
+    def __init__(self, entries: dict):
+        self.entries = entries
+        self.unchanged_count = 0
+
+    @staticmethod
+    def hash_section(section: str, extractor: str) -> str:
+        return hashlib.blake2b(
+            (extractor + "\0" + section).encode("utf-8"), digest_size=16
+        ).hexdigest()
+
+    def unchanged_prices(self, url: str, section_hash: str) -> dict | None:
+        """
+        Returns the prices last normalized from the page at url, if its section
+        hashed to section_hash then too.
+        """
+        entry = self.entries.get(url)
+        if entry is None or entry["hash"] != section_hash:
+            return None
+        self.unchanged_count += 1
+        return entry["prices"]
+
+    def record(self, url: str, section_hash: str, station: dict) -> None:
+        self.entries[url] = {
+            "hash": section_hash,
+            "prices": {price_key: station[price_key] for price_key in merge.price_keys},
+        }
+
+    def retain(self, urls) -> None:
+        """
+        Drops the fingerprints of every page not in urls, e.g. of closed stations.
+        """
+        urls = set(urls)
+        self.entries = {
+            url: entry for url, entry in self.entries.items() if url in urls
+        }
+
+
+def read_page_fingerprints(file_name: str) -> PageFingerprints:
+    if not os.path.exists(file_name):
+        return PageFingerprints({})
+    with open(file_name, "r") as fingerprints_file:
+        return PageFingerprints(json.loads(fingerprints_file.read()))
+
+
+def write_page_fingerprints(file_name: str, fingerprints: PageFingerprints) -> None:
+    # Write then rename, so a run killed mid-write can't leave a corrupt file
+    with open(file_name + ".tmp", "w") as fingerprints_file:
+        fingerprints_file.write(json.dumps(fingerprints.entries))
+    os.replace(file_name + ".tmp", file_name)
+
+
+def open_page_fingerprints(args) -> PageFingerprints | None:
+    if args.page_fingerprints_file is None:
+        return None
+    return read_page_fingerprints(args.page_fingerprints_file)
@@ -0,0 +1,154 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import costco
+import functools
+import httpcache
+from loguru import logger
+from metrics import run_metrics
+from multiprocessing import Pool
+from pipeline import StageStats
+import queue
+import samsclub
+import threading
+import time
+from typing import Callable, NamedTuple
+
+
+# How many collected stations may wait to be merged before the sources block
+_results_queue_size = 1024
+# How often a source blocked on a full queue checks whether collection was stopped
+_put_poll_s = 0.1
+
+
+class FranchiseSource(NamedTuple):
+    """
+    A franchise to collect prices from.
+
+    collect(args, executor, response_cache) yields normalized stations and is run on a
+    thread of its own, alongside every other source. If open_executor is given, it's
+    called with args to create the executor passed to collect (e.g. a process pool
+    for CPU-bound parsing), and the executor is closed once every source is done.
+    """
+
+    name: str
+    collect: Callable
+    open_executor: Callable | None = None
+
+
+def make_sources(
+    costco_station_list_delta: costco.StationListDelta | None = None,
+) -> list:
+    """
+    Returns every franchise source. Pass the delta from refreshing the Costco station
+    list earlier in the run, if it was, so Costco collects from it.
+    """
+    return [
+        # Hundreds of small pages: fetched with asyncio, parsed on a process pool
+        FranchiseSource(
+            "COSTCO",
+            functools.partial(
+                costco.collect_stations, station_list_delta=costco_station_list_delta
+            ),
+            open_executor=lambda args: Pool(processes=args.cpu_pool_size),
+        ),
+        # One large API response, or a browser session if that's blocked. Neither
+        # needs more than the source's own thread
+        FranchiseSource("SAMS_CLUB", samsclub.collect_stations),
+    ]
+
+
+sources = make_sources()
+
+
+def iter_all_stations(
+    franchise_sources: list,
+    args,
+    response_cache: httpcache.ResponseCache | None = None,
+):
+    """
+    Runs every franchise source at once and yields stations as they're collected, in
+    no particular order. If a source fails, its error is raised once the others have
+    finished. If the caller stops early, the sources are stopped too.
+    """
+    finished = object()
+    results = queue.Queue(maxsize=_results_queue_size)
+    stopped = threading.Event()
+    source_stats = {
+        source.name: StageStats(source.name) for source in franchise_sources
+    }
+
+    def put(item) -> bool:
+        # A plain put would block forever on a full queue nobody reads anymore
+        while not stopped.is_set():
+            try:
+                results.put(item, timeout=_put_poll_s)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(source: FranchiseSource, executor) -> None:
+        try:
+            with contextlib.closing(
+                source.collect(args, executor, response_cache)
+            ) as stations:
+                for station in stations:
+                    source_stats[source.name].record(results.qsize())
+                    if not put(station):
+                        return
+        finally:
+            put(finished)
+
+    p_start = time.perf_counter()
+    with contextlib.ExitStack() as executors:
+        # Process pools are created here on the main thread, before any of the source
+        # threads exist to be forked
+        source_executors = [
+            (
+                executors.enter_context(source.open_executor(args))
+                if source.open_executor is not None
+                else None
+            )
+            for source in franchise_sources
+        ]
+        with ThreadPoolExecutor(
+            max_workers=len(franchise_sources), thread_name_prefix="franchise"
+        ) as threads:
+            futures = [
+                threads.submit(run, source, executor)
+                for source, executor in zip(franchise_sources, source_executors)
+            ]
+            running_count = len(futures)
+            try:
+                while running_count > 0:
+                    station = results.get()
+                    if station is finished:
+                        running_count -= 1
+                        continue
+                    yield station
+            finally:
+                # Lets the sources finish if the caller stopped early, before the
+                # thread pool waits for them
+                stopped.set()
+            for source, future in zip(franchise_sources, futures):
+                if future.exception() is not None:
+                    logger.error(
+                        "Failed to collect prices for {franchise}",
+                        franchise=source.name,
+                    )
+            for future in futures:
+                future.result()
+    for stats in source_stats.values():
+        stats.log()
+        run_metrics.observe(
+            "{franchise}_collect_seconds".format(franchise=stats.name.lower()),
+            stats.elapsed_s,
+        )
+        run_metrics.increment(
+            "{franchise}_stations".format(franchise=stats.name.lower()), stats.count
+        )
+    logger.info(
+        "Collected prices for {count} franchises in {time_s} s",
+        count=len(franchise_sources),
+        time_s=time.perf_counter() - p_start,
+    )
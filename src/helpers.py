@@ -1,10 +1,15 @@
 import argparse
 from datetime import timezone
-from datetime import datetime
-import json
+import extract
+import journal
+from json.encoder import encode_basestring_ascii
 import logging
 from loguru import logger
+import logsink
 import multiprocessing as mp
+import publish
+import serializers
+import shards
 import sys
 import time
 
@@ -40,6 +45,26 @@ def parse_command_args():
         default=False,
         help="Denotes whether to structure log statements",
     )
+    arg_parser.add_argument(
+        "--async-logging",
+        action="store_true",
+        default=False,
+        help="Write log statements to stdout from a background thread in each process, so logging doesn't hold up fetching and parsing",
+    )
+    arg_parser.add_argument(
+        "--log-sample-rate",
+        action="store",
+        type=float,
+        default=1,
+        help="Fraction of gas station URLs to log DEBUG and INFO statements about. Warnings and errors are always logged",
+    )
+    arg_parser.add_argument(
+        "--max-warnings-per-minute",
+        action="store",
+        type=int,
+        default=None,
+        help="Maximum number of warnings each log statement may log per minute. Unlimited if not given",
+    )
     arg_parser.add_argument(
         "--refresh-station-list",
         action="store_true",
@@ -51,7 +76,121 @@ def parse_command_args():
         action="store",
         type=int,
         default=mp.cpu_count(),
-        help="Number of subprocesses to use for gas station data retrieval (for applicable franchises). Recommend a value within [2,4] to balance speed and rate limiting mitigation",
+        help="Number of subprocesses to use for gas station data parsing (for applicable franchises)",
+    )
+    arg_parser.add_argument(
+        "--fetch-concurrency",
+        action="store",
+        type=int,
+        default=4,
+        help="Maximum number of in-flight HTTP requests per host when fetching gas station pages (for applicable franchises). Backs off automatically when rate limited",
+    )
+    arg_parser.add_argument(
+        "--initial-request-rate",
+        action="store",
+        type=float,
+        default=5,
+        help="Requests per second per host to start fetching gas station pages at (for applicable franchises). Speeds up towards --max-request-rate while requests succeed, and backs off automatically when rate limited",
+    )
+    arg_parser.add_argument(
+        "--max-request-rate",
+        action="store",
+        type=float,
+        default=20,
+        help="Maximum requests per second per host when fetching gas station pages (for applicable franchises)",
+    )
+    arg_parser.add_argument(
+        "--extractor",
+        action="store",
+        type=str,
+        choices=list(extract.backends),
+        default=extract.default_backend,
+        help="How to extract gas prices from Costco warehouse pages. html5lib parses the whole page and is much slower",
+    )
+    arg_parser.add_argument(
+        "--samsclub-fetch-mode",
+        action="store",
+        type=str,
+        choices=["auto", "direct", "browser"],
+        default="auto",
+        help="How to get Sam's Club data. auto requests the API directly and only falls back to headless Firefox if that's blocked",
+    )
+    arg_parser.add_argument(
+        "--http-cache-dir",
+        action="store",
+        type=str,
+        default=None,
+        help="Directory for an on-disk cache of page validators and gas price sections, so unchanged pages are neither downloaded nor parsed again. Disabled if not given",
+    )
+    arg_parser.add_argument(
+        "--http-cache-ttl-hours",
+        action="store",
+        type=float,
+        default=24,
+        help="How long a cached page may be revalidated instead of fetched in full",
+    )
+    arg_parser.add_argument(
+        "--http-cache-max-mb",
+        action="store",
+        type=int,
+        default=64,
+        help="Size of the on-disk HTTP cache above which the least recently used entries are evicted",
+    )
+    arg_parser.add_argument(
+        "--request-budget",
+        action="store",
+        type=int,
+        default=None,
+        help="Maximum number of gas station pages to fetch per run (for applicable franchises). Stations that have never been fetched come first, then those whose prices change most often, and the rest reuse their last fetched prices. Every station is fetched, and no refresh state is kept, if not given",
+    )
+    arg_parser.add_argument(
+        "--refresh-state-file",
+        action="store",
+        type=str,
+        default="costco-refresh-state.json",
+        help="File to keep each station's fetch history and last fetched prices in, for --request-budget",
+    )
+    arg_parser.add_argument(
+        "--page-fingerprints-file",
+        action="store",
+        type=str,
+        default=None,
+        help="File to keep a hash of each gas station page's prices section in, along with the prices parsed from it, so pages that haven't changed since the last run aren't parsed again and keep the timestamps their prices were first seen at (for applicable franchises). Disabled if not given",
+    )
+    arg_parser.add_argument(
+        "--run-journal",
+        action="store",
+        type=str,
+        default=None,
+        help="SQLite file to record each station's result in as soon as it's collected, so a run that dies partway through can be resumed by running it again with the same --run-id. Disabled if not given",
+    )
+    arg_parser.add_argument(
+        "--run-journal-freshness-minutes",
+        action="store",
+        type=float,
+        default=60,
+        help="How recently a station must have been collected for a resumed run to reuse its result from the run journal",
+    )
+    arg_parser.add_argument(
+        "--run-id",
+        action="store",
+        type=str,
+        default=journal.default_run_id(),
+        help="ID of this run in the run journal. Defaults to the Cloud Run Job execution if there is one, or today's date, so a run restarted the same day resumes",
+    )
+    arg_parser.add_argument(
+        "--price-history-db",
+        action="store",
+        type=str,
+        default=None,
+        help="SQLite file to append every collected price to, for history queries with history.py. Disabled if not given",
+    )
+    arg_parser.add_argument(
+        "--run-report",
+        action="store",
+        type=str,
+        default=None,
+        help="Write the run's timings and counters (e.g. fetch latency and parse time percentiles) to this path plus .json and .prom, the Prometheus text format. The report is always logged at the end of a run",
     )
     arg_parser.add_argument(
         "--no-collect-prices",
@@ -71,6 +210,43 @@ def parse_command_args():
         default=False,
         help="Whether to not write pricing update to the local filesystem. You will likely use this flag in the cloud.",
     )
+    arg_parser.add_argument(
+        "--output-format",
+        action="store",
+        type=str,
+        choices=serializers.serializers,
+        default="json",
+        help="Format of the collected prices written by costco.py and samsclub.py. With scraper.py, a format other than json also writes this run's prices to prices-out in that format; prices.json stays JSON",
+    )
+    arg_parser.add_argument(
+        "--shard-by",
+        action="store",
+        type=str,
+        choices=shards.shard_by_choices,
+        default=None,
+        help="Also write prices as one file per state or geohash prefix, with a manifest of their hashes, so clients can fetch only their region. Disabled if not given",
+    )
+    arg_parser.add_argument(
+        "--geohash-precision",
+        action="store",
+        type=int,
+        default=2,
+        help="Length of the geohash prefix that names each shard when sharding by geohash",
+    )
+    arg_parser.add_argument(
+        "--db-repo-url",
+        action="store",
+        type=str,
+        default=publish.db_repo_url_ssh,
+        help="The git repo to push pricing updates to. Point this at a local bare repo to test publishing without affecting the pricing DB",
+    )
+    arg_parser.add_argument(
+        "--db-repo-clone-dir",
+        action="store",
+        type=str,
+        default=publish.db_repo_clone_dir,
+        help="Where to keep the working copy of the DB repo. It's reused by later runs instead of cloning again",
+    )
     arg_parser.add_argument(
         "--use-mounted-deploy-key",
         action="store_true",
@@ -80,16 +256,25 @@ def parse_command_args():
     return arg_parser.parse_args()
 
 
+_severity_fragments = {}
+
+
 def serialize_log(record):
-    timestamp_iso = datetime.fromtimestamp(
-        record["time"].timestamp(), tz=timezone.utc
-    ).isoformat()
-    subset = {
-        "timestamp": timestamp_iso,
-        "severity": record["level"].name,
-        "message": record["message"],
-    }
-    return json.dumps(subset)
+    # Equivalent to json.dumps of {"timestamp", "severity", "message"}, but only the
+    # message needs encoding per record
+    level_name = record["level"].name
+    severity_fragment = _severity_fragments.get(level_name)
+    if severity_fragment is None:
+        severity_fragment = _severity_fragments[level_name] = (
+            '", "severity": ' + encode_basestring_ascii(level_name) + ', "message": '
+        )
+    return (
+        '{"timestamp": "'
+        + record["time"].astimezone(timezone.utc).isoformat()
+        + severity_fragment
+        + encode_basestring_ascii(record["message"])
+        + "}"
+    )
 
 
 def structured_log_formatter(record):
@@ -99,11 +284,24 @@ def structured_log_formatter(record):
 
 def configure_logger(run_args) -> logging.Logger:
     # Replace default stdout registration with the one we will configure
-    logger.remove(0)
+    logger.remove()
+    sink = (
+        logsink.QueuedSink(sys.stdout)
+        if getattr(run_args, "async_logging", False)
+        else sys.stdout
+    )
+    log_filter = logsink.LogFilter(
+        sample_rate=getattr(run_args, "log_sample_rate", 1),
+        max_warnings_per_minute=getattr(run_args, "max_warnings_per_minute", None),
+    )
     if run_args.structured_logging:
         logger.add(
-            sys.stdout, format=structured_log_formatter, level=run_args.log_level
+            sink,
+            format=structured_log_formatter,
+            filter=log_filter,
+            level=run_args.log_level,
+            colorize=False,
         )
     else:
-        logger.add(sys.stdout, level=run_args.log_level)
+        logger.add(sink, filter=log_filter, level=run_args.log_level)
     return logger
@@ -0,0 +1,248 @@
+import argparse
+import helpers
+import json
+from loguru import logger
+import merge
+import sqlite3
+import time
+
+
+_ms_per_day = 86_400_000
+# Prices are stored as integer thousandths of a dollar
+_price_scale = 1000
+
+
+class PriceHistory:
+    """
+    Append-only SQLite store of every price observed for every station and grade.
+
+    Observations are keyed by (station, grade, timestamp) in a WITHOUT ROWID table,
+    so they're clustered on disk in that order: a station's prices over a time range
+    are one contiguous index scan, and re-ingesting a price that was already stored
+    (e.g. an unchanged price that kept its timestamp) is a no-op.
+    """
+
+    def __init__(self, db_file_name: str):
+        self.connection = sqlite3.connect(db_file_name)
+        self.connection.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS stations (
+                id INTEGER PRIMARY KEY,
+                station_key TEXT NOT NULL UNIQUE,
+                franchise_name TEXT NOT NULL,
+                name TEXT NOT NULL,
+                city TEXT NOT NULL,
+                state TEXT NOT NULL,
+                postal_code TEXT NOT NULL,
+                latitude REAL,
+                longitude REAL
+            );
+            CREATE INDEX IF NOT EXISTS stations_state ON stations (state);
+            CREATE TABLE IF NOT EXISTS observations (
+                station_id INTEGER NOT NULL REFERENCES stations (id),
+                grade INTEGER NOT NULL,
+                timestamp INTEGER NOT NULL,
+                price INTEGER NOT NULL,
+                PRIMARY KEY (station_id, grade, timestamp)
+            ) WITHOUT ROWID;
+            """
+        )
+        self._station_ids = dict(
+            self.connection.execute("SELECT station_key, id FROM stations")
+        )
+
+    def _station_id(self, station: dict) -> int:
+        key = merge.station_key(station)
+        station_id = self._station_ids.get(key)
+        if station_id is None:
+            station_id = self.connection.execute(
+                "INSERT INTO stations (station_key, franchise_name, name, city, state, postal_code, latitude, longitude) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    station["franchiseName"],
+                    station["name"],
+                    station["city"],
+                    station["state"],
+                    station["postalCode"],
+                    station["latitude"],
+                    station["longitude"],
+                ),
+            ).lastrowid
+            self._station_ids[key] = station_id
+        return station_id
+
+    def ingest(self, stations) -> int:
+        """
+        Stores every price in stations, which are in the prices.json shape, and
+        returns how many of them weren't already stored.
+        """
+        p_start = time.perf_counter()
+        observations = []
+        with self.connection:
+            for station in stations:
+                station_id = self._station_id(station)
+                for grade, price_key in enumerate(merge.price_keys):
+                    price = station[price_key]
+                    if price is None or price["price"] is None:
+                        continue
+                    observations.append(
+                        (
+                            station_id,
+                            grade,
+                            price["timestamp"],
+                            round(price["price"] * _price_scale),
+                        )
+                    )
+            total_changes_before = self.connection.total_changes
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO observations VALUES (?, ?, ?, ?)", observations
+            )
+            added_count = self.connection.total_changes - total_changes_before
+        logger.info(
+            "Stored {added_count} new of {count} prices in {time_s} s",
+            added_count=added_count,
+            count=len(observations),
+            time_s=time.perf_counter() - p_start,
+        )
+        return added_count
+
+    def station_prices(
+        self, station_key: str, price_key: str, start_ms: int, end_ms: int
+    ) -> list:
+        """
+        Returns (timestamp, price) for every price observed for a station and grade
+        from start_ms up to but not including end_ms, oldest first.
+        """
+        rows = self.connection.execute(
+            """
+            SELECT timestamp, price FROM observations
+            WHERE station_id = (SELECT id FROM stations WHERE station_key = ?)
+                AND grade = ? AND timestamp >= ? AND timestamp < ?
+            ORDER BY timestamp
+            """,
+            (station_key, merge.price_keys.index(price_key), start_ms, end_ms),
+        )
+        return [(timestamp, price / _price_scale) for timestamp, price in rows]
+
+    def state_average(
+        self,
+        state: str,
+        price_key: str,
+        start_ms: int,
+        end_ms: int,
+        bucket_ms: int = _ms_per_day,
+    ) -> list:
+        """
+        Returns (bucket start, average price, station count) for every bucket_ms-long
+        bucket from start_ms up to end_ms in which a station in the state had a price
+        observed for the grade.
+        """
+        rows = self.connection.execute(
+            """
+            SELECT
+                ? + (timestamp - ?) / ? * ? AS bucket_start,
+                AVG(price),
+                COUNT(DISTINCT station_id)
+            FROM observations
+            WHERE station_id IN (SELECT id FROM stations WHERE state = ?)
+                AND grade = ? AND timestamp >= ? AND timestamp < ?
+            GROUP BY bucket_start
+            ORDER BY bucket_start
+            """,
+            (
+                start_ms,
+                start_ms,
+                bucket_ms,
+                bucket_ms,
+                state,
+                merge.price_keys.index(price_key),
+                start_ms,
+                end_ms,
+            ),
+        )
+        return [
+            (bucket_start, average_price / _price_scale, station_count)
+            for bucket_start, average_price, station_count in rows
+        ]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def parse_history_args():
+    arg_parser = argparse.ArgumentParser(
+        description="Store and query the history of every price the scraper has seen"
+    )
+    arg_parser.add_argument(
+        "--log-level",
+        action="store",
+        type=str,
+        default="INFO",
+        help="The logging level to use",
+    )
+    arg_parser.add_argument(
+        "--structured-logging",
+        action="store_true",
+        default=False,
+        help="Denotes whether to structure log statements",
+    )
+    arg_parser.add_argument(
+        "--db",
+        action="store",
+        type=str,
+        required=True,
+        help="SQLite file of the price history",
+    )
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subparsers.add_parser(
+        "ingest", help="Store the prices in one or more prices.json files"
+    )
+    ingest_parser.add_argument("prices_files", nargs="+")
+    for command, help_text in (
+        ("station", "Print every price for a station and grade"),
+        ("state-average", "Print the daily average price for a state and grade"),
+    ):
+        query_parser = subparsers.add_parser(command, help=help_text)
+        query_parser.add_argument(
+            "target", help="Station key (see merge.station_key) or state"
+        )
+        query_parser.add_argument(
+            "--grade",
+            action="store",
+            type=str,
+            choices=merge.price_keys,
+            default="regularPrice",
+            help="The grade to query",
+        )
+        query_parser.add_argument(
+            "--days",
+            action="store",
+            type=float,
+            default=90,
+            help="How many days back to query",
+        )
+    return arg_parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_history_args()
+    helpers.configure_logger(args)
+    price_history = PriceHistory(args.db)
+    if args.command == "ingest":
+        for prices_file_name in args.prices_files:
+            with open(prices_file_name, "r") as prices_file:
+                price_history.ingest(json.loads(prices_file.read()))
+    else:
+        end_ms = helpers.now_in_epoch_ms()
+        start_ms = end_ms - int(args.days * _ms_per_day)
+        if args.command == "station":
+            rows = price_history.station_prices(
+                args.target, args.grade, start_ms, end_ms
+            )
+        else:
+            rows = price_history.state_average(
+                args.target, args.grade, start_ms, end_ms
+            )
+        print(json.dumps(rows, indent=2))
+    price_history.close()
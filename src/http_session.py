@@ -0,0 +1,75 @@
+from helpers import user_agent
+from loguru import logger
+import os
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import brotli  # noqa: F401
+
+    accept_encoding = "gzip, deflate, br"
+except ImportError:
+    accept_encoding = "gzip, deflate"
+
+
+# Must send User-Agent, else requests to Costco will hang
+default_headers = {"User-Agent": user_agent, "Accept-Encoding": accept_encoding}
+
+_session = None
+_session_pid = None
+
+
+class _CountingHTTPAdapter(HTTPAdapter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.request_count = 0
+
+    def send(self, request, *args, **kwargs):
+        self.request_count += 1
+        return super().send(request, *args, **kwargs)
+
+    def connection_count(self) -> int:
+        # Each connection pool counts the TCP (+TLS) connections it has opened
+        return sum(
+            self.poolmanager.pools[pool_key].num_connections
+            for pool_key in self.poolmanager.pools.keys()
+        )
+
+
+def get_session() -> requests.Session:
+    """
+    Returns this process's shared session, creating it on first use.
+
+    Sessions aren't safe to share across a fork, so each Pool worker gets its own.
+    The session keeps connections alive between requests to the same host.
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        _session = requests.Session()
+        _session.headers.update(default_headers)
+        adapter = _CountingHTTPAdapter()
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+        _session_pid = os.getpid()
+    return _session
+
+
+def connection_stats() -> dict:
+    if _session is None or _session_pid != os.getpid():
+        return {"requests": 0, "connections": 0, "reused": 0}
+    adapter = _session.get_adapter("https://")
+    request_count = adapter.request_count
+    connection_count = adapter.connection_count()
+    return {
+        "requests": request_count,
+        "connections": connection_count,
+        "reused": request_count - connection_count,
+    }
+
+
+def log_connection_stats() -> None:
+    stats = connection_stats()
+    logger.info(
+        "HTTP session made {requests} requests over {connections} connections ({reused} handshakes avoided)",
+        **stats,
+    )
@@ -0,0 +1,117 @@
+import hashlib
+import json
+from loguru import logger
+import os
+import time
+
+
+class ResponseCache:
+    """
+    On-disk cache of HTTP validators (ETag and Last-Modified) keyed by URL, along with
+    the part of the response we actually use (e.g. the gas-price-section), so a 304
+    Not Modified response can be handled without refetching or reparsing the page.
+
+    Entries older than ttl_s are dropped so the page is eventually fetched in full
+    again. Once the cache grows past max_bytes, the least recently used entries are
+    evicted by evict().
+    """
+
+    def __init__(self, cache_dir: str, ttl_s: float, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.hit_count = 0
+        self.miss_count = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_file_name(self, url: str) -> str:
+        return os.path.join(
+            self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json"
+        )
+
+    def get(self, url: str) -> dict | None:
+        entry_file_name = self._entry_file_name(url)
+        try:
+            with open(entry_file_name, "r") as entry_file:
+                entry = json.loads(entry_file.read())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if time.time() - entry["storedAt"] > self.ttl_s or entry["url"] != url:
+            os.remove(entry_file_name)
+            return None
+        # Mark as recently used for eviction
+        os.utime(entry_file_name)
+        return entry
+
+    def put(
+        self, url: str, etag: str | None, last_modified: str | None, content: str
+    ) -> None:
+        # Without a validator, the server can never tell us the page is unchanged
+        if etag is None and last_modified is None:
+            return
+        with open(self._entry_file_name(url), "w") as entry_file:
+            entry_file.write(
+                json.dumps(
+                    {
+                        "url": url,
+                        "etag": etag,
+                        "lastModified": last_modified,
+                        "storedAt": time.time(),
+                        "content": content,
+                    }
+                )
+            )
+
+    def record(self, status_code: int | None) -> None:
+        if status_code == 304:
+            self.hit_count += 1
+        else:
+            self.miss_count += 1
+
+    def evict(self) -> None:
+        entries = []
+        total_bytes = 0
+        with os.scandir(self.cache_dir) as dir_entries:
+            for dir_entry in dir_entries:
+                stat = dir_entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, dir_entry.path))
+                total_bytes += stat.st_size
+        evicted_count = 0
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(path)
+            total_bytes -= size
+            evicted_count += 1
+        logger.info(
+            "Response cache: {hit_count} not modified, {miss_count} fetched in full, {evicted_count} entries evicted, {size_kb} KB on disk",
+            hit_count=self.hit_count,
+            miss_count=self.miss_count,
+            evicted_count=evicted_count,
+            size_kb=total_bytes // 1024,
+        )
+
+
+def conditional_headers(entry: dict | None) -> dict:
+    """
+    Returns the headers that ask the server to respond 304 Not Modified if the page
+    hasn't changed since entry was cached. Keep hold of entry to use on a 304: reading
+    it from the cache again may find it expired.
+    """
+    headers = {}
+    if entry is not None:
+        if entry["etag"] is not None:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["lastModified"] is not None:
+            headers["If-Modified-Since"] = entry["lastModified"]
+    return headers
+
+
+def open_response_cache(args) -> ResponseCache | None:
+    if args.http_cache_dir is None:
+        return None
+    return ResponseCache(
+        args.http_cache_dir,
+        ttl_s=args.http_cache_ttl_hours * 3600,
+        max_bytes=args.http_cache_max_mb * 1024 * 1024,
+    )
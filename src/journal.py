@@ -0,0 +1,91 @@
+import json
+from loguru import logger
+import os
+import sqlite3
+import time
+
+
+class RunJournal:
+    """
+    SQLite journal of the station results completed by each run, keyed by run ID and
+    URL. A result is written as soon as its page has been parsed, so a run that dies
+    partway through can be resumed by a retry with the same run ID: the results it
+    completed within freshness_s are reused instead of being fetched again. Results
+    of other runs are never reused, so a new run always collects fresh prices.
+
+    Only results from pages that were actually fetched and parsed are recorded, so
+    failed or missing stations are always retried.
+    """
+
+    def __init__(self, db_file_name: str, run_id: str, freshness_s: float):
+        self.run_id = run_id
+        self.freshness_s = freshness_s
+        # The journal is opened by the thread that collects the franchise and only
+        # ever used from there
+        self.connection = sqlite3.connect(db_file_name)
+        # Each result is committed on its own; with WAL that's an append rather than
+        # a rewrite of the database
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS station_results (
+                run_id TEXT NOT NULL,
+                url TEXT NOT NULL,
+                completed_at REAL NOT NULL,
+                station TEXT NOT NULL,
+                PRIMARY KEY (run_id, url)
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS station_results_completed_at ON station_results (completed_at)"
+        )
+        with self.connection:
+            pruned_count = self.connection.execute(
+                "DELETE FROM station_results WHERE completed_at < ?",
+                (time.time() - freshness_s,),
+            ).rowcount
+        logger.debug(
+            "Pruned {count} stale results from the run journal", count=pruned_count
+        )
+
+    def fresh_results(self) -> dict:
+        """
+        Returns this run's result for every URL it completed within the freshness
+        window, by URL.
+        """
+        rows = self.connection.execute(
+            "SELECT url, station FROM station_results WHERE run_id = ? AND completed_at >= ?",
+            (self.run_id, time.time() - self.freshness_s),
+        )
+        return {url: json.loads(station) for url, station in rows}
+
+    def record(self, url: str, station: dict) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO station_results VALUES (?, ?, ?, ?)",
+                (self.run_id, url, time.time(), json.dumps(station)),
+            )
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def default_run_id() -> str:
+    # Retried tasks of a Cloud Run Job execution share its execution name. Elsewhere,
+    # a run restarted the same day is the same run, just like the daily tag it
+    # publishes
+    return os.environ.get(
+        "CLOUD_RUN_EXECUTION", time.strftime("%Y-%m-%d", time.localtime())
+    )
+
+
+def open_run_journal(args) -> RunJournal | None:
+    if args.run_journal is None:
+        return None
+    return RunJournal(
+        args.run_journal,
+        run_id=args.run_id,
+        freshness_s=args.run_journal_freshness_minutes * 60,
+    )
@@ -0,0 +1,92 @@
+import codecs
+import itertools
+import json
+
+
+_decoder = json.JSONDecoder()
+_whitespace = " \t\n\r"
+_number_continuations = "+-.0123456789eE"
+
+# What the parser expects next in the top-level array
+_array_start = 0
+_first_item = 1
+_item = 2
+_separator = 3
+_array_end = 4
+
+
+class NotAJsonArrayError(ValueError):
+    def __init__(self, value):
+        super().__init__("The top-level JSON value is not an array")
+        # The whole decoded document, e.g. an error object returned instead of data
+        self.value = value
+
+
+def _skip_whitespace(buffer: str, pos: int) -> int:
+    while pos < len(buffer) and buffer[pos] in _whitespace:
+        pos += 1
+    return pos
+
+
+def iter_array_items(chunks):
+    """
+    Yields each item of a top-level JSON array as soon as it has been fully received.
+
+    chunks is an iterable of bytes (decoded as UTF-8) or str, such as
+    requests.Response.iter_content(). Only the item being decoded is buffered, so
+    memory doesn't grow with the size of the whole array. If the document isn't an
+    array, it's read in full and NotAJsonArrayError is raised with its value.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    expecting = _array_start
+    is_final = False
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is None:
+            is_final = True
+            buffer += decoder.decode(b"", final=True)
+        elif isinstance(chunk, bytes):
+            buffer += decoder.decode(chunk)
+        else:
+            buffer += chunk
+        while True:
+            pos = _skip_whitespace(buffer, pos)
+            if pos == len(buffer):
+                break
+            if expecting == _array_start:
+                if buffer[pos] != "[":
+                    if not is_final:
+                        break
+                    raise NotAJsonArrayError(json.loads(buffer[pos:]))
+                pos += 1
+                expecting = _first_item
+            elif expecting == _first_item and buffer[pos] == "]":
+                pos += 1
+                expecting = _array_end
+            elif expecting in (_first_item, _item):
+                try:
+                    item, end = _decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if is_final:
+                        raise
+                    break
+                # A number cut off by the end of the chunk (e.g. "4." of "4.5") decodes
+                # as a shorter number, so wait until something follows it
+                if not is_final and (
+                    end == len(buffer) or buffer[end] in _number_continuations
+                ):
+                    break
+                yield item
+                pos = end
+                expecting = _separator
+            elif expecting == _separator and buffer[pos] in ",]":
+                expecting = _item if buffer[pos] == "," else _array_end
+                pos += 1
+            else:
+                raise json.JSONDecodeError("Unexpected character", buffer, pos)
+        # Drop everything that's already been decoded
+        buffer = buffer[pos:]
+        pos = 0
+    if expecting != _array_end:
+        raise json.JSONDecodeError("Unterminated JSON array", buffer, len(buffer))
@@ -0,0 +1,139 @@
+import atexit
+import logging
+import multiprocessing.util
+import os
+import queue
+import threading
+import time
+import zlib
+
+
+_warning_window_s = 60
+
+
+class QueuedSink:
+    """
+    A loguru sink that hands each formatted record to a background thread instead of
+    writing it to the stream, so hot loops don't wait on stdout or on each other for
+    its lock. The thread writes whatever has queued up in one write and one flush.
+
+    loguru's own enqueue=True pickles every record onto a multiprocessing queue, which
+    costs the caller more than writing it would. This only moves the string to a
+    thread in the same process. Records queued at exit are written before the process
+    exits. Forked Pool workers inherit the sink and start their own thread, and flush
+    it when they exit normally. A worker that's terminated may
+    lose the records it logged in the last moments before that.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._start()
+        os.register_at_fork(after_in_child=self._start)
+        atexit.register(self.complete)
+
+    def _start(self) -> None:
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write_forever, daemon=True)
+        self._thread.start()
+        if multiprocessing.parent_process() is not None:
+            # Pool workers exit without running atexit handlers
+            multiprocessing.util.Finalize(self, self.complete, exitpriority=0)
+
+    def __call__(self, message) -> None:
+        self._queue.put(str(message))
+
+    def _write_forever(self) -> None:
+        # Besides records, the queue carries an Event to set once everything before
+        # it is written, and None to stop
+        while True:
+            pending = [self._queue.get()]
+            while True:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = []
+            for item in pending:
+                if isinstance(item, str):
+                    records.append(item)
+                    continue
+                self._write(records)
+                records = []
+                if item is None:
+                    return
+                item.set()
+            self._write(records)
+
+    def _write(self, records: list) -> None:
+        if records:
+            self.stream.write("".join(records))
+            self.stream.flush()
+
+    def complete(self) -> None:
+        """
+        Waits until every record queued so far has been written.
+        """
+        written = threading.Event()
+        self._queue.put(written)
+        while not written.wait(0.1):
+            if not self._thread.is_alive():
+                return
+
+    def stop(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+
+class LogFilter:
+    """
+    Thins out the per-URL records that hot loops log.
+
+    Records below WARNING that carry a url are only kept for sample_rate of URLs. The
+    choice is a hash of the URL, so every record about a sampled URL is kept, in every
+    process, and the same URLs are sampled from one run to the next.
+
+    Each line that logs warnings may log at most max_warnings_per_minute of them a
+    minute. The first warning it logs after that notes how many were dropped.
+    """
+
+    def __init__(
+        self, sample_rate: float = 1, max_warnings_per_minute: int | None = None
+    ):
+        self.sample_rate = sample_rate
+        self.max_warnings_per_minute = max_warnings_per_minute
+        self._sample_threshold = int(sample_rate * 2**32)
+        self._warning_windows = {}
+        self._warning_windows_lock = threading.Lock()
+
+    def is_url_sampled(self, url: str) -> bool:
+        return zlib.crc32(url.encode("utf-8")) < self._sample_threshold
+
+    def __call__(self, record) -> bool:
+        level_no = record["level"].no
+        if level_no < logging.WARNING:
+            if self.sample_rate >= 1:
+                return True
+            url = record["extra"].get("url")
+            return url is None or self.is_url_sampled(url)
+        if level_no >= logging.ERROR or self.max_warnings_per_minute is None:
+            return True
+        return self._allow_warning(record)
+
+    def _allow_warning(self, record) -> bool:
+        site = (record["name"], record["line"])
+        now = time.monotonic()
+        with self._warning_windows_lock:
+            window = self._warning_windows.get(site)
+            if window is None or now - window[0] >= _warning_window_s:
+                suppressed = window[2] if window is not None else 0
+                self._warning_windows[site] = [now, 1, 0]
+                if suppressed:
+                    record["message"] += " ({count} similar warnings dropped)".format(
+                        count=suppressed
+                    )
+                return True
+            if window[1] < self.max_warnings_per_minute:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
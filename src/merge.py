@@ -0,0 +1,166 @@
+import functools
+from loguru import logger
+from typing import NamedTuple
+
+
+price_keys = ("regularPrice", "midGradePrice", "premiumPrice", "dieselPrice")
+_missing = object()
+
+
+class MergeResult(NamedTuple):
+    merged: list
+    added: list
+    removed: list
+    changed: list
+    unchanged: list
+
+
+def station_key(station: dict) -> str:
+    """
+    Returns a stable key for a normalized station record, used wherever stations are
+    matched or ordered: merging, publishing, sharding and the price history.
+
+    Normalized records carry no store ID, so the key is the franchise name plus the
+    normalized street address, city, state, and postal code. Reordering or refreshing
+    the station list does not change the key.
+    """
+    return _station_key(
+        station["franchiseName"],
+        station["streetAddress"],
+        station["city"],
+        station["state"],
+        station["postalCode"],
+    )
+
+
+# Every run keys the same stations several times over, and normalizing costs several
+# times more than looking up the raw fields
+@functools.lru_cache(maxsize=1 << 16)
+def _station_key(
+    franchise_name: str, street_address: str, city: str, state: str, postal_code: str
+) -> str:
+    address = "{street_address}|{city}|{state}|{postal_code}".format(
+        street_address=street_address, city=city, state=state, postal_code=postal_code
+    )
+    # Punctuation and whitespace vary between refreshes of the same station's address
+    normalized_address = (
+        "".join(address.lower().split()).replace(".", "").replace(",", "")
+    )
+    return "{franchise_name}|{normalized_address}".format(
+        franchise_name=franchise_name, normalized_address=normalized_address
+    )
+
+
+def merge_station(curr_station_state: dict, new_station_state: dict) -> dict:
+    # If the new price is None, retain the old price
+    merged_regular_price = curr_station_state["regularPrice"]
+    merged_mid_grade_price = curr_station_state["midGradePrice"]
+    merged_premium_price = curr_station_state["premiumPrice"]
+
+    if new_station_state["regularPrice"] is not None:
+        merged_regular_price = new_station_state["regularPrice"]
+    if new_station_state["midGradePrice"] is not None:
+        merged_mid_grade_price = new_station_state["midGradePrice"]
+    if new_station_state["premiumPrice"] is not None:
+        merged_premium_price = new_station_state["premiumPrice"]
+    if (
+        new_station_state["dieselPrice"] is not None
+        and curr_station_state["dieselPrice"] is None
+    ):
+        logger.warning(
+            "Station {station_name} has a diesel price but didn't have one before",
+            station_name=new_station_state["name"],
+        )
+    # Not going to go though the hassle of guaranteeing diesel price accuracy;
+    # just overwrite it with what we saw just now
+    merged_diesel_price = new_station_state["dieselPrice"]
+
+    return {
+        **new_station_state,
+        "regularPrice": merged_regular_price,
+        "midGradePrice": merged_mid_grade_price,
+        "premiumPrice": merged_premium_price,
+        "dieselPrice": merged_diesel_price,
+    }
+
+
+def _same_prices(station: dict, other_station: dict) -> bool:
+    for key in price_keys:
+        price = station[key]
+        other_price = other_station[key]
+        # merge_station keeps the current price dict when there's no new price
+        if price is other_price:
+            continue
+        if (
+            price is None
+            or other_price is None
+            or price["price"] != other_price["price"]
+        ):
+            return False
+    return True
+
+
+def _same_record(station: dict, other_station: dict) -> bool:
+    # Equal apart from the timestamps of the prices
+    if len(station) != len(other_station) or not _same_prices(station, other_station):
+        return False
+    for field, value in station.items():
+        if field not in price_keys and other_station.get(field, _missing) != value:
+            return False
+    return True
+
+
+def merge_prices_by_key(curr_prices: list, new_prices: list) -> MergeResult:
+    """
+    Merges new station prices into the current ones in a single pass.
+
+    Current prices are indexed by station_key, so the order of either list does not
+    matter. Stations only in new_prices are added; stations only in curr_prices are
+    removed. A station is unchanged if its merged record only differs from its current
+    one by the timestamps of its prices, and then keeps its current record, so
+    re-observing the same prices doesn't change anything. Every other station in both
+    lists is changed.
+    """
+    curr_prices_by_key = {station_key(station): station for station in curr_prices}
+    merged = []
+    added = []
+    changed = []
+    unchanged = []
+    seen_keys = set()
+    for new_station_state in new_prices:
+        key = station_key(new_station_state)
+        if key in seen_keys:
+            logger.warning(
+                "Station {station_name} appears more than once in the new prices",
+                station_name=new_station_state["name"],
+            )
+        seen_keys.add(key)
+        curr_station_state = curr_prices_by_key.get(key)
+        if curr_station_state is None:
+            # Just add initial data on the new station
+            added.append(key)
+            merged.append(new_station_state)
+            continue
+        merged_station_state = merge_station(curr_station_state, new_station_state)
+        if _same_record(merged_station_state, curr_station_state):
+            unchanged.append(key)
+            merged.append(curr_station_state)
+        else:
+            changed.append(key)
+            merged.append(merged_station_state)
+    removed = [key for key in curr_prices_by_key if key not in seen_keys]
+    logger.info(
+        "Merged prices for {count} stations: {added} added, {removed} removed, {changed} changed, {unchanged} unchanged",
+        count=len(merged),
+        added=len(added),
+        removed=len(removed),
+        changed=len(changed),
+        unchanged=len(unchanged),
+    )
+    return MergeResult(
+        merged=merged,
+        added=added,
+        removed=removed,
+        changed=changed,
+        unchanged=unchanged,
+    )
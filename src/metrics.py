@@ -0,0 +1,178 @@
+from array import array
+from contextlib import contextmanager
+import json
+from loguru import logger
+import math
+import resource
+import threading
+import time
+
+
+_prometheus_prefix = "gas_scraper_"
+_quantiles = (0.5, 0.95, 0.99)
+
+
+def peak_rss_mb() -> dict:
+    """
+    Returns the peak resident set size, in MB, of this process and of the largest of
+    its children that have exited.
+    """
+    # ru_maxrss survives fork and exec, so a fresh process would report its parent's
+    # peak. VmHWM is reset along with the address space
+    self_peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open("/proc/self/status", "r") as status_file:
+            for line in status_file:
+                if line.startswith("VmHWM:"):
+                    self_peak_kb = int(line.split()[1])
+                    break
+    except FileNotFoundError:
+        pass
+    # ru_maxrss is in KB on Linux
+    return {
+        "self": self_peak_kb // 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // 1024,
+    }
+
+
+class Histogram:
+    """
+    Every value observed for one metric, kept so that exact quantiles can be taken
+    at the end of the run. A run observes at most a few thousand values per metric,
+    so there's no need for buckets.
+    """
+
+    def __init__(self):
+        self.values = array("d")
+
+    def observe(self, value: float) -> None:
+        self.values.append(value)
+
+    def summary(self) -> dict:
+        if not self.values:
+            return {"count": 0, "sum": 0.0}
+        ordered = sorted(self.values)
+        return {
+            "count": len(ordered),
+            "sum": math.fsum(ordered),
+            "min": ordered[0],
+            "max": ordered[-1],
+            **{
+                "p{percent}".format(percent=round(q * 100)): ordered[
+                    max(0, math.ceil(q * len(ordered)) - 1)
+                ]
+                for q in _quantiles
+            },
+        }
+
+
+class RunMetrics:
+    """
+    Named histograms, counters, and gauges for one run of the scraper, exported as a
+    run report in JSON and in the Prometheus text format so runs can be compared.
+
+    Metrics are per process: values observed in Pool workers must be sent back to
+    the parent to be recorded. Recording is thread-safe, since the fetch stage runs
+    on a thread of its own.
+    """
+
+    def __init__(self):
+        self.started_at_ms = int(time.time() * 1000)
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self.gauges[name] = value
+
+    def total(self, name: str) -> float:
+        # The sum of every value observed for a histogram, or 0 if there are none
+        with self._lock:
+            histogram = self.histograms.get(name)
+            return math.fsum(histogram.values) if histogram is not None else 0.0
+
+    @contextmanager
+    def span(self, name: str):
+        """
+        Times the enclosed block into the histogram {name}_seconds, even if it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name + "_seconds", time.perf_counter() - start)
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "startedAt": self.started_at_ms,
+                "finishedAt": int(time.time() * 1000),
+                "histograms": {
+                    name: histogram.summary()
+                    for name, histogram in sorted(self.histograms.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+                "gauges": dict(sorted(self.gauges.items())),
+            }
+
+    def to_prometheus(self) -> str:
+        report = self.report()
+        lines = []
+        for name, summary in report["histograms"].items():
+            metric_name = _prometheus_prefix + name
+            lines.append("# TYPE {name} summary".format(name=metric_name))
+            for q in _quantiles:
+                percentile_key = "p{percent}".format(percent=round(q * 100))
+                if percentile_key in summary:
+                    lines.append(
+                        '{name}{{quantile="{q}"}} {value}'.format(
+                            name=metric_name, q=q, value=summary[percentile_key]
+                        )
+                    )
+            lines.append(
+                "{name}_sum {value}".format(name=metric_name, value=summary["sum"])
+            )
+            lines.append(
+                "{name}_count {value}".format(name=metric_name, value=summary["count"])
+            )
+        for name, value in report["counters"].items():
+            metric_name = _prometheus_prefix + name + "_total"
+            lines.append("# TYPE {name} counter".format(name=metric_name))
+            lines.append("{name} {value}".format(name=metric_name, value=value))
+        for name, value in report["gauges"].items():
+            metric_name = _prometheus_prefix + name
+            lines.append("# TYPE {name} gauge".format(name=metric_name))
+            lines.append("{name} {value}".format(name=metric_name, value=value))
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, file_stem: str) -> None:
+        with open(file_stem + ".json", "w") as report_file:
+            report_file.write(json.dumps(self.report(), indent=2))
+        with open(file_stem + ".prom", "w") as report_file:
+            report_file.write(self.to_prometheus())
+        logger.info(
+            "Wrote run report to {file_stem}.json and {file_stem}.prom",
+            file_stem=file_stem,
+        )
+
+    def log(self) -> None:
+        # With --structured-logging, this is one JSON line that log-based metrics
+        # can be extracted from
+        logger.info("Run report: {report}", report=json.dumps(self.report()))
+
+
+# This process's metrics
+run_metrics = RunMetrics()
@@ -0,0 +1,173 @@
+from helpers import now_in_epoch_ms
+import re
+
+
+_not_imported = object()
+# NumPy is optional, and only imported once a batch is large enough to use it, so Pool
+# workers that normalize one page at a time don't carry it
+numpy = _not_imported
+# Liters per gallon, scaled by 10^8 so that conversion can be done in integer cents
+_liters_per_gallon_e8 = 378_541_178
+_e8 = 100_000_000
+# Below this many prices, NumPy's per-call overhead outweighs what it saves
+_numpy_min_batch_size = 256
+_price_text_pattern = re.compile(r"\$?([0-9]+)(?:\.([0-9]*))?")
+
+
+def import_numpy():
+    """
+    Returns the numpy module, or None if it isn't installed.
+    """
+    global numpy
+    if numpy is _not_imported:
+        try:
+            import numpy as numpy_module
+        except ImportError:
+            numpy_module = None
+        numpy = numpy_module
+    return numpy
+
+
+def price_text_to_cents(price_text) -> int:
+    """
+    Returns a price such as "$3.459" or 3.459 in whole cents, truncating any fraction
+    of a cent. Raises ValueError if the text isn't a price.
+    """
+    match = _price_text_pattern.fullmatch(str(price_text).strip())
+    if match is None:
+        raise ValueError("Not a price: {price_text!r}".format(price_text=price_text))
+    whole, fraction = match.groups()
+    return int(whole + ((fraction or "") + "00")[0:2])
+
+
+def _per_liter_cents_to_per_gallon_cents(cents):
+    # Rounds half up. Works on a NumPy array of cents too
+    return (cents * _liters_per_gallon_e8 + _e8 // 2) // _e8
+
+
+def _prices_to_cents_with_numpy(price_texts: list):
+    # Works on the bytes of every price at once: the digits before the decimal point,
+    # after an optional "$", make up the dollars, and the two digits after it the
+    # cents. Prices in any other form are left to price_text_to_cents()
+    price_texts = [str(price_text) for price_text in price_texts]
+    try:
+        chars = numpy.array(price_texts, "S").view(numpy.uint8)
+    except UnicodeEncodeError:
+        return numpy.array(
+            [price_text_to_cents(price_text) for price_text in price_texts],
+            numpy.int64,
+        )
+    chars = chars.reshape(len(price_texts), -1)
+    digits = chars.astype(numpy.int64) - ord("0")
+    is_digit = (digits >= 0) & (digits <= 9)
+    is_dot = chars == ord(".")
+    dot_indexes = numpy.where(
+        is_dot.any(axis=1), is_dot.argmax(axis=1), chars.shape[1]
+    )
+    positions = numpy.arange(chars.shape[1])
+    is_dollar_digit = is_digit & (positions < dot_indexes[:, None])
+    # Shorter prices are padded with NUL bytes at the end
+    is_padding = numpy.logical_and.accumulate((chars == 0)[:, ::-1], axis=1)[:, ::-1]
+    is_valid = (
+        (
+            is_digit
+            | is_dot
+            | is_padding
+            | ((chars == ord("$")) & (positions == 0))
+        ).all(axis=1)
+        & (is_dot.sum(axis=1) <= 1)
+        & is_dollar_digit.any(axis=1)
+    )
+    # Each dollar digit's power of ten is how many dollar digits follow it
+    powers = (
+        numpy.cumsum(is_dollar_digit[:, ::-1], axis=1)[:, ::-1] - is_dollar_digit
+    )
+    dollars = (numpy.where(is_dollar_digit, digits, 0) * 10**powers).sum(axis=1)
+    cents = dollars * 100
+    for place, scale in ((1, 10), (2, 1)):
+        index = numpy.minimum(dot_indexes + place, chars.shape[1] - 1)
+        digit = digits[numpy.arange(len(price_texts)), index]
+        is_fraction_digit = (dot_indexes + place < chars.shape[1]) & (
+            (digit >= 0) & (digit <= 9)
+        )
+        cents += numpy.where(is_fraction_digit, digit, 0) * scale
+    for i in numpy.flatnonzero(~is_valid):
+        cents[i] = price_text_to_cents(price_texts[i])
+    return cents
+
+
+def _normalize_prices_with_numpy(price_texts: list, per_liter) -> list:
+    cents = _prices_to_cents_with_numpy(price_texts)
+    if per_liter is not False:
+        per_gallon_cents = _per_liter_cents_to_per_gallon_cents(cents)
+        cents = (
+            per_gallon_cents
+            if per_liter is True
+            else numpy.where(numpy.array(per_liter, bool), per_gallon_cents, cents)
+        )
+    return (cents / 100).tolist()
+
+
+def normalize_prices(price_texts: list, per_liter=False) -> list:
+    """
+    Converts raw prices, such as "$3.459" or 3.459, to dollars per gallon truncated to
+    the cent. per_liter is either one flag for every price or a list of flags, one per
+    price, for the prices that are per liter instead of per gallon. A None price stays
+    None.
+
+    Large batches are converted with NumPy if it's installed.
+    """
+    present = [i for i, price_text in enumerate(price_texts) if price_text is not None]
+    if len(present) < len(price_texts):
+        normalized = [None] * len(price_texts)
+        for i, price in zip(
+            present,
+            normalize_prices(
+                [price_texts[i] for i in present],
+                (
+                    per_liter
+                    if isinstance(per_liter, bool)
+                    else [per_liter[i] for i in present]
+                ),
+            ),
+        ):
+            normalized[i] = price
+        return normalized
+    if len(price_texts) >= _numpy_min_batch_size and import_numpy() is not None:
+        return _normalize_prices_with_numpy(price_texts, per_liter)
+    cents = [price_text_to_cents(price_text) for price_text in price_texts]
+    if per_liter is True:
+        cents = [_per_liter_cents_to_per_gallon_cents(c) for c in cents]
+    elif per_liter is not False:
+        cents = [
+            _per_liter_cents_to_per_gallon_cents(c) if is_per_liter else c
+            for c, is_per_liter in zip(cents, per_liter)
+        ]
+    return [c / 100 for c in cents]
+
+
+def normalize_grade_prices(
+    grade_prices: list,
+    price_keys_by_grade: dict,
+    per_liter=False,
+    observed_at_ms: int | None = None,
+) -> tuple:
+    """
+    Normalizes the (grade, raw price) tuples of a page or payload in one batch, all
+    timestamped observed_at_ms (by default, now).
+
+    Returns a list with a {"timestamp", "price"} dict, or None if the grade isn't in
+    price_keys_by_grade, for every tuple, and a list of the price keys they map to.
+    """
+    if observed_at_ms is None:
+        observed_at_ms = now_in_epoch_ms()
+    price_keys = [price_keys_by_grade.get(grade) for grade, _ in grade_prices]
+    known = [i for i, price_key in enumerate(price_keys) if price_key is not None]
+    prices = normalize_prices(
+        [grade_prices[i][1] for i in known],
+        per_liter if isinstance(per_liter, bool) else [per_liter[i] for i in known],
+    )
+    price_points = [None] * len(grade_prices)
+    for i, price in zip(known, prices):
+        price_points[i] = {"timestamp": observed_at_ms, "price": price}
+    return price_points, price_keys
@@ -0,0 +1,49 @@
+from loguru import logger
+import time
+
+
+class StageStats:
+    """
+    Counts the items that have gone through one stage of a pipeline and samples the
+    depth of the queue feeding it each time an item is taken off that queue.
+
+    Throughput is measured from when the stats were created (the start of the
+    pipeline) to the stage's last item.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.max_queue_depth = 0
+        self._queue_depth_total = 0
+        self._start = time.perf_counter()
+        self._last = self._start
+
+    def record(self, queue_depth: int = 0) -> None:
+        self.count += 1
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+        self._queue_depth_total += queue_depth
+        self._last = time.perf_counter()
+
+    @property
+    def elapsed_s(self) -> float:
+        return self._last - self._start
+
+    @property
+    def throughput_per_s(self) -> float:
+        return self.count / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+    @property
+    def mean_queue_depth(self) -> float:
+        return self._queue_depth_total / self.count if self.count else 0.0
+
+    def log(self) -> None:
+        logger.info(
+            "Stage {stage}: {count} items, last one after {time_s:.3f} s ({throughput_per_s:.1f}/s). Queue depth mean={mean_queue_depth:.1f} max={max_queue_depth}",
+            stage=self.name,
+            count=self.count,
+            time_s=self.elapsed_s,
+            throughput_per_s=self.throughput_per_s,
+            mean_queue_depth=self.mean_queue_depth,
+            max_queue_depth=self.max_queue_depth,
+        )
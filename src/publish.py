@@ -0,0 +1,131 @@
+from dbrepo import DbRepo
+import json
+from loguru import logger
+import merge
+import os
+import shards
+from typing import NamedTuple
+
+
+db_repo_url_ssh = "git@github.com:franklinmoy3/the-gas-app-db.git"
+db_repo_clone_dir = "/tmp/the-gas-app-db"
+prices_file_name = "prices.json"
+shards_dir_name = "shards"
+
+
+class PriceDelta(NamedTuple):
+    # The full set of prices to publish
+    prices: list
+    added: list
+    removed: list
+    changed: list
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+
+
+def compute_delta(published_prices: list, new_prices) -> PriceDelta:
+    """
+    Merges new station prices into the last published ones with the keyed merge and
+    reports which stations were added, removed, or changed.
+
+    A station whose merged record only differs from its published one by timestamps
+    keeps its published record, so re-observing the same prices doesn't touch the
+    file. Stations only in published_prices are dropped.
+    """
+    result = merge.merge_prices_by_key(published_prices, new_prices)
+    return PriceDelta(
+        prices=result.merged,
+        added=result.added,
+        removed=result.removed,
+        changed=result.changed,
+    )
+
+
+def serialize_prices(prices: list) -> str:
+    # Sorting by station key keeps every station at the same place in the file from
+    # run to run, so a price change only shows up as a one-line diff
+    return json.dumps(sorted(prices, key=merge.station_key), indent=2) + "\n"
+
+
+def read_prices_file(file_name: str) -> list:
+    if not os.path.exists(file_name):
+        return []
+    with open(file_name, "r") as price_file:
+        return json.loads(price_file.read())
+
+
+def write_prices_file(file_name: str, new_prices) -> PriceDelta:
+    delta = compute_delta(read_prices_file(file_name), new_prices)
+    if delta.is_empty and os.path.exists(file_name):
+        logger.info("No price changes for {file_name}", file_name=file_name)
+        return delta
+    with open(file_name, "w+") as price_file:
+        price_file.write(serialize_prices(delta.prices))
+    return delta
+
+
+def write_prices(
+    file_name: str,
+    new_prices,
+    shards_dir: str,
+    shard_by: str | None,
+    geohash_precision: int,
+) -> bool:
+    """
+    Writes new prices to file_name and, if shard_by is given, to shards under
+    shards_dir. Returns whether anything was written.
+    """
+    delta = write_prices_file(file_name, new_prices)
+    if shard_by is None:
+        return not delta.is_empty
+    # Shards are cut from the same merged prices, so a station only changed by
+    # timestamps doesn't touch its shard either
+    shard_result = shards.write_shards(
+        shards_dir, delta.prices, shard_by, geohash_precision
+    )
+    return not (delta.is_empty and shard_result.is_empty)
+
+
+def publish_prices(
+    new_prices,
+    db_repo: DbRepo,
+    today: str,
+    shard_by: str | None = None,
+    geohash_precision: int = 2,
+) -> bool:
+    """
+    Applies new prices on top of the prices published in the DB repo and pushes the
+    result as a commit tagged with today's date.
+
+    Returns False without committing if no station changed since the last publish.
+    """
+    db_repo.sync()
+    logger.info("Applying pricing update...")
+    if not write_prices(
+        db_repo.path(prices_file_name),
+        new_prices,
+        db_repo.path(shards_dir_name),
+        shard_by,
+        geohash_precision,
+    ):
+        logger.info("No price changes since the last publish. Skipping commit")
+        db_repo.log_timings()
+        return False
+    logger.info("Staging pricing update...")
+    db_repo.commit_and_tag(
+        [prices_file_name] if shard_by is None else [prices_file_name, shards_dir_name],
+        "Pricing update: {today}".format(today=today),
+        today,
+        "Pricing update for {today}".format(today=today),
+    )
+    logger.info("Pricing update for {today} staged. Pushing...", today=today)
+    try:
+        db_repo.push(today)
+    except RuntimeError as e:
+        logger.error("Failed to push pricing update: {error}", error=e)
+        raise
+    logger.info("Pricing update pushed in {time_s} s", time_s=db_repo.timings["push"])
+    db_repo.log_timings()
+    return True
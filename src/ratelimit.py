@@ -0,0 +1,225 @@
+import asyncio
+from email.utils import parsedate_to_datetime
+from loguru import logger
+import time
+from urllib.parse import urlsplit
+
+
+_default_backoff_s = 1
+_max_backoff_s = 60
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Returns the number of seconds a Retry-After header value asks us to wait, or None
+    if there's no usable value. The header may be delay-seconds or an HTTP-date.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class TokenBucket:
+    def __init__(self, rate_per_s: float, burst: float = 1):
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self._tokens = burst
+        self._last_refill = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._last_refill) * self.rate_per_s
+        )
+        self._last_refill = now
+
+    def drain(self) -> None:
+        self._tokens = 0
+        self._last_refill = time.monotonic()
+
+    async def acquire(self) -> None:
+        self._refill()
+        while self._tokens < 1:
+            await asyncio.sleep((1 - self._tokens) / self.rate_per_s)
+            self._refill()
+        self._tokens -= 1
+
+
+class HostRateController:
+    """
+    Paces requests to one host with a token bucket and adapts to throttling with AIMD:
+    every successful response nudges the request rate and concurrency limit up, and a
+    429 halves both and pauses the host for the Retry-After period (or an exponential
+    backoff if there isn't one).
+
+    The request rate starts at initial_rate_per_s and probes upwards from there, up to
+    max_rate_per_s, so a host that keeps up is fetched from faster than the rate it
+    was first trusted with.
+
+    A 403 means the host has blocked us (or we've hit a honeypot), which retrying
+    would only make worse, so no more requests are let through to it.
+
+    Throttled responses to requests that started before the last decrease don't
+    decrease again, since they were sent at the old rate.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        max_rate_per_s: float,
+        max_concurrency: int,
+        max_consecutive_throttles: int,
+        initial_rate_per_s: float | None = None,
+    ):
+        self.host = host
+        self.max_rate_per_s = max_rate_per_s
+        self.max_concurrency = max_concurrency
+        self.max_consecutive_throttles = max_consecutive_throttles
+        self.bucket = TokenBucket(
+            max_rate_per_s
+            if initial_rate_per_s is None
+            else min(initial_rate_per_s, max_rate_per_s)
+        )
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.consecutive_throttles = 0
+        self.throttle_count = 0
+        self.forbidden = False
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._slot_freed = asyncio.Condition()
+
+    @property
+    def gave_up(self) -> bool:
+        return (
+            self.forbidden
+            or self.consecutive_throttles >= self.max_consecutive_throttles
+        )
+
+    async def acquire(self) -> float:
+        """
+        Waits for a request slot and returns the time the request was let through,
+        which must be passed back to release().
+        """
+        async with self._slot_freed:
+            await self._slot_freed.wait_for(
+                lambda: self.gave_up or self.in_flight < int(self.concurrency)
+            )
+            self.in_flight += 1
+        if self.gave_up:
+            return time.monotonic()
+        while True:
+            # The pause may be extended while we sleep
+            while (pause_s := self._paused_until - time.monotonic()) > 0:
+                await asyncio.sleep(pause_s)
+            await self.bucket.acquire()
+            # Throttled while waiting for a token, so wait out the new pause
+            if self._paused_until <= time.monotonic():
+                return time.monotonic()
+
+    async def release(
+        self,
+        started_at: float,
+        status_code: int | None = None,
+        retry_after_s: float | None = None,
+    ) -> None:
+        """
+        Frees the request slot. Pass the response's status code so the limits can
+        adapt; leave it as None if no response was received.
+        """
+        if status_code == 403:
+            self._on_forbidden()
+        elif status_code == 429:
+            self._on_throttled(started_at, retry_after_s)
+        elif status_code is not None:
+            self._on_success()
+        async with self._slot_freed:
+            self.in_flight -= 1
+            self._slot_freed.notify_all()
+
+    def _on_success(self) -> None:
+        self.consecutive_throttles = 0
+        # Additive increase: about +1 in-flight request per window of successes, and
+        # about +1 request/s for every second of successes
+        self.concurrency = min(
+            self.max_concurrency, self.concurrency + 1 / self.concurrency
+        )
+        self.bucket.rate_per_s = min(
+            self.max_rate_per_s, self.bucket.rate_per_s + 1 / self.bucket.rate_per_s
+        )
+
+    def _on_forbidden(self) -> None:
+        if not self.forbidden:
+            logger.error(
+                "Got a 403 from {host}. Giving up on it for this run.", host=self.host
+            )
+        self.forbidden = True
+
+    def _on_throttled(self, started_at: float, retry_after_s: float | None) -> None:
+        self.throttle_count += 1
+        if started_at < self._last_decrease:
+            return
+        self.consecutive_throttles += 1
+        self.concurrency = max(1.0, self.concurrency / 2)
+        self.bucket.rate_per_s = max(0.1, self.bucket.rate_per_s / 2)
+        # Don't let tokens saved up during the pause go out as a burst afterwards
+        self.bucket.drain()
+        if retry_after_s is None:
+            retry_after_s = min(
+                _max_backoff_s, _default_backoff_s * 2**self.consecutive_throttles
+            )
+        now = time.monotonic()
+        self._last_decrease = now
+        self._paused_until = max(self._paused_until, now + retry_after_s)
+        logger.warning(
+            "Throttled by {host}. Pausing {retry_after_s} s and backing off to {rate_per_s:.2f} requests/s with concurrency {concurrency}",
+            host=self.host,
+            retry_after_s=retry_after_s,
+            rate_per_s=self.bucket.rate_per_s,
+            concurrency=int(self.concurrency),
+        )
+        if self.gave_up:
+            logger.error(
+                "Throttled by {host} {count} times in a row. Giving up on it for this run.",
+                host=self.host,
+                count=self.consecutive_throttles,
+            )
+
+
+class RateController:
+    """
+    Hands out one HostRateController per host. Every request to a host made through
+    the same RateController shares that host's limits.
+    """
+
+    def __init__(
+        self,
+        max_rate_per_s: float,
+        max_concurrency: int,
+        max_consecutive_throttles: int = 5,
+        initial_rate_per_s: float | None = None,
+    ):
+        self.max_rate_per_s = max_rate_per_s
+        self.max_concurrency = max_concurrency
+        self.max_consecutive_throttles = max_consecutive_throttles
+        self.initial_rate_per_s = initial_rate_per_s
+        self.hosts = {}
+
+    def for_url(self, url: str) -> HostRateController:
+        host = urlsplit(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = HostRateController(
+                host,
+                self.max_rate_per_s,
+                self.max_concurrency,
+                self.max_consecutive_throttles,
+                self.initial_rate_per_s,
+            )
+        return self.hosts[host]
@@ -0,0 +1,172 @@
+import json
+from loguru import logger
+import math
+import merge
+import os
+from typing import NamedTuple
+
+
+# Until a station has some history, assume its prices change about once a day
+_prior_change_count = 1
+_prior_hours = 24
+_ms_per_hour = 3_600_000
+
+
+class RefreshPlan(NamedTuple):
+    # Keys to fetch, highest priority first
+    to_fetch: list
+    # Keys whose last fetched result is reused this run
+    to_reuse: list
+    # Keys that have never been fetched but didn't fit in this run's budget
+    deferred: list
+
+
+def station_prices(station: dict) -> list:
+    return [
+        None if station[price_key] is None else station[price_key]["price"]
+        for price_key in merge.price_keys
+    ]
+
+
+def change_rate_per_h(history: dict) -> float:
+    """
+    Estimates how many times an hour a station's prices change from how often they
+    changed between its past fetches, smoothed towards a prior of one change a day.
+    """
+    observed_hours = (history["lastFetchedAt"] - history["firstFetchedAt"]) / (
+        _ms_per_hour
+    )
+    return (history["changeCount"] + _prior_change_count) / (
+        observed_hours + _prior_hours
+    )
+
+
+def change_probability(history: dict, now_ms: int) -> float:
+    """
+    Returns the probability that a station's prices have changed since it was last
+    fetched, treating price changes as a Poisson process.
+    """
+    hours_since_fetch = (now_ms - history["lastFetchedAt"]) / _ms_per_hour
+    return 1 - math.exp(-change_rate_per_h(history) * hours_since_fetch)
+
+
+def refresh_priority(history: dict, now_ms: int) -> float:
+    """
+    Returns roughly how many stale station-hours fetching a station now would save:
+    the probability its prices changed since its last fetch, times how long a fresh
+    price can be expected to stay current until the station comes around again
+    (assumed to take about as long as it's been since its last fetch).
+
+    A station that changes constantly goes stale again right after it's fetched, so
+    under a tight budget it's worth less than one that changes now and then.
+    """
+    probability = change_probability(history, now_ms)
+    return probability * probability / change_rate_per_h(history)
+
+
+def plan_refresh(
+    keys: list, histories: dict, request_budget: int | None, now_ms: int
+) -> RefreshPlan:
+    """
+    Picks which stations to fetch this run given at most request_budget requests.
+
+    Stations are ranked by refresh_priority, so volatile stations are fetched more
+    often than stable ones, and a stable station's turn comes around as it goes
+    unfetched for longer. Stations without a previously fetched result come first,
+    since there's nothing to serve for them, but count against the budget like any
+    other fetch: those that don't fit are deferred to a later run.
+    """
+    unknown_keys = [key for key in keys if key not in histories]
+    known_keys = sorted(
+        (key for key in keys if key in histories),
+        key=lambda key: (
+            -refresh_priority(histories[key], now_ms),
+            histories[key]["lastFetchedAt"],
+        ),
+    )
+    if request_budget is None:
+        return RefreshPlan(
+            to_fetch=unknown_keys + known_keys, to_reuse=[], deferred=[]
+        )
+    if len(unknown_keys) > request_budget:
+        logger.warning(
+            "{count} stations have never been fetched, which is more than the budget of {request_budget} requests. Deferring {deferred_count} of them to later runs",
+            count=len(unknown_keys),
+            request_budget=request_budget,
+            deferred_count=len(unknown_keys) - request_budget,
+        )
+    known_budget = max(0, request_budget - len(unknown_keys))
+    return RefreshPlan(
+        to_fetch=unknown_keys[:request_budget] + known_keys[:known_budget],
+        to_reuse=known_keys[known_budget:],
+        deferred=unknown_keys[request_budget:],
+    )
+
+
+def seed_history(station: dict) -> dict | None:
+    """
+    Returns a history for a station that has none yet, from its published record,
+    as if it had been fetched once when its latest price was observed. Returns None
+    if the record has no prices.
+    """
+    timestamps = [
+        station[price_key]["timestamp"]
+        for price_key in merge.price_keys
+        if station[price_key] is not None
+    ]
+    if not timestamps:
+        return None
+    return {
+        "fetchCount": 1,
+        "changeCount": 0,
+        "firstFetchedAt": max(timestamps),
+        "lastFetchedAt": max(timestamps),
+        "prices": station_prices(station),
+        "station": station,
+    }
+
+
+def record_fetch(histories: dict, key: str, station: dict, fetched_at_ms: int) -> bool:
+    """
+    Records a freshly fetched station and returns whether its prices changed since
+    its last fetch.
+
+    A fetch without any prices, e.g. of a page missing its prices section, isn't
+    recorded: it says nothing about how often the prices change, and its result
+    isn't worth reusing over the last one that had prices.
+    """
+    prices = station_prices(station)
+    if all(price is None for price in prices):
+        return False
+    history = histories.get(key)
+    if history is None:
+        histories[key] = {
+            "fetchCount": 1,
+            "changeCount": 0,
+            "firstFetchedAt": fetched_at_ms,
+            "lastFetchedAt": fetched_at_ms,
+            "prices": prices,
+            "station": station,
+        }
+        return False
+    changed = prices != history["prices"]
+    history["fetchCount"] += 1
+    history["changeCount"] += changed
+    history["lastFetchedAt"] = fetched_at_ms
+    history["prices"] = prices
+    history["station"] = station
+    return changed
+
+
+def read_refresh_state(file_name: str) -> dict:
+    if not os.path.exists(file_name):
+        return {}
+    with open(file_name, "r") as state_file:
+        return json.loads(state_file.read())
+
+
+def write_refresh_state(file_name: str, histories: dict) -> None:
+    # Write then rename, so a run killed mid-write can't lose the history
+    with open(file_name + ".tmp", "w") as state_file:
+        state_file.write(json.dumps(histories))
+    os.replace(file_name + ".tmp", file_name)
@@ -0,0 +1,394 @@
+import argparse
+from benchmark import (
+    make_synthetic_clubfinder_payload,
+    write_synthetic_warehouse_pages,
+)
+from concurrent.futures import ProcessPoolExecutor
+import costco
+import helpers
+import http_session
+import json
+from loguru import logger
+import metrics
+import multiprocessing
+import os
+import publish
+import samsclub
+import statistics
+import stubserver
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+
+manifest_file_name = "manifest.json"
+pages_dir_name = "pages"
+# The stub server serves pages by the basename of the request path
+_samsclub_page_name = os.path.basename(
+    urlsplit(samsclub.samsclub_us_data_source_url).path
+)
+# Lower is better for these, higher for the rest
+_lower_is_better = ("wall_time_s", "peak_rss_mb", "children_peak_rss_mb")
+
+
+def _write_manifest(corpus_dir: str, url_objects: list, source: str) -> None:
+    with open(os.path.join(corpus_dir, manifest_file_name), "w") as manifest_file:
+        manifest_file.write(
+            json.dumps(
+                {
+                    "source": source,
+                    "createdAt": helpers.now_in_epoch_ms(),
+                    "costcoUrls": url_objects,
+                },
+                indent=2,
+            )
+        )
+
+
+def record_corpus(corpus_dir: str, limit: int | None, delay_s: float) -> None:
+    """
+    Saves the live Costco warehouse pages in the station list, and the Sam's Club
+    clubfinder response, to a fixture corpus that replay_corpus can serve offline.
+    Requests are made one at a time, delay_s apart.
+    """
+    pages_dir = os.path.join(corpus_dir, pages_dir_name)
+    os.makedirs(pages_dir, exist_ok=True)
+    url_objects = costco.read_station_urls()[:limit]
+    recorded = []
+    for url_object in url_objects:
+        url = url_object["url"]
+        resp = http_session.get_session().get(url)
+        logger.info(
+            helpers.api_response_log_fmt_str, status_code=resp.status_code, url=url
+        )
+        if resp.status_code != 200:
+            logger.warning("Not recording {url}", url=url)
+        else:
+            page_name = os.path.basename(urlsplit(url).path)
+            with open(os.path.join(pages_dir, page_name), "wb") as page_file:
+                page_file.write(resp.content)
+            recorded.append(url_object)
+        time.sleep(delay_s)
+    chunks = samsclub._open_details_stream_directly(
+        samsclub.samsclub_us_data_source_url
+    )
+    if chunks is None:
+        logger.warning(
+            "The clubfinder API blocked the request. Replays will serve synthetic Sam's Club data"
+        )
+    else:
+        with open(os.path.join(pages_dir, _samsclub_page_name), "wb") as page_file:
+            for chunk in chunks:
+                page_file.write(chunk)
+    _write_manifest(corpus_dir, recorded, "recorded")
+    logger.info(
+        "Recorded {count} of {total} Costco pages to {corpus_dir}",
+        count=len(recorded),
+        total=len(url_objects),
+        corpus_dir=corpus_dir,
+    )
+
+
+def synthesize_corpus(corpus_dir: str, warehouse_count: int, club_count: int) -> None:
+    """
+    Writes a fixture corpus of synthetic pages, for when there's no recorded one.
+    """
+    pages_dir = os.path.join(corpus_dir, pages_dir_name)
+    os.makedirs(pages_dir, exist_ok=True)
+    url_objects = write_synthetic_warehouse_pages(pages_dir, warehouse_count)
+    with open(os.path.join(pages_dir, _samsclub_page_name), "wb") as page_file:
+        page_file.write(make_synthetic_clubfinder_payload(club_count))
+    _write_manifest(corpus_dir, url_objects, "synthetic")
+    logger.info(
+        "Wrote {warehouse_count} synthetic warehouse pages and {club_count} clubs to {corpus_dir}",
+        warehouse_count=warehouse_count,
+        club_count=club_count,
+        corpus_dir=corpus_dir,
+    )
+
+
+def _run_scraper(
+    run_dir: str,
+    samsclub_base_url: str,
+    scraper_argv: list,
+    log_level: str,
+) -> dict:
+    # Runs in a fresh process, so the redirected URLs and peak RSS only apply here
+    import scraper
+
+    # This process was spawned, so its Pools would spawn their workers too, and they
+    # wouldn't inherit the logger configuration. Fork them like production does
+    multiprocessing.set_start_method("fork", force=True)
+    os.chdir(run_dir)
+    samsclub.samsclub_us_data_source_url = samsclub_base_url + "/" + _samsclub_page_name
+    samsclub._samsclub_club_finder_url = samsclub_base_url + "/club-finder"
+    sys.argv = ["scraper.py", *scraper_argv]
+    args = helpers.parse_command_args()
+    args.log_level = log_level
+    helpers.configure_logger(args)
+    start = time.perf_counter()
+    scraper.main(args)
+    wall_time_s = time.perf_counter() - start
+    with open(publish.prices_file_name, "r") as prices_file:
+        station_count = len(json.loads(prices_file.read()))
+    peak_rss_mb = metrics.peak_rss_mb()
+    return {
+        "stations": station_count,
+        "wall_time_s": wall_time_s,
+        "throughput_per_s": station_count / wall_time_s,
+        "peak_rss_mb": peak_rss_mb["self"],
+        # Pool workers
+        "children_peak_rss_mb": peak_rss_mb["children"],
+    }
+
+
+def replay_corpus(args) -> dict:
+    """
+    Runs scraper.main end to end with --no-update-db against the corpus, served by
+    stub servers in place of costco.com and samsclub.com, and returns the median of
+    each measurement over args.runs runs. Every run starts from an empty directory,
+    so nothing is reused from an earlier one.
+    """
+    with open(os.path.join(args.corpus, manifest_file_name), "r") as manifest_file:
+        manifest = json.loads(manifest_file.read())
+    pages_dir = os.path.join(args.corpus, pages_dir_name)
+    costco_server = stubserver.start_stub_server(
+        pages_dir,
+        latency_s=args.latency_ms / 1000,
+        jitter_s=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+    )
+    # Sam's Club is a single response that fails the whole franchise if it errors,
+    # so it's served without injected errors
+    samsclub_server = stubserver.start_stub_server(
+        pages_dir, latency_s=args.latency_ms / 1000
+    )
+    measurements = []
+    for run in range(args.runs):
+        with tempfile.TemporaryDirectory() as run_dir:
+            with open(
+                os.path.join(run_dir, costco.costco_station_urls_file_name), "w"
+            ) as urls_file:
+                urls_file.write(
+                    json.dumps(
+                        [
+                            {
+                                **url_object,
+                                "url": costco_server.base_url
+                                + "/warehouse-locations/"
+                                + os.path.basename(urlsplit(url_object["url"]).path),
+                            }
+                            for url_object in manifest["costcoUrls"]
+                        ]
+                    )
+                )
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                measurement = executor.submit(
+                    _run_scraper,
+                    run_dir,
+                    samsclub_server.base_url,
+                    ["--no-update-db", "--samsclub-fetch-mode", "direct"]
+                    + args.scraper_args,
+                    args.scraper_log_level,
+                ).result()
+        logger.info(
+            "Replay run {run}: {stations} stations in {wall_time_s:.2f} s ({throughput_per_s:.1f}/s), peak RSS {peak_rss_mb} MB (pool workers {children_peak_rss_mb} MB)",
+            run=run + 1,
+            **measurement,
+        )
+        measurements.append(measurement)
+    logger.info(
+        "Stub servers injected {error_count} errors",
+        error_count=costco_server.error_count,
+    )
+    costco_server.shutdown()
+    samsclub_server.shutdown()
+    return {
+        key: statistics.median(measurement[key] for measurement in measurements)
+        for key in measurements[0]
+    }
+
+
+def compare_to_baseline(result: dict, baseline: dict, tolerance: float) -> bool:
+    """
+    Logs how result compares to baseline and returns False if any measurement is
+    more than tolerance (a fraction) worse.
+    """
+    is_within_tolerance = True
+    for key, value in result.items():
+        if key == "stations" or key not in baseline:
+            continue
+        baseline_value = baseline[key]
+        change = (value - baseline_value) / baseline_value if baseline_value else 0.0
+        worse_by = change if key in _lower_is_better else -change
+        is_regression = worse_by > tolerance
+        is_within_tolerance = is_within_tolerance and not is_regression
+        (logger.warning if is_regression else logger.info)(
+            "{key}: {value:.2f} vs. baseline {baseline_value:.2f} ({change:+.1%}){regression}",
+            key=key,
+            value=value,
+            baseline_value=baseline_value,
+            change=change,
+            regression=" REGRESSION" if is_regression else "",
+        )
+    if result["stations"] != baseline.get("stations"):
+        logger.warning(
+            "Collected {count} stations, but the baseline collected {baseline_count}",
+            count=result["stations"],
+            baseline_count=baseline.get("stations"),
+        )
+    return is_within_tolerance
+
+
+def parse_replay_args():
+    arg_parser = argparse.ArgumentParser(
+        description="Record fixture pages and replay them through the scraper offline"
+    )
+    arg_parser.add_argument(
+        "--log-level",
+        action="store",
+        type=str,
+        default="INFO",
+        help="The logging level to use",
+    )
+    arg_parser.add_argument(
+        "--structured-logging",
+        action="store_true",
+        default=False,
+        help="Denotes whether to structure log statements",
+    )
+    arg_parser.add_argument(
+        "--corpus",
+        action="store",
+        type=str,
+        default="replay-corpus",
+        help="Directory of the fixture corpus",
+    )
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser(
+        "record", help="Save the live pages in the station lists to the corpus"
+    )
+    record_parser.add_argument(
+        "--limit",
+        action="store",
+        type=int,
+        default=None,
+        help="Only record this many Costco pages",
+    )
+    record_parser.add_argument(
+        "--delay-ms",
+        action="store",
+        type=float,
+        default=500,
+        help="How long to wait between requests",
+    )
+
+    synthesize_parser = subparsers.add_parser(
+        "synthesize", help="Write a corpus of synthetic pages"
+    )
+    synthesize_parser.add_argument(
+        "--warehouses",
+        action="store",
+        type=int,
+        default=560,
+        help="Number of Costco warehouse pages",
+    )
+    synthesize_parser.add_argument(
+        "--clubs",
+        action="store",
+        type=int,
+        default=600,
+        help="Number of Sam's Clubs",
+    )
+
+    run_parser = subparsers.add_parser(
+        "run", help="Run the scraper against the corpus and compare to a baseline"
+    )
+    run_parser.add_argument(
+        "--runs",
+        action="store",
+        type=int,
+        default=3,
+        help="Number of runs to take the median of",
+    )
+    run_parser.add_argument(
+        "--latency-ms",
+        action="store",
+        type=float,
+        default=50,
+        help="Delay the stub servers add to every response",
+    )
+    run_parser.add_argument(
+        "--jitter-ms",
+        action="store",
+        type=float,
+        default=50,
+        help="Random delay of up to this much on top of the latency",
+    )
+    run_parser.add_argument(
+        "--error-rate",
+        action="store",
+        type=float,
+        default=0.01,
+        help="Fraction of Costco requests to fail with a 503",
+    )
+    run_parser.add_argument(
+        "--scraper-log-level",
+        action="store",
+        type=str,
+        default="WARNING",
+        help="The logging level of the scraper runs",
+    )
+    run_parser.add_argument(
+        "--baseline",
+        action="store",
+        type=str,
+        default="replay-baseline.json",
+        help="Measurements to compare against",
+    )
+    run_parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        default=False,
+        help="Save this run's measurements as the baseline instead of comparing",
+    )
+    run_parser.add_argument(
+        "--tolerance",
+        action="store",
+        type=float,
+        default=0.1,
+        help="Fraction by which a measurement may be worse than the baseline",
+    )
+    run_parser.add_argument(
+        "scraper_args",
+        nargs=argparse.REMAINDER,
+        help="Extra arguments for scraper.py after a --, e.g. -- --cpu-pool-size 4",
+    )
+    args = arg_parser.parse_args()
+    if args.command == "run" and args.scraper_args[:1] == ["--"]:
+        args.scraper_args = args.scraper_args[1:]
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_replay_args()
+    helpers.configure_logger(args)
+    if args.command == "record":
+        record_corpus(args.corpus, args.limit, args.delay_ms / 1000)
+    elif args.command == "synthesize":
+        synthesize_corpus(args.corpus, args.warehouses, args.clubs)
+    else:
+        result = replay_corpus(args)
+        if args.save_baseline or not os.path.exists(args.baseline):
+            with open(args.baseline, "w") as baseline_file:
+                baseline_file.write(json.dumps(result, indent=2))
+            logger.info("Saved baseline to {file_name}", file_name=args.baseline)
+        else:
+            with open(args.baseline, "r") as baseline_file:
+                baseline = json.loads(baseline_file.read())
+            if not compare_to_baseline(result, baseline, args.tolerance):
+                sys.exit(1)
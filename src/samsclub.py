@@ -1,7 +1,18 @@
 import helpers
-from helpers import now_in_epoch_ms
-import json
+from helpers import (
+    get_request_log_fmt_str,
+    api_response_log_fmt_str,
+    now_in_epoch_ms,
+)
+import http_session
+import jsonstream
 from loguru import logger
+import merge
+import metrics
+from metrics import run_metrics
+import normalize
+import requests
+import serializers
 from selenium import webdriver
 from selenium.webdriver import FirefoxOptions
 from selenium.webdriver.common.by import By
@@ -9,155 +20,297 @@ from selenium.common.exceptions import WebDriverException
 import time
 
 
-samsclub_us_data_source_url = "view-source:https://www.samsclub.com/api/node/vivaldi/browse/v2/clubfinder/list?singleLineAddr=94040&nbrOfStores=2147483647&distance=2147483647"
+samsclub_us_data_source_url = "https://www.samsclub.com/api/node/vivaldi/browse/v2/clubfinder/list?singleLineAddr=94040&nbrOfStores=2147483647&distance=2147483647"
+_samsclub_club_finder_url = "https://www.samsclub.com/club-finder"
+# Seconds to wait to connect, and then between bytes of the response
+_direct_request_timeout_s = 30
+_browser = None
+_stream_chunk_size = 64 * 1024
+# Clubs to normalize at once while the clubfinder data streams in
+_normalize_batch_size = 512
+_price_keys_by_grade = {
+    "UNLEAD": "regularPrice",
+    "MIDGRAD": "midGradePrice",
+    "PREMIUM": "premiumPrice",
+    "DIESEL": "dieselPrice",
+}
 
 
-def normalize_data(data) -> list:
-    logger.info("Normalizing data...")
-    p_start = time.perf_counter()
-    normalized = []
-    franchise_name = "SAMS_CLUB"
-    for station in data:
+def _normalize_batch(stations: list, observed_at_ms: int):
+    grade_prices = []
+    for station in stations:
+        for gas_price in station.get("gasPrices", ()):
+            grade_prices.append((gas_price["name"], gas_price["price"]))
+    price_points, price_keys = normalize.normalize_grade_prices(
+        grade_prices, _price_keys_by_grade, observed_at_ms=observed_at_ms
+    )
+    # Gas prices are in the same order as grade_prices
+    i = 0
+    for station in stations:
         # Map to normalized schema
         name = station["name"]
-        street_address = station["address"]["address1"]
-        city = station["address"]["city"]
-        state = station["address"]["state"]
-        postal_code = station["address"]["postalCode"]
-        latitude = station["geoPoint"]["latitude"]
-        longitude = station["geoPoint"]["longitude"]
-        regular_price = None
-        mid_grade_price = None
-        premium_price = None
-        diesel_price = None
-        if "gasPrices" in station:
-            for gas_price in station["gasPrices"]:
-                match gas_price["name"]:
-                    case "UNLEAD":
-                        regular_price = {
-                            "timestamp": now_in_epoch_ms(),
-                            "price": float(str(gas_price["price"])[0:4]),
-                        }
-                    case "MIDGRAD":
-                        mid_grade_price = {
-                            "timestamp": now_in_epoch_ms(),
-                            "price": float(str(gas_price["price"])[0:4]),
-                        }
-                    case "PREMIUM":
-                        premium_price = {
-                            "timestamp": now_in_epoch_ms(),
-                            "price": float(str(gas_price["price"])[0:4]),
-                        }
-                    case "DIESEL":
-                        diesel_price = {
-                            "timestamp": now_in_epoch_ms(),
-                            "price": float(str(gas_price["price"])[0:4]),
-                        }
-                    case _:
-                        logger.warning(
-                            '{station_name} has unexpected gas grade "{grade_name}". Gas price object={gas_price}',
-                            station_name=name,
-                            grade_name=gas_price["name"],
-                            gas_price=gas_price,
-                        )
-            if (
-                regular_price is None
-                and mid_grade_price is None
-                and premium_price is None
-                and diesel_price is None
-            ):
+        if "gasPrices" not in station:
+            logger.debug("Warehouse {name} does not have any gas prices", name=name)
+            continue
+        prices = dict.fromkeys(merge.price_keys)
+        for gas_price in station["gasPrices"]:
+            if price_keys[i] is None:
                 logger.warning(
-                    'Station "{station_name}" has a gas prices section, but no gas prices were found. Station details: {station}',
+                    '{station_name} has unexpected gas grade "{grade_name}". Gas price object={gas_price}',
                     station_name=name,
-                    station=station,
+                    grade_name=gas_price["name"],
+                    gas_price=gas_price,
                 )
-            elif regular_price is None:
-                logger.error(
-                    "Expected a price for regular octane at {station_name}, but got None!",
-                    station_name=name,
-                )
-            normalized.append(
-                {
-                    "franchiseName": franchise_name,
-                    "name": name,
-                    "streetAddress": street_address,
-                    "city": city,
-                    "state": state,
-                    "postalCode": postal_code,
-                    "latitude": latitude,
-                    "longitude": longitude,
-                    "currencySymbol": "$",
-                    "regularPrice": regular_price,
-                    "midGradePrice": mid_grade_price,
-                    "premiumPrice": premium_price,
-                    "dieselPrice": diesel_price,
-                }
+            else:
+                prices[price_keys[i]] = price_points[i]
+            i += 1
+        if all(price is None for price in prices.values()):
+            logger.warning(
+                'Station "{station_name}" has a gas prices section, but no gas prices were found. Station details: {station}',
+                station_name=name,
+                station=station,
             )
-        else:
-            logger.debug("Warehouse {name} does not have any gas prices", name=name)
+        elif prices["regularPrice"] is None:
+            logger.error(
+                "Expected a price for regular octane at {station_name}, but got None!",
+                station_name=name,
+            )
+        yield {
+            "franchiseName": "SAMS_CLUB",
+            "name": name,
+            "streetAddress": station["address"]["address1"],
+            "city": station["address"]["city"],
+            "state": station["address"]["state"],
+            "postalCode": station["address"]["postalCode"],
+            "latitude": station["geoPoint"]["latitude"],
+            "longitude": station["geoPoint"]["longitude"],
+            "currencySymbol": "$",
+            **prices,
+        }
+
+
+def iter_normalized_data(data, observed_at_ms: int | None = None):
+    """
+    Yields a normalized record for every club in data that has gas prices. data may be
+    a list or a stream of clubs, such as jsonstream.iter_array_items().
+
+    Clubs are normalized in batches as they stream in. Every price is timestamped
+    observed_at_ms, or by default when the first club arrived.
+    """
+    batch = []
+    for station in data:
+        if observed_at_ms is None:
+            observed_at_ms = now_in_epoch_ms()
+        batch.append(station)
+        if len(batch) == _normalize_batch_size:
+            yield from _normalize_batch(batch, observed_at_ms)
+            batch = []
+    if batch:
+        yield from _normalize_batch(batch, observed_at_ms)
+
+
+def normalize_data(data) -> list:
+    logger.info("Normalizing data...")
+    p_start = time.perf_counter()
+    normalized = list(iter_normalized_data(data))
     p_end = time.perf_counter()
     logger.info("Done normalizing data in {time_s} s", time_s=p_end - p_start)
     return normalized
 
 
-def get_and_normalize_data_from_url(url: str) -> list | None:
-    p_start = time.perf_counter()
-    logger.debug("Launching Firefox in headless mode...")
-    browser_opts = FirefoxOptions()
-    browser_opts.add_argument("--headless")
+def _open_details_stream_directly(url: str):
+    """
+    Requests the clubfinder API without a browser and returns an iterator over the
+    response body's chunks. Returns None if the request looks blocked, e.g. a non-200
+    response, a bot challenge page instead of JSON, or a connection that is dropped
+    or times out.
+    """
+    session = http_session.get_session()
     try:
-        browser = webdriver.Firefox(options=browser_opts)
-    except WebDriverException as err:
-        with open("geckodriver.log") as geckodriver_log:
-            logger.debug(geckodriver_log.read())
-        raise err
-    logger.info("Started Firefox in headless mode")
-
-    logger.debug("Making browser GET request to {url}", url=url)
+        if not any(
+            cookie.domain.endswith("samsclub.com") for cookie in session.cookies
+        ):
+            # Pick up the cookies a browser would have before calling the API
+            logger.debug(get_request_log_fmt_str, url=_samsclub_club_finder_url)
+            cookie_resp = session.get(
+                _samsclub_club_finder_url, timeout=_direct_request_timeout_s
+            )
+            logger.info(
+                api_response_log_fmt_str,
+                status_code=cookie_resp.status_code,
+                url=_samsclub_club_finder_url,
+            )
+        logger.debug(get_request_log_fmt_str, url=url)
+        resp = session.get(
+            url,
+            headers={
+                "Accept": "application/json",
+                "Referer": _samsclub_club_finder_url,
+            },
+            stream=True,
+            timeout=_direct_request_timeout_s,
+        )
+    except requests.RequestException as err:
+        logger.warning(
+            "Direct request to {url} failed: {error}", url=url, error=repr(err)
+        )
+        return None
+    logger.info(api_response_log_fmt_str, status_code=resp.status_code, url=url)
+    if resp.status_code != 200:
+        resp.close()
+        return None
+    if "json" not in resp.headers.get("Content-Type", ""):
+        logger.warning(
+            "Expected JSON from {url}, but got {content_type}",
+            url=url,
+            content_type=resp.headers.get("Content-Type"),
+        )
+        resp.close()
+        return None
+    return resp.iter_content(chunk_size=_stream_chunk_size)
+
+
+def _get_browser():
+    global _browser
+    if _browser is None:
+        logger.debug("Launching Firefox in headless mode...")
+        browser_start = time.perf_counter()
+        browser_opts = FirefoxOptions()
+        browser_opts.add_argument("--headless")
+        try:
+            _browser = webdriver.Firefox(options=browser_opts)
+        except WebDriverException as err:
+            with open("geckodriver.log") as geckodriver_log:
+                logger.debug(geckodriver_log.read())
+            raise err
+        logger.info(
+            "Started Firefox in headless mode in {time_s} s",
+            time_s=time.perf_counter() - browser_start,
+        )
+    return _browser
+
+
+def close_browser() -> None:
+    global _browser
+    if _browser is not None:
+        logger.info("Closing Firefox")
+        _browser.quit()
+        _browser = None
+
+
+def _get_details_blob_with_browser(url: str) -> str:
+    # The browser is kept open and reused until close_browser() is called
+    browser = _get_browser()
+    browser_url = "view-source:" + url
+    logger.debug("Making browser GET request to {url}", url=browser_url)
     browser_get_start = time.perf_counter()
-    browser.get(url)
+    browser.get(browser_url)
     browser_get_end = time.perf_counter()
     logger.info(
         "GET request to {url} done in {time_s} s",
-        url=url,
+        url=browser_url,
         time_s=browser_get_end - browser_get_start,
     )
 
     logger.info("Getting warehouse details blob from document...")
-    details_blob = (
+    return (
         browser.find_element(by=By.ID, value="viewsource")
         .find_element(by=By.TAG_NAME, value="pre")
         .text
     )
 
-    logger.info("Closing Firefox and returning blob")
-    browser.close()
 
-    data = json.loads(details_blob)
+def _iter_details(url: str, fetch_mode: str):
+    """
+    Yields every club in the clubfinder data at url as it streams in.
+
+    fetch_mode is "direct" to request the API without a browser, "browser" to load it
+    in headless Firefox, or "auto" to try the direct request and fall back to the
+    browser only if it's blocked.
+    """
+    p_start = time.perf_counter()
+    chunks = None
+    used_fetch_mode = fetch_mode
+    if fetch_mode != "browser":
+        chunks = _open_details_stream_directly(url)
+        used_fetch_mode = "direct"
+        if chunks is None:
+            if fetch_mode == "direct":
+                raise AssertionError("Direct request to the clubfinder API was blocked")
+            logger.warning(
+                "Direct request to the clubfinder API was blocked. Falling back to the browser"
+            )
+    if chunks is None:
+        # The browser only hands over the whole blob, so there's nothing to stream
+        chunks = [_get_details_blob_with_browser(url)]
+        used_fetch_mode = "browser"
+    logger.info(
+        "Got warehouse details response with {fetch_mode} fetch in {time_s} s",
+        fetch_mode=used_fetch_mode,
+        time_s=time.perf_counter() - p_start,
+    )
+    try:
+        yield from jsonstream.iter_array_items(chunks)
+    except jsonstream.NotAJsonArrayError as err:
+        data = err.value
+        if isinstance(data, dict) and "error" in data:
+            logger.critical(
+                "Data contains an error: {error} - {message}",
+                error=data["error"],
+                message=data.get("message"),
+            )
+            raise AssertionError("Data contains an error") from err
+        raise AssertionError("Data is not a list of clubs") from err
+
+
+def iter_data_from_url(url: str, fetch_mode: str = "auto"):
+    """
+    Yields normalized records for the Sam's Clubs with gas prices while the clubfinder
+    data is still streaming in.
+    """
+    return iter_normalized_data(_iter_details(url, fetch_mode))
+
+
+def get_and_normalize_data_from_url(url: str, fetch_mode: str = "auto") -> list | None:
+    p_start = time.perf_counter()
+    with run_metrics.span("samsclub_collect"):
+        normalized = normalize_data(_iter_details(url, fetch_mode))
     p_end = time.perf_counter()
-    if "error" in data:
-        logger.critical(
-            "Data contains an error: {error} - {message}",
-            error=data["error"],
-            message=data["message"],
-        )
-        raise AssertionError("Data contains an error")
-    normalized = normalize_data(data)
     logger.info(
-        "Collected gas prices for all Sam's Clubs in {time_s} s", time_s=p_end - p_start
+        "Collected gas prices for all Sam's Clubs in {time_s} s. Peak RSS: {peak_rss_mb}",
+        time_s=p_end - p_start,
+        peak_rss_mb=metrics.peak_rss_mb(),
     )
     return normalized
 
 
+def collect_prices(url: str, fetch_mode: str = "auto") -> list | None:
+    # For one-off jobs such as a Pool task, where nothing else will reuse the browser
+    try:
+        return get_and_normalize_data_from_url(url, fetch_mode)
+    finally:
+        close_browser()
+
+
+def collect_stations(args, executor=None, response_cache=None):
+    # Entry point for the franchise scheduler. The clubfinder API has a single
+    # response, so there's nothing for an executor or the response cache to do
+    try:
+        yield from iter_data_from_url(
+            samsclub_us_data_source_url, args.samsclub_fetch_mode
+        )
+    finally:
+        close_browser()
+
+
 def main(args):
     if args.refresh_station_list:
         logger.info("Sam's Club has no URL list to update")
     if args.no_collect_prices:
         logger.info('Will not collect prices as "--no-collect-prices" was specified')
     else:
-        data = get_and_normalize_data_from_url(samsclub_us_data_source_url)
-        with open("samsclub-prices-out.json", "w") as out_file:
-            out_file.write(json.dumps(data, indent=2))
+        data = collect_prices(samsclub_us_data_source_url, args.samsclub_fetch_mode)
+        serializers.write_stations("samsclub-prices-out", data, args.output_format)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+from array import array
+import gzip
+import json
+import struct
+import sys
+from store import StationPriceStore, price_keys
+from typing import Callable, NamedTuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Short keys for the compact JSON format. Prices become [price, timestamp] pairs
+_short_keys = {
+    "franchiseName": "f",
+    "name": "n",
+    "streetAddress": "a",
+    "city": "c",
+    "state": "s",
+    "postalCode": "z",
+    "latitude": "y",
+    "longitude": "x",
+    "currencySymbol": "u",
+    "regularPrice": "r",
+    "midGradePrice": "m",
+    "premiumPrice": "p",
+    "dieselPrice": "d",
+}
+_long_keys = {short_key: key for key, short_key in _short_keys.items()}
+_short_price_keys = {_short_keys[price_key] for price_key in price_keys}
+_binary_magic = b"GASP"
+_binary_version = 1
+_string_columns = (
+    "franchise_names",
+    "names",
+    "street_addresses",
+    "cities",
+    "states",
+    "postal_codes",
+    "currency_symbols",
+)
+
+
+class Serializer(NamedTuple):
+    """
+    A file format for normalized stations. encode takes stations (a list of dicts or
+    a StationPriceStore) and returns the file's bytes; decode turns them back into a
+    list of station dicts.
+    """
+
+    name: str
+    file_extension: str
+    encode: Callable
+    decode: Callable
+
+
+def _encode_json(stations) -> bytes:
+    return json.dumps(list(stations), indent=2).encode("utf-8")
+
+
+def _decode_json(data: bytes) -> list:
+    return json.loads(data)
+
+
+def _encode_compact_json(stations) -> bytes:
+    return json.dumps(
+        [
+            {
+                _short_keys[key]: (
+                    [value["price"], value["timestamp"]]
+                    if key in price_keys and value is not None
+                    else value
+                )
+                for key, value in station.items()
+            }
+            for station in stations
+        ],
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def _decode_compact_json(data: bytes) -> list:
+    return [
+        {
+            _long_keys[short_key]: (
+                {"timestamp": value[1], "price": value[0]}
+                if short_key in _short_price_keys and value is not None
+                else value
+            )
+            for short_key, value in station.items()
+        }
+        for station in json.loads(data)
+    ]
+
+
+def _to_little_endian(column: array) -> bytes:
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _from_little_endian(typecode: str, data: memoryview) -> array:
+    column = array(typecode)
+    column.frombytes(data)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def _encode_binary(stations) -> bytes:
+    """
+    Column-oriented layout of a StationPriceStore, all little-endian:
+
+        magic "GASP", version (u8), station count (u32)
+        per string column: string table length (u32), the column's distinct strings
+            as NUL-separated UTF-8, then one u32 index into the table per station
+        latitudes, longitudes (f64 each, NaN if unknown)
+        per grade: prices (f32, NaN if unreadable), timestamps (i64, -1 if missing)
+    """
+    if not isinstance(stations, StationPriceStore):
+        stations = StationPriceStore.from_records(stations)
+    parts = [
+        _binary_magic,
+        struct.pack("<BI", _binary_version, len(stations)),
+    ]
+    for column_name in _string_columns:
+        table = {}
+        indices = array("I", [0]) * len(stations)
+        for i, value in enumerate(getattr(stations, column_name)):
+            indices[i] = table.setdefault(value, len(table))
+        table_bytes = "\0".join(table).encode("utf-8")
+        parts.append(struct.pack("<I", len(table_bytes)))
+        parts.append(table_bytes)
+        parts.append(_to_little_endian(indices))
+    parts.append(_to_little_endian(stations.latitudes))
+    parts.append(_to_little_endian(stations.longitudes))
+    for price_key in price_keys:
+        parts.append(_to_little_endian(stations.prices[price_key]))
+        parts.append(_to_little_endian(stations.timestamps[price_key]))
+    return b"".join(parts)
+
+
+def read_binary_store(data: bytes) -> StationPriceStore:
+    """
+    Loads the binary format straight into a StationPriceStore, without building a
+    dict per station.
+    """
+    view = memoryview(data)
+    if bytes(view[:4]) != _binary_magic:
+        raise ValueError("Not a binary prices file")
+    version, count = struct.unpack_from("<BI", view, 4)
+    if version != _binary_version:
+        raise ValueError(
+            "Unsupported binary prices version {version}".format(version=version)
+        )
+    offset = 4 + struct.calcsize("<BI")
+
+    def take(typecode: str, item_count: int) -> array:
+        nonlocal offset
+        size = array(typecode).itemsize * item_count
+        column = _from_little_endian(typecode, view[offset : offset + size])
+        offset += size
+        return column
+
+    stations = StationPriceStore()
+    for column_name in _string_columns:
+        (table_length,) = struct.unpack_from("<I", view, offset)
+        offset += 4
+        table = [
+            sys.intern(value)
+            for value in str(view[offset : offset + table_length], "utf-8").split("\0")
+        ]
+        offset += table_length
+        setattr(stations, column_name, [table[i] for i in take("I", count)])
+    stations.latitudes = take("d", count)
+    stations.longitudes = take("d", count)
+    for price_key in price_keys:
+        stations.prices[price_key] = take("f", count)
+        stations.timestamps[price_key] = take("q", count)
+    return stations
+
+
+def _decode_binary(data: bytes) -> list:
+    return read_binary_store(data).to_records()
+
+
+def _gzipped(serializer: Serializer) -> Serializer:
+    return Serializer(
+        serializer.name + "-gzip",
+        serializer.file_extension + ".gz",
+        # mtime=0 keeps the output the same for the same stations. Level 6 is
+        # within a few percent of 9's size at about twice the speed
+        lambda stations: gzip.compress(
+            serializer.encode(stations), compresslevel=6, mtime=0
+        ),
+        lambda data: serializer.decode(gzip.decompress(data)),
+    )
+
+
+def _zstd_compressed(serializer: Serializer) -> Serializer:
+    return Serializer(
+        serializer.name + "-zstd",
+        serializer.file_extension + ".zst",
+        lambda stations: zstandard.ZstdCompressor().compress(
+            serializer.encode(stations)
+        ),
+        lambda data: serializer.decode(zstandard.ZstdDecompressor().decompress(data)),
+    )
+
+
+_json = Serializer("json", ".json", _encode_json, _decode_json)
+_compact_json = Serializer(
+    "compact-json", ".min.json", _encode_compact_json, _decode_compact_json
+)
+_binary = Serializer("binary", ".bin", _encode_binary, _decode_binary)
+serializers = {
+    serializer.name: serializer
+    for serializer in (
+        _json,
+        _compact_json,
+        _gzipped(_compact_json),
+        _binary,
+        _gzipped(_binary),
+    )
+}
+# zstandard is optional; its formats are only offered if it's installed
+if zstandard is not None:
+    serializers.update(
+        {
+            serializer.name: serializer
+            for serializer in (
+                _zstd_compressed(_compact_json),
+                _zstd_compressed(_binary),
+            )
+        }
+    )
+
+
+def write_stations(file_stem: str, stations, format_name: str) -> str:
+    """
+    Writes stations to file_stem plus the format's file extension and returns the
+    file's name.
+    """
+    serializer = serializers[format_name]
+    file_name = file_stem + serializer.file_extension
+    with open(file_name, "wb") as out_file:
+        out_file.write(serializer.encode(stations))
+    return file_name
@@ -0,0 +1,161 @@
+import hashlib
+import helpers
+import json
+from loguru import logger
+import merge
+import os
+import time
+from typing import NamedTuple
+
+
+manifest_file_name = "manifest.json"
+shard_by_choices = ("state", "geohash")
+_geohash_alphabet = "0123456789bcdefghjkmnpqrstuvwxyz"
+# Shard for stations that can't be placed, e.g. a geohash shard without coordinates
+_unplaced_shard_name = "unplaced"
+
+
+class ShardWriteResult(NamedTuple):
+    written: list
+    removed: list
+    unchanged: list
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.written or self.removed)
+
+
+def geohash(latitude: float, longitude: float, precision: int) -> str:
+    """
+    Returns the geohash of a point to precision characters. Points that share a
+    geohash prefix are close together, so a prefix names a region.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    # Bits alternate between longitude and latitude, starting with longitude
+    is_lon_bit = True
+    while len(chars) < precision:
+        value, value_range = (
+            (longitude, lon_range) if is_lon_bit else (latitude, lat_range)
+        )
+        mid = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            value_range[0] = mid
+        else:
+            value_range[1] = mid
+        is_lon_bit = not is_lon_bit
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_geohash_alphabet[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def shard_name(station: dict, shard_by: str, geohash_precision: int) -> str:
+    if shard_by == "state":
+        return station["state"] or _unplaced_shard_name
+    if station["latitude"] is None or station["longitude"] is None:
+        return _unplaced_shard_name
+    return geohash(station["latitude"], station["longitude"], geohash_precision)
+
+
+def serialize_shard(prices: list) -> bytes:
+    # Same layout as prices.json, so a shard is read the same way as the whole file
+    return (json.dumps(sorted(prices, key=merge.station_key), indent=2) + "\n").encode(
+        "utf-8"
+    )
+
+
+def read_manifest(shards_dir: str) -> dict:
+    manifest_path = os.path.join(shards_dir, manifest_file_name)
+    if not os.path.exists(manifest_path):
+        return {"shards": {}}
+    with open(manifest_path, "r") as manifest_file:
+        return json.loads(manifest_file.read())
+
+
+def write_shards(
+    shards_dir: str, prices: list, shard_by: str, geohash_precision: int = 2
+) -> ShardWriteResult:
+    """
+    Splits prices into one file per state or geohash prefix under shards_dir, next to
+    a manifest listing each shard's file, SHA-256, station count, and last-modified
+    time, so clients can fetch only the regions they need and tell when one changed.
+
+    Only shards whose content changed are rewritten; an unchanged shard keeps its
+    bytes and its last-modified time. Shards that no longer have any stations are
+    removed. Changing shard_by or geohash_precision rewrites everything.
+    """
+    p_start = time.perf_counter()
+    os.makedirs(shards_dir, exist_ok=True)
+    manifest = read_manifest(shards_dir)
+    if manifest.get("shardBy") != shard_by or (
+        shard_by == "geohash" and manifest.get("geohashPrecision") != geohash_precision
+    ):
+        # None of the old shards line up with the new ones
+        published_shards = {}
+    else:
+        published_shards = manifest["shards"]
+    prices_by_shard = {}
+    for station in prices:
+        prices_by_shard.setdefault(
+            shard_name(station, shard_by, geohash_precision), []
+        ).append(station)
+    now_ms = helpers.now_in_epoch_ms()
+    shards = {}
+    written = []
+    unchanged = []
+    for name, shard_prices in sorted(prices_by_shard.items()):
+        content = serialize_shard(shard_prices)
+        sha256 = hashlib.sha256(content).hexdigest()
+        published_shard = published_shards.get(name)
+        if published_shard is not None and published_shard["sha256"] == sha256:
+            shards[name] = published_shard
+            unchanged.append(name)
+            continue
+        shard_file_name = "{name}.json".format(name=name)
+        with open(os.path.join(shards_dir, shard_file_name), "wb") as shard_file:
+            shard_file.write(content)
+        shards[name] = {
+            "file": shard_file_name,
+            "sha256": sha256,
+            "stationCount": len(shard_prices),
+            "bytes": len(content),
+            "lastModified": now_ms,
+        }
+        written.append(name)
+    removed = [name for name in manifest["shards"] if name not in shards]
+    for name in removed:
+        shard_path = os.path.join(shards_dir, manifest["shards"][name]["file"])
+        if os.path.exists(shard_path):
+            os.remove(shard_path)
+    result = ShardWriteResult(written=written, removed=removed, unchanged=unchanged)
+    if not result.is_empty or "shardBy" not in manifest:
+        manifest = {
+            "shardBy": shard_by,
+            "geohashPrecision": geohash_precision if shard_by == "geohash" else None,
+            "lastModified": now_ms,
+            "shards": shards,
+        }
+        # Write then rename, so a client never reads a manifest that's half written
+        manifest_path = os.path.join(shards_dir, manifest_file_name)
+        with open(manifest_path + ".tmp", "w") as manifest_file:
+            manifest_file.write(json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+        os.replace(manifest_path + ".tmp", manifest_path)
+    logger.info(
+        "Sharded {count} stations by {shard_by} into {shard_count} shards in {time_s} s: {written} written, {removed} removed, {unchanged} unchanged",
+        count=len(prices),
+        shard_by=shard_by,
+        shard_count=len(shards),
+        time_s=time.perf_counter() - p_start,
+        written=len(written),
+        removed=len(removed),
+        unchanged=len(unchanged),
+    )
+    return result
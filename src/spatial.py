@@ -0,0 +1,247 @@
+import heapq
+import math
+import merge
+
+
+earth_radius_km = 6371.0088
+# Small enough that a leaf is cheaper to scan than to split further
+_leaf_size = 16
+
+
+class KDTree:
+    """
+    k-d tree over points of any number of dimensions, split at the median with up to
+    _leaf_size points per leaf. Queries return indices into points.
+    """
+
+    def __init__(self, points: list):
+        self.points = points
+        self.dims = len(points[0]) if points else 0
+        self.root = self._build(list(range(len(points))), 0)
+
+    def _build(self, indices: list, depth: int):
+        # A leaf is a list of indices and an internal node is (axis, split, left, right)
+        if len(indices) <= _leaf_size:
+            return indices
+        axis = depth % self.dims
+        indices.sort(key=lambda i: self.points[i][axis])
+        mid = len(indices) // 2
+        # Left holds values <= split and right holds values >= split
+        return (
+            axis,
+            self.points[indices[mid]][axis],
+            self._build(indices[:mid], depth + 1),
+            self._build(indices[mid:], depth + 1),
+        )
+
+    def _squared_distance(self, i: int, point: tuple) -> float:
+        return sum((a - b) * (a - b) for a, b in zip(self.points[i], point))
+
+    def nearest(self, point: tuple, k: int) -> list:
+        """
+        Returns (squared distance, index) for the k points nearest to point, nearest
+        first.
+        """
+        if k <= 0:
+            return []
+        # Max-heap of the best k so far, by negated squared distance
+        best = []
+        # (node, lower bound on the squared distance to anything under it)
+        stack = [(self.root, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if len(best) == k and bound >= -best[0][0]:
+                continue
+            if isinstance(node, list):
+                for i in node:
+                    squared_distance = self._squared_distance(i, point)
+                    if len(best) < k:
+                        heapq.heappush(best, (-squared_distance, i))
+                    elif squared_distance < -best[0][0]:
+                        heapq.heapreplace(best, (-squared_distance, i))
+                continue
+            axis, split, left, right = node
+            diff = point[axis] - split
+            near, far = (left, right) if diff < 0 else (right, left)
+            # Visit the near side first by pushing it last
+            stack.append((far, max(bound, diff * diff)))
+            stack.append((near, bound))
+        return sorted((-negated, i) for negated, i in best)
+
+    def within_radius(self, point: tuple, radius: float) -> list:
+        """
+        Returns (squared distance, index) for every point within radius of point,
+        nearest first.
+        """
+        squared_radius = radius * radius
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                for i in node:
+                    squared_distance = self._squared_distance(i, point)
+                    if squared_distance <= squared_radius:
+                        found.append((squared_distance, i))
+                continue
+            axis, split, left, right = node
+            if point[axis] - radius <= split:
+                stack.append(left)
+            if point[axis] + radius >= split:
+                stack.append(right)
+        found.sort()
+        return found
+
+    def within_box(self, low: tuple, high: tuple) -> list:
+        """
+        Returns the index of every point inside the box from low to high, inclusive.
+        """
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                found.extend(
+                    i
+                    for i in node
+                    if all(
+                        lo <= value <= hi
+                        for lo, value, hi in zip(low, self.points[i], high)
+                    )
+                )
+                continue
+            axis, split, left, right = node
+            if low[axis] <= split:
+                stack.append(left)
+            if high[axis] >= split:
+                stack.append(right)
+        return found
+
+
+def _unit_vector(latitude: float, longitude: float) -> tuple:
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def _chord_to_km(chord: float) -> float:
+    return 2 * earth_radius_km * math.asin(min(1.0, chord / 2))
+
+
+def _km_to_chord(distance_km: float) -> float:
+    return 2 * math.sin(min(math.pi, distance_km / earth_radius_km) / 2)
+
+
+def great_circle_km(
+    latitude_a: float, longitude_a: float, latitude_b: float, longitude_b: float
+) -> float:
+    return _chord_to_km(
+        math.dist(
+            _unit_vector(latitude_a, longitude_a),
+            _unit_vector(latitude_b, longitude_b),
+        )
+    )
+
+
+class StationIndex:
+    """
+    Spatial index over normalized stations for nearest-station, radius and bounding
+    box queries. Stations without coordinates are left out.
+
+    Distance queries run on a k-d tree of points on the unit sphere, where straight
+    line (chord) distance orders stations the same way great-circle distance does,
+    so there's no distortion near the poles or the antimeridian. Bounding box queries
+    run on a k-d tree of (latitude, longitude).
+    """
+
+    def __init__(self, stations):
+        self.stations = [
+            station
+            for station in stations
+            if station["latitude"] is not None and station["longitude"] is not None
+        ]
+        self._sphere_tree = KDTree(
+            [
+                _unit_vector(station["latitude"], station["longitude"])
+                for station in self.stations
+            ]
+        )
+        self._lat_lon_tree = KDTree(
+            [(station["latitude"], station["longitude"]) for station in self.stations]
+        )
+
+    def __len__(self) -> int:
+        return len(self.stations)
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1) -> list:
+        """
+        Returns (distance in km, station) for the k stations nearest to the given
+        point, nearest first.
+        """
+        return [
+            (_chord_to_km(math.sqrt(squared_chord)), self.stations[i])
+            for squared_chord, i in self._sphere_tree.nearest(
+                _unit_vector(latitude, longitude), k
+            )
+        ]
+
+    def within_radius(
+        self, latitude: float, longitude: float, radius_km: float
+    ) -> list:
+        """
+        Returns (distance in km, station) for every station within radius_km of the
+        given point, nearest first.
+        """
+        return [
+            (_chord_to_km(math.sqrt(squared_chord)), self.stations[i])
+            for squared_chord, i in self._sphere_tree.within_radius(
+                _unit_vector(latitude, longitude), _km_to_chord(radius_km)
+            )
+        ]
+
+    def within_bbox(
+        self,
+        min_latitude: float,
+        min_longitude: float,
+        max_latitude: float,
+        max_longitude: float,
+    ) -> list:
+        """
+        Returns every station inside the bounding box. A box with min_longitude
+        greater than max_longitude crosses the antimeridian.
+        """
+        if min_longitude <= max_longitude:
+            longitude_ranges = [(min_longitude, max_longitude)]
+        else:
+            longitude_ranges = [(min_longitude, 180.0), (-180.0, max_longitude)]
+        return [
+            self.stations[i]
+            for low_longitude, high_longitude in longitude_ranges
+            for i in self._lat_lon_tree.within_box(
+                (min_latitude, low_longitude), (max_latitude, high_longitude)
+            )
+        ]
+
+
+def _price_of(station: dict, price_key: str) -> float | None:
+    price = station[price_key]
+    return None if price is None else price["price"]
+
+
+def cheapest_by_grade(stations) -> dict:
+    """
+    Returns the station with the lowest price for each grade among stations (e.g. the
+    stations a StationIndex query found), or None for a grade none of them has a price
+    for.
+    """
+    cheapest = {price_key: None for price_key in merge.price_keys}
+    for station in stations:
+        for price_key in merge.price_keys:
+            price = _price_of(station, price_key)
+            if price is None:
+                continue
+            if cheapest[price_key] is None or price < _price_of(
+                cheapest[price_key], price_key
+            ):
+                cheapest[price_key] = station
+    return cheapest
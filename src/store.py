@@ -0,0 +1,132 @@
+from array import array
+import json
+import math
+import sys
+
+
+price_keys = ("regularPrice", "midGradePrice", "premiumPrice", "dieselPrice")
+# Prices have at most 3 decimal places, which float32 can round-trip below $1000
+_price_decimals = 3
+_missing_timestamp = -1
+
+
+def _coordinate_to_float(coordinate: float | None) -> float:
+    return math.nan if coordinate is None else coordinate
+
+
+def _float_to_coordinate(value: float) -> float | None:
+    return None if math.isnan(value) else value
+
+
+class StationPriceStore:
+    """
+    Column-oriented store of normalized station prices.
+
+    Each station field is a column: numbers live in typed arrays (float32 prices,
+    int64 epoch ms timestamps, float64 coordinates) and repeated strings such as
+    franchise names and states are interned, instead of every station being a 13-key
+    dict with four nested price dicts. A missing grade has a timestamp of -1, a
+    grade whose price couldn't be read has a NaN price, and an unknown coordinate is
+    NaN.
+
+    Iterating over the store yields the same dicts the scrapers produce, so it can be
+    used wherever a list of normalized stations is expected.
+    """
+
+    __slots__ = (
+        "franchise_names",
+        "names",
+        "street_addresses",
+        "cities",
+        "states",
+        "postal_codes",
+        "latitudes",
+        "longitudes",
+        "currency_symbols",
+        "prices",
+        "timestamps",
+    )
+
+    def __init__(self):
+        self.franchise_names = []
+        self.names = []
+        self.street_addresses = []
+        self.cities = []
+        self.states = []
+        self.postal_codes = []
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+        self.currency_symbols = []
+        self.prices = {price_key: array("f") for price_key in price_keys}
+        self.timestamps = {price_key: array("q") for price_key in price_keys}
+
+    @classmethod
+    def from_records(cls, stations) -> "StationPriceStore":
+        station_price_store = cls()
+        station_price_store.extend(stations)
+        return station_price_store
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def append(self, station: dict) -> None:
+        self.franchise_names.append(sys.intern(station["franchiseName"]))
+        self.names.append(station["name"])
+        self.street_addresses.append(station["streetAddress"])
+        self.cities.append(sys.intern(station["city"]))
+        self.states.append(sys.intern(station["state"]))
+        self.postal_codes.append(station["postalCode"])
+        self.latitudes.append(_coordinate_to_float(station["latitude"]))
+        self.longitudes.append(_coordinate_to_float(station["longitude"]))
+        self.currency_symbols.append(sys.intern(station["currencySymbol"]))
+        for price_key in price_keys:
+            price = station[price_key]
+            if price is None:
+                self.prices[price_key].append(math.nan)
+                self.timestamps[price_key].append(_missing_timestamp)
+            else:
+                self.prices[price_key].append(
+                    math.nan if price["price"] is None else price["price"]
+                )
+                self.timestamps[price_key].append(price["timestamp"])
+
+    def extend(self, stations) -> None:
+        for station in stations:
+            self.append(station)
+
+    def _price_at(self, price_key: str, i: int) -> dict | None:
+        timestamp = self.timestamps[price_key][i]
+        if timestamp == _missing_timestamp:
+            return None
+        price = self.prices[price_key][i]
+        return {
+            "timestamp": timestamp,
+            "price": None if math.isnan(price) else round(price, _price_decimals),
+        }
+
+    def __getitem__(self, i: int) -> dict:
+        return {
+            "franchiseName": self.franchise_names[i],
+            "name": self.names[i],
+            "streetAddress": self.street_addresses[i],
+            "city": self.cities[i],
+            "state": self.states[i],
+            "postalCode": self.postal_codes[i],
+            "latitude": _float_to_coordinate(self.latitudes[i]),
+            "longitude": _float_to_coordinate(self.longitudes[i]),
+            "currencySymbol": self.currency_symbols[i],
+            "regularPrice": self._price_at("regularPrice", i),
+            "midGradePrice": self._price_at("midGradePrice", i),
+            "premiumPrice": self._price_at("premiumPrice", i),
+            "dieselPrice": self._price_at("dieselPrice", i),
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_records(self) -> list:
+        return list(self)
+
+    def to_json(self, indent: int | None = 2) -> str:
+        return json.dumps(self.to_records(), indent=indent)
@@ -0,0 +1,243 @@
+import argparse
+import collections
+import hashlib
+import helpers
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from loguru import logger
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    # Keep connections alive like a real web server would
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.count_request()
+        time.sleep(self.server.latency_s + random.uniform(0, self.server.jitter_s))
+        if random.random() < self.server.error_rate:
+            body = b"Service Unavailable"
+            self.server.error_count += 1
+            self.send_response(503)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.server.is_over_rate_limit():
+            body = b"Too Many Requests"
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        page_name = os.path.basename(urlsplit(self.path).path)
+        if page_name in self.server.status_codes:
+            body = b"Status set by the stub server"
+            self.send_response(self.server.status_codes[page_name])
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        page_file_name = os.path.join(self.server.pages_dir, page_name)
+        try:
+            with open(page_file_name, "rb") as page_file:
+                body = page_file.read()
+            status_code = 200
+        except (FileNotFoundError, IsADirectoryError):
+            body = b"Not Found"
+            status_code = 404
+        etag = None
+        if status_code == 200:
+            etag = '"{digest}"'.format(digest=hashlib.sha1(body).hexdigest())
+            if self.headers.get("If-None-Match") == etag:
+                status_code = 304
+                body = b""
+        self.send_response(status_code)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        # Saved API responses such as the clubfinder list have no file extension
+        self.send_header(
+            "Content-Type",
+            (
+                "application/json"
+                if body[:1] in (b"[", b"{")
+                else "text/html; charset=utf-8"
+            ),
+        )
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.trace("Stub server: " + format, *args)
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Serves saved pages from pages_dir by the basename of the request path, so
+    https://www.costco.com/warehouse-locations/hoover-al-362.html is served from
+    <pages_dir>/hoover-al-362.html. Every response is delayed by latency_s plus up to
+    jitter_s more, and error_rate of them fail with a 503. Pages carry an ETag, and
+    requests with a matching If-None-Match get a 304.
+
+    If max_rate_per_s is set, requests beyond that many in the last second get a 429
+    with Retry-After, like a rate-limited origin would send.
+
+    status_codes maps page names to a status code to always respond to them with
+    instead, e.g. a 403 for a page that a real site blocks.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        pages_dir: str,
+        latency_s: float = 0,
+        port: int = 0,
+        max_rate_per_s: float | None = None,
+        jitter_s: float = 0,
+        error_rate: float = 0,
+        status_codes: dict | None = None,
+    ):
+        super().__init__(("127.0.0.1", port), _StubRequestHandler)
+        self.pages_dir = pages_dir
+        self.latency_s = latency_s
+        self.max_rate_per_s = max_rate_per_s
+        self.jitter_s = jitter_s
+        self.error_rate = error_rate
+        self.status_codes = status_codes or {}
+        self.request_count = 0
+        self.throttled_count = 0
+        self.error_count = 0
+        self._request_count_lock = threading.Lock()
+        self._request_times = collections.deque()
+        self._request_times_lock = threading.Lock()
+
+    def count_request(self) -> None:
+        with self._request_count_lock:
+            self.request_count += 1
+
+    def is_over_rate_limit(self) -> bool:
+        if self.max_rate_per_s is None:
+            return False
+        now = time.monotonic()
+        with self._request_times_lock:
+            while self._request_times and self._request_times[0] <= now - 1:
+                self._request_times.popleft()
+            if len(self._request_times) >= self.max_rate_per_s:
+                self.throttled_count += 1
+                return True
+            self._request_times.append(now)
+            return False
+
+    @property
+    def base_url(self) -> str:
+        return "http://127.0.0.1:{port}".format(port=self.server_address[1])
+
+
+def start_stub_server(
+    pages_dir: str,
+    latency_s: float = 0,
+    port: int = 0,
+    max_rate_per_s: float | None = None,
+    jitter_s: float = 0,
+    error_rate: float = 0,
+    status_codes: dict | None = None,
+):
+    server = StubServer(
+        pages_dir,
+        latency_s=latency_s,
+        port=port,
+        max_rate_per_s=max_rate_per_s,
+        jitter_s=jitter_s,
+        error_rate=error_rate,
+        status_codes=status_codes,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(
+        "Stub server serving {pages_dir} at {base_url}",
+        pages_dir=pages_dir,
+        base_url=server.base_url,
+    )
+    return server
+
+
+def parse_stub_server_args():
+    arg_parser = argparse.ArgumentParser(
+        description="Serve saved pages locally in place of the real sites"
+    )
+    arg_parser.add_argument(
+        "--log-level",
+        action="store",
+        type=str,
+        default="INFO",
+        help="The logging level to use",
+    )
+    arg_parser.add_argument(
+        "--structured-logging",
+        action="store_true",
+        default=False,
+        help="Denotes whether to structure log statements",
+    )
+    arg_parser.add_argument(
+        "--pages-dir",
+        action="store",
+        type=str,
+        required=True,
+        help="Directory of saved pages to serve",
+    )
+    arg_parser.add_argument(
+        "--port",
+        action="store",
+        type=int,
+        default=8000,
+        help="Port to listen on",
+    )
+    arg_parser.add_argument(
+        "--latency-ms",
+        action="store",
+        type=float,
+        default=0,
+        help="Delay to add to every response",
+    )
+    arg_parser.add_argument(
+        "--jitter-ms",
+        action="store",
+        type=float,
+        default=0,
+        help="Add a random delay of up to this much on top of the latency",
+    )
+    arg_parser.add_argument(
+        "--error-rate",
+        action="store",
+        type=float,
+        default=0,
+        help="Fraction of requests to fail with a 503",
+    )
+    arg_parser.add_argument(
+        "--max-request-rate",
+        action="store",
+        type=float,
+        default=None,
+        help="Respond with 429 to requests beyond this many per second",
+    )
+    return arg_parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_stub_server_args()
+    helpers.configure_logger(args)
+    server = StubServer(
+        args.pages_dir,
+        latency_s=args.latency_ms / 1000,
+        port=args.port,
+        max_rate_per_s=args.max_request_rate,
+        jitter_s=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+    )
+    logger.info("Stub server listening at {base_url}", base_url=server.base_url)
+    server.serve_forever()
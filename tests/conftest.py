@@ -0,0 +1,46 @@
+import os
+import sys
+
+
+# The scraper's modules import each other as top-level modules, as they do when run
+# from src
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import benchmark  # noqa: E402
+import costco  # noqa: E402
+import json  # noqa: E402
+import pytest  # noqa: E402
+import stubserver  # noqa: E402
+from typing import NamedTuple  # noqa: E402
+
+
+_synthetic_station_count = 12
+
+
+class CostcoSite(NamedTuple):
+    server: stubserver.StubServer
+    # With URLs on the stub server, as written to the station list file
+    url_objects: list
+
+
+@pytest.fixture
+def costco_site(tmp_path, monkeypatch):
+    """
+    Synthetic warehouse pages served by a stub server, listed in a Costco station
+    list file in the working directory, which is a temporary directory.
+    """
+    pages_dir = tmp_path / "pages"
+    pages_dir.mkdir()
+    url_objects = benchmark.write_synthetic_warehouse_pages(
+        str(pages_dir), _synthetic_station_count
+    )
+    server = stubserver.start_stub_server(str(pages_dir))
+    url_objects = [
+        {**url_object, "url": server.base_url + url_object["url"]}
+        for url_object in url_objects
+    ]
+    monkeypatch.chdir(tmp_path)
+    with open(costco.costco_station_urls_file_name, "w") as urls_file:
+        urls_file.write(json.dumps(url_objects))
+    yield CostcoSite(server, url_objects)
+    server.shutdown()
@@ -0,0 +1,62 @@
+import costco
+import helpers
+import json
+from multiprocessing import Pool
+import publish
+import sys
+
+
+def _collect(monkeypatch, pool, request_budget: int, station_list_delta=None) -> list:
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["scraper.py", "--request-budget", str(request_budget)],
+    )
+    return list(
+        costco.collect_stations(
+            helpers.parse_command_args(),
+            pool,
+            station_list_delta=station_list_delta,
+        )
+    )
+
+
+def test_collects_the_refreshed_station_list(costco_site, monkeypatch):
+    old_url_objects = costco_site.url_objects[1:-2]
+    with open(costco.costco_station_urls_file_name, "w") as urls_file:
+        urls_file.write(json.dumps(old_url_objects))
+    new_url_objects = costco_site.url_objects[:-2] + costco_site.url_objects[-1:]
+    delta = costco.diff_station_urls(old_url_objects, new_url_objects)
+    assert delta.added == [costco_site.url_objects[0], costco_site.url_objects[-1]]
+    assert delta.removed == []
+    with Pool(2) as pool:
+        _collect(monkeypatch, pool, request_budget=100)
+        request_count = costco_site.server.request_count
+        # Only enough budget for the two new stations, which go before the rest
+        stations = _collect(monkeypatch, pool, request_budget=2, station_list_delta=delta)
+        assert costco_site.server.request_count == request_count + 2
+        assert len(stations) == len(new_url_objects)
+        # A closed station isn't collected, even from its last fetched result
+        closed = costco.diff_station_urls(new_url_objects, new_url_objects[1:])
+        assert closed.removed == [costco_site.url_objects[0]]
+        stations = _collect(monkeypatch, pool, request_budget=0, station_list_delta=closed)
+        assert len(stations) == len(new_url_objects) - 1
+
+
+def test_seeds_refresh_histories_from_published_prices(costco_site, monkeypatch):
+    published_at = helpers.now_in_epoch_ms()
+    published_stations = [
+        costco._normalized_station(
+            url_object, regular_price={"timestamp": published_at, "price": 3.5}
+        )
+        for url_object in costco_site.url_objects[1:]
+    ]
+    with open(publish.prices_file_name, "w") as prices_file:
+        prices_file.write(publish.serialize_prices(published_stations))
+    with Pool(2) as pool:
+        stations = _collect(monkeypatch, pool, request_budget=1)
+    # Only the station that was never published is fetched
+    assert costco_site.server.request_count == 1
+    assert len(stations) == len(costco_site.url_objects)
+    for station in published_stations:
+        assert station in stations
@@ -0,0 +1,37 @@
+import extract
+import pytest
+
+
+_page = """<html><head>
+<style>.gas-price-section { margin: 0 }</style>
+<script>document.querySelector("div.gas-price-section")</script>
+</head><body>
+<div class="warehouse"><div class="gas-price-section" id="gas">
+  <div><span class="gas-type">Regular</span><span>$3.<b>45</b><sup>9</sup></span></div>
+  <div><span class="gas-type">Premium</span><span>$4.19&#57;</span></div>
+  <div><span class="gas-type">Diesel</span></div>
+</div><div>Hours</div></div>
+</body></html>"""
+
+
+def test_slices_the_gas_price_section_past_earlier_mentions():
+    section = extract.slice_gas_price_section(_page)
+    assert section.startswith('<div class="gas-price-section" id="gas">')
+    assert section.endswith("</div>\n</div>")
+    assert "Hours" not in section
+    assert extract.slice_gas_price_section("<div class='gas-price-section'>") is None
+
+
+@pytest.mark.parametrize("backend", sorted(extract.backends))
+def test_backends_extract_the_same_gas_prices(backend):
+    assert extract.backends[backend](_page) == [
+        ("Regular", "$3.459"),
+        ("Premium", "$4.199"),
+        ("Diesel", None),
+    ]
+    assert extract.backends[backend]("<html><body>Closed</body></html>") is None
+
+
+def test_falls_back_to_html5lib_when_no_gas_prices_are_found(monkeypatch):
+    monkeypatch.setitem(extract.backends, "section", lambda html: [])
+    assert extract.extract_gas_prices(_page, "section")[0] == ("Regular", "$3.459")
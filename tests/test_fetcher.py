@@ -0,0 +1,89 @@
+import fetcher
+import httpcache
+import os
+import pytest
+import stubserver
+
+
+@pytest.fixture
+def pages_dir(tmp_path):
+    for i in range(6):
+        (tmp_path / "page-{i}".format(i=i)).write_text("Page {i}".format(i=i))
+    return tmp_path
+
+
+def _urls(server, count: int) -> list:
+    return [
+        "http://127.0.0.1:{port}/page-{i}".format(port=server.server_port, i=i)
+        for i in range(count)
+    ]
+
+
+def test_retries_429_until_the_page_is_served(pages_dir):
+    server = stubserver.start_stub_server(str(pages_dir), max_rate_per_s=2)
+    try:
+        results = fetcher.fetch_all(
+            _urls(server, 6), concurrency=6, max_rate_per_s=100
+        )
+    finally:
+        server.shutdown()
+    assert server.throttled_count > 0
+    assert [result.status_code for result in results] == [200] * 6
+    assert [result.text for result in results] == [
+        "Page {i}".format(i=i) for i in range(6)
+    ]
+    assert any(result.attempts > 1 for result in results)
+
+
+def test_does_not_retry_403_or_request_more_from_the_host(pages_dir):
+    server = stubserver.start_stub_server(
+        str(pages_dir), status_codes={"page-0": 403}
+    )
+    try:
+        results = fetcher.fetch_all(_urls(server, 3), concurrency=1, max_rate_per_s=100)
+    finally:
+        server.shutdown()
+    assert server.request_count == 1
+    assert results[0].status_code == 403
+    assert results[0].attempts == 1
+    assert results[0].text is None
+    assert [(result.status_code, result.attempts) for result in results[1:]] == [
+        (None, 0),
+        (None, 0),
+    ]
+
+
+class _ExpiringResponseCache(httpcache.ResponseCache):
+    # Every entry expires as soon as it has been read once
+    def get(self, url: str) -> dict | None:
+        entry = super().get(url)
+        if entry is not None:
+            os.remove(self._entry_file_name(url))
+        return entry
+
+
+def test_not_modified_page_uses_the_entry_its_validators_came_from(
+    pages_dir, tmp_path
+):
+    response_cache = _ExpiringResponseCache(
+        str(tmp_path / "cache"), ttl_s=3600, max_bytes=1024 * 1024
+    )
+    server = stubserver.start_stub_server(str(pages_dir))
+    try:
+        urls = _urls(server, 1)
+        (result,) = fetcher.fetch_all(urls, concurrency=1, max_rate_per_s=100)
+        response_cache.put(urls[0], result.etag, None, "Cached page 0")
+        (not_modified,) = fetcher.fetch_all(
+            urls, concurrency=1, max_rate_per_s=100, response_cache=response_cache
+        )
+        (refetched,) = fetcher.fetch_all(
+            urls, concurrency=1, max_rate_per_s=100, response_cache=response_cache
+        )
+    finally:
+        server.shutdown()
+    assert result.status_code == 200
+    assert not_modified.status_code == 304
+    assert not_modified.cached_content == "Cached page 0"
+    # Without an entry, no validators are sent and the page is fetched in full
+    assert refetched.status_code == 200
+    assert refetched.text == "Page 0"
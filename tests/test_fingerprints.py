@@ -0,0 +1,55 @@
+import costco
+import fingerprints
+import helpers
+from multiprocessing import Pool
+import sys
+
+
+def _station(regular_price: float) -> dict:
+    return {
+        "name": "A",
+        "regularPrice": {"timestamp": 1, "price": regular_price},
+        "midGradePrice": None,
+        "premiumPrice": None,
+        "dieselPrice": None,
+    }
+
+
+def test_reuses_prices_of_pages_that_hash_the_same(tmp_path):
+    file_name = str(tmp_path / "fingerprints.json")
+    page_fingerprints = fingerprints.read_page_fingerprints(file_name)
+    section_hash = page_fingerprints.hash_section("<div>$3.45</div>", "section")
+    assert section_hash != page_fingerprints.hash_section("<div>$3.45</div>", "html5lib")
+    assert page_fingerprints.unchanged_prices("a", section_hash) is None
+    page_fingerprints.record("a", section_hash, _station(3.45))
+    page_fingerprints.record("closed", section_hash, _station(3.45))
+    page_fingerprints.retain(["a", "new"])
+    fingerprints.write_page_fingerprints(file_name, page_fingerprints)
+
+    page_fingerprints = fingerprints.read_page_fingerprints(file_name)
+    assert page_fingerprints.entries.keys() == {"a"}
+    assert page_fingerprints.unchanged_prices("a", "other") is None
+    prices = page_fingerprints.unchanged_prices("a", section_hash)
+    assert prices["regularPrice"] == {"timestamp": 1, "price": 3.45}
+    assert "name" not in prices
+    assert page_fingerprints.unchanged_count == 1
+
+
+def _collect(monkeypatch, pool) -> list:
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["scraper.py", "--page-fingerprints-file", "fingerprints.json"],
+    )
+    return list(costco.collect_stations(helpers.parse_command_args(), pool))
+
+
+def test_unchanged_pages_keep_their_first_observed_prices(costco_site, monkeypatch):
+    with Pool(2) as pool:
+        first_run = _collect(monkeypatch, pool)
+        second_run = _collect(monkeypatch, pool)
+    assert len(first_run) == len(costco_site.url_objects)
+    # Same prices with the same timestamps, in whatever order they were fetched in
+    assert sorted(first_run, key=lambda station: station["name"]) == sorted(
+        second_run, key=lambda station: station["name"]
+    )
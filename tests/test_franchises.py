@@ -0,0 +1,35 @@
+import franchises
+import itertools
+import threading
+
+
+def test_stops_the_sources_when_the_caller_stops_early(monkeypatch):
+    monkeypatch.setattr(franchises, "_results_queue_size", 2)
+    closed_sources = []
+
+    def collect_forever(name: str):
+        def collect(args, executor, response_cache):
+            try:
+                for i in itertools.count():
+                    yield {"name": name, "i": i}
+            finally:
+                closed_sources.append(name)
+
+        return collect
+
+    sources = [
+        franchises.FranchiseSource(name, collect_forever(name)) for name in ("A", "B")
+    ]
+    stations = []
+
+    def consume() -> None:
+        collector = franchises.iter_all_stations(sources, None)
+        stations.extend(itertools.islice(collector, 3))
+        collector.close()
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    consumer.join(timeout=10)
+    assert not consumer.is_alive()
+    assert len(stations) == 3
+    assert sorted(closed_sources) == ["A", "B"]
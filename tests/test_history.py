@@ -0,0 +1,75 @@
+from history import PriceHistory
+import merge
+
+
+_ms_per_day = 86_400_000
+
+
+def _station(name: str, state: str, regular_price, diesel_price=None) -> dict:
+    return {
+        "franchiseName": "COSTCO",
+        "name": name,
+        "streetAddress": "1 {name} St".format(name=name),
+        "city": name,
+        "state": state,
+        "postalCode": "00000",
+        "latitude": 0.0,
+        "longitude": 0.0,
+        "currencySymbol": "$",
+        "regularPrice": regular_price,
+        "midGradePrice": None,
+        "premiumPrice": None,
+        "dieselPrice": diesel_price,
+    }
+
+
+def _price(timestamp: int, price: float | None) -> dict:
+    return {"timestamp": timestamp, "price": price}
+
+
+def test_ingests_each_price_once(tmp_path):
+    price_history = PriceHistory(str(tmp_path / "history.sqlite3"))
+    stations = [
+        _station("A", "WA", _price(0, 3.459), _price(0, 4.199)),
+        _station("B", "WA", _price(0, None)),
+    ]
+    assert price_history.ingest(stations) == 2
+    # An unchanged price keeps its timestamp, so it isn't stored again
+    stations[0]["regularPrice"] = _price(0, 3.459)
+    assert price_history.ingest(stations) == 0
+    price_history.close()
+
+
+def test_queries_a_station_over_a_time_range(tmp_path):
+    price_history = PriceHistory(str(tmp_path / "history.sqlite3"))
+    for day, price in enumerate((3.5, 3.6, 3.55, 3.7)):
+        price_history.ingest([_station("A", "WA", _price(day * _ms_per_day, price))])
+    station_key = merge.station_key(_station("A", "WA", None))
+    assert price_history.station_prices(
+        station_key, "regularPrice", _ms_per_day, 3 * _ms_per_day
+    ) == [(_ms_per_day, 3.6), (2 * _ms_per_day, 3.55)]
+    assert price_history.station_prices(station_key, "dieselPrice", 0, _ms_per_day) == []
+    price_history.close()
+
+
+def test_averages_a_state_per_bucket(tmp_path):
+    price_history = PriceHistory(str(tmp_path / "history.sqlite3"))
+    price_history.ingest(
+        [
+            _station("A", "WA", _price(0, 3.0)),
+            _station("B", "WA", _price(3_600_000, 4.0)),
+            _station("C", "OR", _price(0, 9.0)),
+        ]
+    )
+    price_history.ingest([_station("A", "WA", _price(_ms_per_day, 3.5))])
+    assert price_history.state_average(
+        "WA", "regularPrice", 0, 2 * _ms_per_day
+    ) == [(0, 3.5, 2), (_ms_per_day, 3.5, 1)]
+    # Re-opening the file keeps the stations' IDs
+    price_history.close()
+    price_history = PriceHistory(str(tmp_path / "history.sqlite3"))
+    assert price_history.ingest([_station("A", "WA", _price(2 * _ms_per_day, 3.4))]) == 1
+    assert price_history.state_average(
+        "WA", "regularPrice", _ms_per_day, 3 * _ms_per_day
+    ) == [(_ms_per_day, 3.5, 1), (2 * _ms_per_day, 3.4, 1)]
+    price_history.close()
@@ -0,0 +1,63 @@
+import costco
+import helpers
+import journal
+from multiprocessing import Pool
+import sys
+import time
+
+
+_localtime = time.localtime
+
+
+def test_a_restarted_run_has_the_same_default_id(monkeypatch):
+    monkeypatch.delenv("CLOUD_RUN_EXECUTION", raising=False)
+    started_at = time.mktime((2026, 10, 17, 9, 0, 0, 0, 0, -1))
+    monkeypatch.setattr(time, "localtime", lambda: _localtime(started_at))
+    run_id = journal.default_run_id()
+    # Restarted hours later
+    monkeypatch.setattr(time, "localtime", lambda: _localtime(started_at + 8 * 3600))
+    assert journal.default_run_id() == run_id
+    monkeypatch.setenv("CLOUD_RUN_EXECUTION", "scraper-abc12")
+    assert journal.default_run_id() == "scraper-abc12"
+
+
+def test_reuses_only_results_of_the_same_run(tmp_path):
+    db_file_name = str(tmp_path / "journal.sqlite3")
+    run_journal = journal.RunJournal(db_file_name, "run-1", freshness_s=3600)
+    run_journal.record("https://example.com/1", {"name": "1"})
+    run_journal.close()
+    assert journal.RunJournal(db_file_name, "run-1", 3600).fresh_results() == {
+        "https://example.com/1": {"name": "1"}
+    }
+    assert journal.RunJournal(db_file_name, "run-2", 3600).fresh_results() == {}
+
+
+def _collect(monkeypatch, pool, run_id: str, limit: int | None = None) -> list:
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["scraper.py", "--run-journal", "journal.sqlite3", "--run-id", run_id],
+    )
+    stations = []
+    collector = costco.collect_stations(helpers.parse_command_args(), pool)
+    for station in collector:
+        stations.append(station)
+        if len(stations) == limit:
+            # Stop partway through, like a run that dies
+            collector.close()
+    return stations
+
+
+def test_resumes_an_interrupted_run(costco_site, monkeypatch):
+    with Pool(2) as pool:
+        interrupted = _collect(monkeypatch, pool, "run-1", limit=4)
+        resumed = _collect(monkeypatch, pool, "run-1")
+        new_run = _collect(monkeypatch, pool, "run-2")
+    assert len(interrupted) == 4
+    assert len(resumed) == len(costco_site.url_objects)
+    assert len({station["name"] for station in resumed}) == len(costco_site.url_objects)
+    # The interrupted run's results are reused as they were, rather than being
+    # fetched again with new timestamps
+    for station in interrupted:
+        assert station in resumed
+    assert not any(station in new_run for station in resumed)
@@ -0,0 +1,51 @@
+import json
+import jsonstream
+import pytest
+
+
+_document = json.dumps(
+    [
+        {"name": "Café", "gasPrices": [{"name": "UNLEAD", "price": 3.459}]},
+        4.5,
+        -12e3,
+        "[not, an, array]",
+        [],
+        None,
+    ],
+    ensure_ascii=False,
+).encode("utf-8")
+
+
+def _chunked(data, size: int) -> list:
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64])
+def test_yields_the_same_items_however_the_document_is_chunked(chunk_size):
+    expected = json.loads(_document)
+    assert list(jsonstream.iter_array_items(_chunked(_document, chunk_size))) == expected
+    assert (
+        list(jsonstream.iter_array_items(_chunked(_document.decode(), chunk_size)))
+        == expected
+    )
+    assert list(jsonstream.iter_array_items([b" [ ] "])) == []
+
+
+def test_yields_an_item_before_the_rest_has_arrived():
+    def chunks():
+        yield b'[{"id": 1}, {"id":'
+        raise AssertionError("Read past the first item")
+
+    assert next(jsonstream.iter_array_items(chunks())) == {"id": 1}
+
+
+def test_raises_with_the_value_of_a_document_that_isnt_an_array():
+    with pytest.raises(jsonstream.NotAJsonArrayError) as error_info:
+        list(jsonstream.iter_array_items([b'{"error": "bl', b'ocked"}']))
+    assert error_info.value.value == {"error": "blocked"}
+
+
+@pytest.mark.parametrize("document", [b'[{"id": 1}, {"id"', b"[1, 2", b"[1 2]"])
+def test_raises_on_malformed_arrays(document):
+    with pytest.raises(json.JSONDecodeError):
+        list(jsonstream.iter_array_items(_chunked(document, 3)))
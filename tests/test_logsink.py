@@ -0,0 +1,62 @@
+import io
+import logging
+import logsink
+from loguru import logger
+import time
+from types import SimpleNamespace
+
+
+def test_queued_sink_writes_every_record_in_order():
+    stream = io.StringIO()
+    sink = logsink.QueuedSink(stream)
+    handler_id = logger.add(sink, format="{message}")
+    try:
+        for i in range(1000):
+            logger.info("record {i}", i=i)
+        sink.complete()
+        assert stream.getvalue() == "".join(
+            "record {i}\n".format(i=i) for i in range(1000)
+        )
+    finally:
+        logger.remove(handler_id)
+        sink.stop()
+
+
+def _record(level_no: int, url: str | None = None, line: int = 1) -> dict:
+    return {
+        "level": SimpleNamespace(no=level_no),
+        "extra": {} if url is None else {"url": url},
+        "name": "costco",
+        "line": line,
+        "message": "Message",
+    }
+
+
+def test_samples_the_same_urls_at_every_level_below_warning():
+    log_filter = logsink.LogFilter(sample_rate=0.25)
+    urls = ["https://example.com/{i}".format(i=i) for i in range(1000)]
+    sampled = [url for url in urls if log_filter(_record(logging.INFO, url))]
+    assert 150 < len(sampled) < 350
+    assert sampled == [url for url in urls if log_filter(_record(logging.DEBUG, url))]
+    assert log_filter(_record(logging.INFO))
+    assert all(log_filter(_record(logging.WARNING, url)) for url in urls)
+
+
+def test_limits_warnings_per_line_per_minute(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    log_filter = logsink.LogFilter(max_warnings_per_minute=2)
+    assert [log_filter(_record(logging.WARNING)) for _ in range(5)] == [
+        True,
+        True,
+        False,
+        False,
+        False,
+    ]
+    # Other lines and errors have limits of their own
+    assert log_filter(_record(logging.WARNING, line=2))
+    assert log_filter(_record(logging.ERROR))
+    now[0] = 60.0
+    record = _record(logging.WARNING)
+    assert log_filter(record)
+    assert record["message"] == "Message (3 similar warnings dropped)"
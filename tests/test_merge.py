@@ -0,0 +1,94 @@
+import merge
+
+
+def _station(i: int, regular_price: float | None) -> dict:
+    return {
+        "franchiseName": "Costco",
+        "name": "Station {i}".format(i=i),
+        "streetAddress": "{i} Synthetic Way".format(i=i),
+        "city": "Synthetic",
+        "state": "CA",
+        "postalCode": "00000",
+        "latitude": 0.0,
+        "longitude": 0.0,
+        "currencySymbol": "$",
+        "regularPrice": (
+            None
+            if regular_price is None
+            else {"timestamp": 1_700_000_000_000, "price": regular_price}
+        ),
+        "midGradePrice": None,
+        "premiumPrice": None,
+        "dieselPrice": None,
+    }
+
+
+def test_matches_reordered_stations_by_key():
+    curr_prices = [_station(1, 4.5), _station(2, 4.6), _station(3, 4.7)]
+    new_prices = [_station(3, 4.8), _station(1, 4.5), _station(2, None)]
+    result = merge.merge_prices_by_key(curr_prices, new_prices)
+    assert [station["name"] for station in result.merged] == [
+        "Station 3",
+        "Station 1",
+        "Station 2",
+    ]
+    assert [station["regularPrice"]["price"] for station in result.merged] == [
+        4.8,
+        4.5,
+        # A missing new price keeps the current one
+        4.6,
+    ]
+    assert result.added == []
+    assert result.removed == []
+    assert result.changed == [merge.station_key(_station(3, None))]
+    assert result.unchanged == [
+        merge.station_key(_station(1, None)),
+        merge.station_key(_station(2, None)),
+    ]
+
+
+def test_adds_inserted_stations():
+    curr_prices = [_station(1, 4.5), _station(3, 4.7)]
+    new_prices = [_station(1, 4.5), _station(2, 4.6), _station(3, 4.7)]
+    result = merge.merge_prices_by_key(curr_prices, new_prices)
+    assert result.merged == new_prices
+    assert result.added == [merge.station_key(_station(2, None))]
+    assert result.removed == []
+    assert len(result.unchanged) == 2
+
+
+def test_drops_removed_stations():
+    curr_prices = [_station(1, 4.5), _station(2, 4.6), _station(3, 4.7)]
+    new_prices = [_station(1, 4.5), _station(3, 4.9)]
+    result = merge.merge_prices_by_key(curr_prices, new_prices)
+    assert result.merged == new_prices
+    assert result.added == []
+    assert result.removed == [merge.station_key(_station(2, None))]
+    assert result.unchanged == [merge.station_key(_station(1, None))]
+
+
+def test_matches_stations_whose_address_punctuation_changed():
+    curr_station = _station(1, 4.5)
+    new_station = {
+        **_station(1, 4.6),
+        "streetAddress": "1  synthetic way.",
+        "city": "SYNTHETIC",
+    }
+    result = merge.merge_prices_by_key([curr_station], [new_station])
+    assert result.added == []
+    assert result.removed == []
+    assert result.merged[0]["regularPrice"]["price"] == 4.6
+
+
+def test_keeps_the_current_record_of_stations_with_the_same_prices():
+    curr_station = _station(1, 4.5)
+    reobserved = _station(1, 4.5)
+    reobserved["regularPrice"]["timestamp"] += 3_600_000
+    renamed = {**_station(2, 4.6), "name": "Renamed"}
+    result = merge.merge_prices_by_key(
+        [curr_station, _station(2, 4.6)], [reobserved, renamed]
+    )
+    assert result.merged[0] is curr_station
+    assert result.merged[1] == renamed
+    assert result.unchanged == [merge.station_key(curr_station)]
+    assert result.changed == [merge.station_key(renamed)]
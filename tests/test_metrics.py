@@ -0,0 +1,57 @@
+import json
+import metrics
+import pytest
+
+
+def test_histogram_summary_has_exact_quantiles():
+    histogram = metrics.Histogram()
+    assert histogram.summary() == {"count": 0, "sum": 0.0}
+    for value in range(100, 0, -1):
+        histogram.observe(value)
+    assert histogram.summary() == {
+        "count": 100,
+        "sum": 5050.0,
+        "min": 1,
+        "max": 100,
+        "p50": 50,
+        "p95": 95,
+        "p99": 99,
+    }
+
+
+def test_reports_every_metric(tmp_path):
+    run_metrics = metrics.RunMetrics()
+    run_metrics.observe("fetch_seconds", 0.5)
+    run_metrics.observe("fetch_seconds", 1.5)
+    run_metrics.increment("costco_stations", 3)
+    run_metrics.increment("costco_stations")
+    run_metrics.set_gauge("costco_pool_utilization", 0.75)
+    with pytest.raises(RuntimeError):
+        with run_metrics.span("publish"):
+            raise RuntimeError
+    assert run_metrics.total("fetch_seconds") == 2.0
+    assert run_metrics.total("missing_seconds") == 0.0
+
+    report = run_metrics.report()
+    assert report["histograms"]["fetch_seconds"]["p50"] == 0.5
+    assert report["histograms"]["publish_seconds"]["count"] == 1
+    assert report["counters"] == {"costco_stations": 4}
+    assert report["gauges"] == {"costco_pool_utilization": 0.75}
+
+    prometheus = run_metrics.to_prometheus().splitlines()
+    assert "# TYPE gas_scraper_fetch_seconds summary" in prometheus
+    assert 'gas_scraper_fetch_seconds{quantile="0.99"} 1.5' in prometheus
+    assert "gas_scraper_fetch_seconds_count 2" in prometheus
+    assert "gas_scraper_costco_stations_total 4" in prometheus
+    assert "gas_scraper_costco_pool_utilization 0.75" in prometheus
+
+    run_metrics.write_report(str(tmp_path / "report"))
+    with open(tmp_path / "report.json") as report_file:
+        assert json.loads(report_file.read())["counters"] == report["counters"]
+    assert (tmp_path / "report.prom").read_text() == run_metrics.to_prometheus()
+
+
+def test_peak_rss_is_in_mb():
+    peak_rss_mb = metrics.peak_rss_mb()
+    assert 1 <= peak_rss_mb["self"] < 1 << 20
+    assert peak_rss_mb["children"] >= 0
@@ -0,0 +1,47 @@
+import normalize
+import pytest
+
+
+def _batch(price_texts: list) -> list:
+    # Large enough to be normalized with NumPy, if it's installed
+    return price_texts * normalize._numpy_min_batch_size
+
+
+@pytest.mark.parametrize(
+    "price_text, price",
+    [
+        ("$3.459", 3.45),
+        ("3.459", 3.45),
+        (3.459, 3.45),
+        ("$4", 4.0),
+        (" $5.1 ", 5.1),
+        ("$12.09", 12.09),
+    ],
+)
+def test_normalizes_batches_like_single_prices(price_text, price):
+    assert normalize.normalize_prices([price_text]) == [price]
+    assert normalize.normalize_prices(_batch([price_text, "$1.00"])) == _batch(
+        [price, 1.0]
+    )
+
+
+def test_converts_per_liter_prices_to_per_gallon():
+    assert normalize.normalize_prices(["$1.00"], per_liter=True) == [3.79]
+    assert normalize.normalize_prices(
+        _batch(["$1.00", "$1.00"]), per_liter=_batch([True, False])
+    ) == _batch([3.79, 1.0])
+
+
+def test_keeps_missing_prices_missing():
+    assert normalize.normalize_prices(_batch([None, "$2.50"])) == _batch([None, 2.5])
+
+
+@pytest.mark.parametrize(
+    "price_text",
+    ["N/A", "€3.45", "$3.4.5", "3.45.6", "3,45", "", "$", ".45", "3\x004", "-3.45"],
+)
+def test_rejects_prices_that_are_not_numbers(price_text):
+    with pytest.raises(ValueError):
+        normalize.price_text_to_cents(price_text)
+    with pytest.raises(ValueError):
+        normalize.normalize_prices(_batch(["$1.00", price_text]))
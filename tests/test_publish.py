@@ -0,0 +1,102 @@
+from dbrepo import DbRepo
+import json
+import publish
+import pytest
+import subprocess
+
+
+def _git(*git_args: str, cwd: str) -> str:
+    return subprocess.run(
+        ["git", *git_args], cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def _station(i: int, regular_price: float) -> dict:
+    return {
+        "franchiseName": "Costco",
+        "name": "Station {i}".format(i=i),
+        "streetAddress": "{i} Synthetic Way".format(i=i),
+        "city": "Synthetic",
+        "state": ("CA", "WA")[i % 2],
+        "postalCode": "00000",
+        "latitude": 0.0,
+        "longitude": 0.0,
+        "currencySymbol": "$",
+        "regularPrice": {"timestamp": 1_700_000_000_000, "price": regular_price},
+        "midGradePrice": None,
+        "premiumPrice": None,
+        "dieselPrice": None,
+    }
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    """
+    A bare repo standing in for the pricing DB repo, with one commit on main.
+    """
+    for variable in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv("GIT_{variable}_NAME".format(variable=variable), "Test")
+        monkeypatch.setenv(
+            "GIT_{variable}_EMAIL".format(variable=variable), "test@example.com"
+        )
+    remote_dir = str(tmp_path / "remote.git")
+    seed_dir = str(tmp_path / "seed")
+    _git("init", "--bare", "--initial-branch=main", remote_dir, cwd=str(tmp_path))
+    _git("clone", remote_dir, seed_dir, cwd=str(tmp_path))
+    with open(tmp_path / "seed" / "README.md", "w") as readme_file:
+        readme_file.write("Pricing DB\n")
+    _git("add", "README.md", cwd=seed_dir)
+    _git("commit", "-m", "Initial commit", cwd=seed_dir)
+    _git("push", "origin", "HEAD:main", cwd=seed_dir)
+    return remote_dir
+
+
+@pytest.fixture
+def db_repo(remote, tmp_path):
+    return DbRepo(remote, str(tmp_path / "clone"))
+
+
+def test_commits_prices_and_shards_with_a_tag(remote, db_repo):
+    prices = [_station(1, 4.5), _station(2, 4.6)]
+    assert publish.publish_prices(prices, db_repo, "2026-10-17", shard_by="state")
+    assert _git("ls-tree", "-r", "--name-only", "main", cwd=remote).split() == [
+        "README.md",
+        "prices.json",
+        "shards/CA.json",
+        "shards/WA.json",
+        "shards/manifest.json",
+    ]
+    assert json.loads(_git("show", "main:prices.json", cwd=remote)) == prices
+    assert json.loads(_git("show", "main:shards/CA.json", cwd=remote)) == [
+        _station(2, 4.6)
+    ]
+    assert _git("rev-parse", "2026-10-17^{commit}", cwd=remote) == _git(
+        "rev-parse", "main", cwd=remote
+    )
+
+
+def test_skips_the_commit_when_nothing_changed(remote, db_repo):
+    assert publish.publish_prices([_station(1, 4.5)], db_repo, "2026-10-17")
+    published_head = _git("rev-parse", "main", cwd=remote)
+    # Re-observing the same price only changes its timestamp
+    reobserved = _station(1, 4.5)
+    reobserved["regularPrice"]["timestamp"] += 3_600_000
+    assert not publish.publish_prices([reobserved], db_repo, "2026-10-18")
+    assert _git("rev-parse", "main", cwd=remote) == published_head
+    assert _git("tag", "--list", cwd=remote) == "2026-10-17"
+    # The existing clone was brought up to date rather than cloned again
+    assert "fetch" in db_repo.timings
+
+
+def test_pushes_the_branch_and_tag_atomically(remote, db_repo, tmp_path):
+    # Reject updates to branches, but not to tags
+    hook_file_name = tmp_path / "remote.git" / "hooks" / "update"
+    hook_file_name.write_text(
+        '#!/bin/sh\ncase "$1" in refs/heads/*) exit 1 ;; esac\nexit 0\n'
+    )
+    hook_file_name.chmod(0o755)
+    published_head = _git("rev-parse", "main", cwd=remote)
+    with pytest.raises(RuntimeError):
+        publish.publish_prices([_station(1, 4.5)], db_repo, "2026-10-17")
+    assert _git("rev-parse", "main", cwd=remote) == published_head
+    assert _git("tag", "--list", cwd=remote) == ""
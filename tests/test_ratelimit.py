@@ -0,0 +1,37 @@
+import asyncio
+import ratelimit
+
+
+def _respond(controller, status_code: int) -> None:
+    async def request():
+        started_at = await controller.acquire()
+        await controller.release(started_at, status_code)
+
+    asyncio.run(request())
+
+
+def test_rate_probes_above_the_initial_rate_up_to_the_max():
+    controller = ratelimit.HostRateController(
+        "example.com", 8, 4, 5, initial_rate_per_s=5
+    )
+    for _ in range(5):
+        controller._on_success()
+    assert 5 < controller.bucket.rate_per_s < 8
+    for _ in range(100):
+        controller._on_success()
+    assert controller.bucket.rate_per_s == 8
+
+
+def test_429_halves_the_rate():
+    controller = ratelimit.HostRateController(
+        "example.com", 8, 4, 5, initial_rate_per_s=8
+    )
+    controller._on_throttled(controller._last_decrease, 0)
+    assert controller.bucket.rate_per_s == 4
+    assert not controller.gave_up
+
+
+def test_403_gives_up_on_the_host():
+    controller = ratelimit.HostRateController("example.com", 8, 4, 5)
+    _respond(controller, 403)
+    assert controller.gave_up
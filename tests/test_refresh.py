@@ -0,0 +1,79 @@
+import merge
+import refresh
+
+
+_ms_per_hour = 3_600_000
+
+
+def _history(last_fetched_at: int, change_count: int) -> dict:
+    return {
+        "fetchCount": change_count + 1,
+        "changeCount": change_count,
+        "firstFetchedAt": 0,
+        "lastFetchedAt": last_fetched_at,
+        "prices": [],
+        "station": {},
+    }
+
+
+def test_fetches_everything_without_a_budget():
+    histories = {"a": _history(0, 0)}
+    plan = refresh.plan_refresh(["a", "b"], histories, None, _ms_per_hour)
+    assert plan == refresh.RefreshPlan(to_fetch=["b", "a"], to_reuse=[], deferred=[])
+
+
+def test_fetches_unknown_then_likely_changed_stations_within_the_budget():
+    now_ms = 48 * _ms_per_hour
+    histories = {
+        "just-fetched": _history(47 * _ms_per_hour, 0),
+        "long-unfetched": _history(0, 0),
+    }
+    plan = refresh.plan_refresh(
+        ["just-fetched", "new", "long-unfetched"], histories, 2, now_ms
+    )
+    assert plan == refresh.RefreshPlan(
+        to_fetch=["new", "long-unfetched"], to_reuse=["just-fetched"], deferred=[]
+    )
+
+
+def test_unknown_stations_count_against_the_budget():
+    histories = {"known": _history(0, 0)}
+    plan = refresh.plan_refresh(
+        ["new-1", "known", "new-2", "new-3"], histories, 2, _ms_per_hour
+    )
+    assert plan == refresh.RefreshPlan(
+        to_fetch=["new-1", "new-2"], to_reuse=["known"], deferred=["new-3"]
+    )
+
+
+def _station(*prices) -> dict:
+    return {
+        price_key: None if price is None else {"timestamp": timestamp, "price": price}
+        for price_key, (timestamp, price) in zip(merge.price_keys, prices)
+    }
+
+
+def test_doesnt_record_a_fetch_without_prices():
+    histories = {}
+    assert not refresh.record_fetch(
+        histories, "a", _station(*[(0, None)] * 4), _ms_per_hour
+    )
+    assert histories == {}
+    refresh.record_fetch(histories, "a", _station(*[(0, 3.5)] * 4), _ms_per_hour)
+    assert not refresh.record_fetch(
+        histories, "a", _station(*[(0, None)] * 4), 2 * _ms_per_hour
+    )
+    assert histories["a"]["changeCount"] == 0
+    assert histories["a"]["lastFetchedAt"] == _ms_per_hour
+    assert refresh.record_fetch(
+        histories, "a", _station(*[(0, 3.6)] * 4), 3 * _ms_per_hour
+    )
+
+
+def test_seeds_a_history_from_the_latest_published_price():
+    station = _station((2, 3.5), (5, 3.9), (0, None), (1, 4.1))
+    history = refresh.seed_history(station)
+    assert history["firstFetchedAt"] == history["lastFetchedAt"] == 5
+    assert history["prices"] == [3.5, 3.9, None, 4.1]
+    assert history["station"] is station
+    assert refresh.seed_history(_station(*[(0, None)] * 4)) is None
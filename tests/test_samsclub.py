@@ -0,0 +1,30 @@
+import samsclub
+import stubserver
+
+
+def test_falls_back_to_the_browser_when_the_direct_request_times_out(
+    tmp_path, monkeypatch
+):
+    (tmp_path / "club-finder").write_text("<html>Club finder</html>")
+    (tmp_path / "clubfinder").write_text("[]")
+    server = stubserver.start_stub_server(str(tmp_path), latency_s=0.5)
+    browser_urls = []
+
+    def get_details_blob_with_browser(url: str) -> str:
+        browser_urls.append(url)
+        return '[{"name": "Club"}]'
+
+    monkeypatch.setattr(
+        samsclub, "_samsclub_club_finder_url", server.base_url + "/club-finder"
+    )
+    monkeypatch.setattr(samsclub, "_direct_request_timeout_s", 0.1)
+    monkeypatch.setattr(
+        samsclub, "_get_details_blob_with_browser", get_details_blob_with_browser
+    )
+    try:
+        url = server.base_url + "/api/clubfinder"
+        assert samsclub._open_details_stream_directly(url) is None
+        assert list(samsclub._iter_details(url, "auto")) == [{"name": "Club"}]
+        assert browser_urls == [url]
+    finally:
+        server.shutdown()
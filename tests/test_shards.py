@@ -0,0 +1,81 @@
+import json
+import os
+import shards
+
+
+def _station(name: str, state: str, latitude, longitude, regular_price: float) -> dict:
+    return {
+        "franchiseName": "COSTCO",
+        "name": name,
+        "streetAddress": "1 {name} St".format(name=name),
+        "city": name,
+        "state": state,
+        "postalCode": "00000",
+        "latitude": latitude,
+        "longitude": longitude,
+        "regularPrice": {"timestamp": 0, "price": regular_price},
+        "midGradePrice": None,
+        "premiumPrice": None,
+        "dieselPrice": None,
+    }
+
+
+def test_geohash():
+    assert shards.geohash(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert shards.geohash(47.6, -122.3, 2) == "c2"
+
+
+def test_rewrites_only_changed_shards(tmp_path):
+    shards_dir = str(tmp_path / "shards")
+    prices = [
+        _station("Seattle", "WA", 47.6, -122.3, 3.9),
+        _station("Spokane", "WA", 47.7, -117.4, 3.8),
+        _station("Portland", "OR", 45.5, -122.7, 4.1),
+    ]
+    result = shards.write_shards(shards_dir, prices, "state")
+    assert result == shards.ShardWriteResult(
+        written=["OR", "WA"], removed=[], unchanged=[]
+    )
+    manifest = shards.read_manifest(shards_dir)
+    assert manifest["shards"]["WA"]["stationCount"] == 2
+    with open(os.path.join(shards_dir, "WA.json")) as shard_file:
+        assert json.loads(shard_file.read()) == [prices[0], prices[1]]
+
+    # Nothing changed, so neither the shards nor the manifest are rewritten
+    manifest_mtime_ns = os.stat(os.path.join(shards_dir, "manifest.json")).st_mtime_ns
+    wa_mtime_ns = os.stat(os.path.join(shards_dir, "WA.json")).st_mtime_ns
+    result = shards.write_shards(shards_dir, list(reversed(prices)), "state")
+    assert result.is_empty
+    assert result.unchanged == ["OR", "WA"]
+    assert (
+        os.stat(os.path.join(shards_dir, "manifest.json")).st_mtime_ns
+        == manifest_mtime_ns
+    )
+
+    prices[2]["regularPrice"]["price"] = 4.2
+    result = shards.write_shards(shards_dir, prices, "state")
+    assert result == shards.ShardWriteResult(
+        written=["OR"], removed=[], unchanged=["WA"]
+    )
+    assert os.stat(os.path.join(shards_dir, "WA.json")).st_mtime_ns == wa_mtime_ns
+    assert shards.read_manifest(shards_dir)["shards"]["WA"] == manifest["shards"]["WA"]
+
+    result = shards.write_shards(shards_dir, prices[:2], "state")
+    assert result.removed == ["OR"]
+    assert not os.path.exists(os.path.join(shards_dir, "OR.json"))
+
+
+def test_changing_how_prices_are_sharded_rewrites_every_shard(tmp_path):
+    shards_dir = str(tmp_path / "shards")
+    prices = [
+        _station("Seattle", "WA", 47.6, -122.3, 3.9),
+        _station("Nowhere", "WA", None, None, 3.8),
+    ]
+    shards.write_shards(shards_dir, prices, "state")
+    result = shards.write_shards(shards_dir, prices, "geohash", geohash_precision=2)
+    assert result == shards.ShardWriteResult(
+        written=["c2", "unplaced"], removed=["WA"], unchanged=[]
+    )
+    result = shards.write_shards(shards_dir, prices, "geohash", geohash_precision=3)
+    assert result.written == ["c23", "unplaced"]
+    assert shards.read_manifest(shards_dir)["geohashPrecision"] == 3
@@ -0,0 +1,76 @@
+import math
+import random
+import spatial
+
+
+def _random_points(rng: random.Random, count: int, dims: int) -> list:
+    return [tuple(rng.uniform(-10, 10) for _ in range(dims)) for _ in range(count)]
+
+
+def _squared_distance(a: tuple, b: tuple) -> float:
+    return sum((x - y) * (x - y) for x, y in zip(a, b))
+
+
+def test_kd_tree_queries_match_brute_force():
+    rng = random.Random(0)
+    points = _random_points(rng, 500, 3)
+    tree = spatial.KDTree(points)
+    for point in _random_points(rng, 20, 3):
+        by_distance = sorted(
+            (_squared_distance(p, point), i) for i, p in enumerate(points)
+        )
+        assert tree.nearest(point, 7) == by_distance[:7]
+        assert tree.within_radius(point, 4) == [
+            (squared_distance, i)
+            for squared_distance, i in by_distance
+            if squared_distance <= 16
+        ]
+        low = tuple(value - 3 for value in point)
+        high = tuple(value + 3 for value in point)
+        assert sorted(tree.within_box(low, high)) == [
+            i
+            for i, p in enumerate(points)
+            if all(lo <= value <= hi for lo, value, hi in zip(low, p, high))
+        ]
+    assert tree.nearest(points[0], 0) == []
+    assert len(tree.nearest(points[0], 1000)) == len(points)
+
+
+def _station(name: str, latitude, longitude, regular_price=None) -> dict:
+    return {
+        "name": name,
+        "latitude": latitude,
+        "longitude": longitude,
+        "regularPrice": (
+            None if regular_price is None else {"timestamp": 0, "price": regular_price}
+        ),
+        "midGradePrice": None,
+        "premiumPrice": None,
+        "dieselPrice": None,
+    }
+
+
+def test_station_index_queries_across_the_antimeridian():
+    stations = [
+        _station("Fiji", -17.7, 178.0, 5.1),
+        _station("Samoa", -13.8, -172.1, 4.9),
+        _station("Seattle", 47.6, -122.3, 3.9),
+        _station("Unknown", None, None),
+    ]
+    index = spatial.StationIndex(stations)
+    assert len(index) == 3
+    (distance_km, nearest), (_, next_nearest) = index.nearest(-15.0, 179.9, k=2)
+    assert nearest["name"] == "Fiji"
+    assert next_nearest["name"] == "Samoa"
+    assert math.isclose(
+        distance_km, spatial.great_circle_km(-15.0, 179.9, -17.7, 178.0)
+    )
+    assert [
+        station["name"] for _, station in index.within_radius(-15.0, 179.9, 1500)
+    ] == ["Fiji", "Samoa"]
+    assert sorted(
+        station["name"] for station in index.within_bbox(-20, 170, -10, -170)
+    ) == ["Fiji", "Samoa"]
+    cheapest = spatial.cheapest_by_grade(index.within_bbox(-20, 170, -10, -170))
+    assert cheapest["regularPrice"]["name"] == "Samoa"
+    assert cheapest["dieselPrice"] is None
@@ -0,0 +1,36 @@
+import pytest
+import serializers
+from store import StationPriceStore
+
+
+def _station(latitude: float | None, longitude: float | None) -> dict:
+    return {
+        "franchiseName": "Costco",
+        "name": "Synthetic (Costco)",
+        "streetAddress": "1 Synthetic Way",
+        "city": "Synthetic",
+        "state": "CA",
+        "postalCode": "00000",
+        "latitude": latitude,
+        "longitude": longitude,
+        "currencySymbol": "$",
+        "regularPrice": {"timestamp": 1_700_000_000_000, "price": 4.599},
+        "midGradePrice": None,
+        "premiumPrice": {"timestamp": 1_700_000_000_000, "price": None},
+        "dieselPrice": None,
+    }
+
+
+@pytest.mark.parametrize(
+    "station",
+    [_station(37.5, -122.25), _station(None, None), _station(37.5, None)],
+)
+def test_round_trips_stations(station):
+    assert StationPriceStore.from_records([station]).to_records() == [station]
+
+
+@pytest.mark.parametrize("format_name", sorted(serializers.serializers))
+def test_serializers_round_trip_unknown_coordinates(format_name):
+    serializer = serializers.serializers[format_name]
+    stations = [_station(None, None), _station(37.5, -122.25)]
+    assert serializer.decode(serializer.encode(stations)) == stations
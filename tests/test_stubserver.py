@@ -0,0 +1,89 @@
+import costco
+import extract
+import pytest
+import requests
+import stubserver
+import time
+
+
+@pytest.fixture
+def pages_dir(tmp_path):
+    (tmp_path / "page.html").write_text("<html>Page</html>")
+    (tmp_path / "clubfinder").write_text('[{"id": "1"}]')
+    return tmp_path
+
+
+@pytest.fixture
+def start_server(pages_dir):
+    servers = []
+
+    def start(**kwargs) -> stubserver.StubServer:
+        server = stubserver.start_stub_server(str(pages_dir), **kwargs)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def test_serves_pages_by_name_with_an_etag(start_server):
+    server = start_server()
+    resp = requests.get(server.base_url + "/warehouse-locations/page.html")
+    assert resp.status_code == 200
+    assert resp.text == "<html>Page</html>"
+    assert resp.headers["Content-Type"] == "text/html; charset=utf-8"
+    assert resp.headers["ETag"]
+    resp = requests.get(server.base_url + "/api/clubfinder")
+    assert resp.json() == [{"id": "1"}]
+    assert resp.headers["Content-Type"] == "application/json"
+    assert requests.get(server.base_url + "/missing.html").status_code == 404
+    assert server.request_count == 3
+
+
+def test_responds_not_modified_to_a_matching_etag(start_server):
+    server = start_server()
+    url = server.base_url + "/page.html"
+    etag = requests.get(url).headers["ETag"]
+    resp = requests.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.content == b""
+    resp = requests.get(url, headers={"If-None-Match": '"stale"'})
+    assert resp.status_code == 200
+
+
+def test_throttles_requests_over_the_rate_limit(start_server):
+    server = start_server(max_rate_per_s=2)
+    status_codes = [
+        requests.get(server.base_url + "/page.html").status_code for _ in range(4)
+    ]
+    assert status_codes == [200, 200, 429, 429]
+    assert server.throttled_count == 2
+    resp = requests.get(server.base_url + "/page.html")
+    assert resp.headers["Retry-After"] == "1"
+
+
+def test_injects_errors_and_latency(start_server):
+    server = start_server(error_rate=1, latency_s=0.05)
+    start = time.perf_counter()
+    resp = requests.get(server.base_url + "/page.html")
+    assert time.perf_counter() - start >= 0.05
+    assert resp.status_code == 503
+    assert server.error_count == 1
+
+
+def test_responds_with_configured_status_codes(start_server):
+    server = start_server(status_codes={"page.html": 403})
+    assert requests.get(server.base_url + "/page.html").status_code == 403
+    assert requests.get(server.base_url + "/clubfinder").status_code == 200
+
+
+@pytest.mark.parametrize("extractor", sorted(extract.backends))
+def test_serves_synthetic_warehouse_pages_with_readable_prices(costco_site, extractor):
+    for url_object in costco_site.url_objects:
+        page = requests.get(url_object["url"]).text
+        station = costco.normalize_html(url_object, page, extractor)
+        # Synthetic prices start at $3, or more per gallon for Puerto Rico's per
+        # liter prices
+        assert station["regularPrice"]["price"] >= 3
+        assert station["premiumPrice"]["price"] >= 3